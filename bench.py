@@ -0,0 +1,334 @@
+#! encoding = utf-8
+
+'''
+Benchmarks of the dimer literature database on synthetic databases.
+
+    python bench.py --scale small --scale medium -o bench_output.txt
+    python bench.py --compare old_output.txt -o bench_output.txt
+
+Each scale generates a database with a skewed (Zipf) pair distribution,
+then times the database core and, if PyQt5 is available, the GUI on the
+offscreen Qt platform. Results are written as JSON; --compare prints the
+timings that got slower than in a previous result file.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from itertools import accumulate
+
+import mylib
+
+# name -> (number of molecules, number of records)
+SCALES = {
+    'small': (1000, 10000),
+    'medium': (1000, 100000),
+    'large': (10000, 1000000),
+}
+# Zipf exponent of the molecule popularity
+SKEW = 1.1
+LIT_TYPE_WEIGHTS = [4, 2, 3, 1]     # of mylib.DEFAULT_LIT_TYPES
+
+
+def gen_records(n_mols, n_records, seed=0):
+    ''' Generate synthetic records: a few popular molecules appear in
+    most pairs, like Ar or H2O do in the real literature.
+
+    Yields
+    (mol1, mol2, lit_type, year, bibkey, note)
+    '''
+
+    rnd = random.Random(seed)
+    mols = ['M{:05d}'.format(i) for i in range(n_mols)]
+    cum_weights = list(accumulate(1 / (i + 1) ** SKEW for i in range(n_mols)))
+    lit_cum_weights = list(accumulate(LIT_TYPE_WEIGHTS))
+
+    for k in range(n_records):
+        mol1, mol2 = rnd.choices(mols, cum_weights=cum_weights, k=2)
+        lit_type = rnd.choices(mylib.DEFAULT_LIT_TYPES, cum_weights=lit_cum_weights)[0]
+        year = rnd.randint(1970, 2024)
+        yield (mol1, mol2, lit_type, year, 'Syn{:07d}{:d}'.format(k, year), 'tunneling splitting {:d}'.format(k % 97))
+
+
+def gen_db(db_name, n_mols, n_records, seed=0):
+    ''' Create a synthetic database.
+
+    Returns
+    stats -- dict, see mylib.import_records
+    '''
+
+    mylib.create_db(db_name)
+    conn = mylib.connect(db_name)
+    try:
+        return mylib.import_records(conn.cursor(), gen_records(n_mols, n_records, seed))
+    finally:
+        conn.close()
+
+
+def timeit(func, repeat=1):
+    ''' Best wall time of func() over repeat runs, in seconds '''
+
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+
+    return best
+
+
+def top_molecule(cursor):
+    ''' name of the molecule with the most records '''
+
+    r = cursor.execute("SELECT m.name FROM lit JOIN molecule AS m ON m.id = lit.mol1 GROUP BY lit.mol1 ORDER BY count(*) DESC LIMIT 1")
+
+    return r.fetchone()[0]
+
+
+def bench_core(db_name, repeat=5):
+    ''' Time the database core on db_name.
+
+    Returns
+    timings -- dict, name -> seconds
+    '''
+
+    timings = {}
+    lit_types = mylib.DEFAULT_LIT_TYPES
+
+    def create_fresh_db():
+        # all migrations on a new file, db_name is migrated already
+        with tempfile.TemporaryDirectory() as tmp:
+            mylib.create_db(os.path.join(tmp, 'fresh.db'))
+    timings['create_db_fresh'] = timeit(create_fresh_db, repeat)
+
+    conn = mylib.connect(db_name)
+    c = conn.cursor()
+    # the most popular pair & molecule
+    (top_lit_type, mol_a, mol_b) = c.execute(mylib.SQL_PAIR_COUNTS.format('?, ?, ?, ?') + " ORDER BY p.n DESC LIMIT 1",
+                                             lit_types).fetchone()[:3]
+    mol = top_molecule(c)
+    conn.execute("DELETE FROM matrix_snapshot")
+    conn.commit()
+
+    timings['matrix_build'] = timeit(lambda: mylib.read_pair_counts(c, lit_types))
+    timings['matrix_snapshot_save'] = timeit(lambda: mylib.load_matrices(c, lit_types))
+    timings['matrix_snapshot_load'] = timeit(lambda: mylib.load_matrices(c, lit_types), repeat)
+    timings['pair_detail'] = timeit(lambda: mylib.read_pair(c, top_lit_type, mol_a, mol_b), repeat)
+
+    opts = (mol, '', None, None, [])
+    timings['search_count'] = timeit(lambda: mylib.search_count(c, opts), repeat)
+    timings['search_first_page'] = timeit(lambda: mylib.search_page(c, opts, 'Year'), repeat)
+    cache = mylib.SearchCache()
+    cache.search_page(c, opts, 'Year')
+    timings['search_first_page_cached'] = timeit(lambda: cache.search_page(c, opts, 'Year'), repeat)
+
+    def deep_pages(n=20):
+        last_row = None
+        for i in range(n):
+            rows = mylib.search_page(c, opts, 'Year', last_row)
+            last_row = rows[-1] if rows else None
+    timings['search_20_pages'] = timeit(deep_pages, repeat)
+
+    fts_opts = ('', '', None, None, [], 'tunneling 42')
+    timings['search_fts_page'] = timeit(lambda: mylib.search_page(c, fts_opts, 'Mol'), repeat)
+    timings['search_fts_count'] = timeit(lambda: mylib.search_count(c, fts_opts), repeat)
+
+    # a few edits, then read what changed like a refresh does
+    seq = mylib.read_change_seq(c)
+    timings['insert_10'] = timeit(lambda: [
+        mylib.insert_entry(c, (mol, 'Bench{:d}'.format(k), lit_types[0], 2024, 'Bench{:d}'.format(k), ''))
+        for k in range(10)])
+    timings['refresh_read'] = timeit(lambda: mylib.read_changed_pairs(c, seq, lit_types, 1000), repeat)
+    timings['import_10k'] = timeit(lambda: mylib.import_records(c, gen_records(100, 10000, seed=1)))
+
+    conn.close()
+
+    return timings
+
+
+def bench_gui(db_name):
+    ''' Time the GUI on the offscreen Qt platform.
+
+    Returns
+    timings -- dict, name -> seconds, empty if PyQt5 is not installed
+    '''
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5 import QtWidgets
+        import main
+    except ImportError:
+        return {}
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    main.DB = db_name
+    timings = {}
+
+    def wait(timeout=600):
+        ''' process events until the database jobs are done '''
+        t0 = time.perf_counter()
+        while True:
+            app.processEvents()
+            if not w.dbWorkers.jobs or time.perf_counter() - t0 > timeout:
+                break
+            else:
+                time.sleep(0.001)
+        app.processEvents()
+
+    t0 = time.perf_counter()
+    w = main.MainWindow()
+    w.show()
+    app.processEvents()
+    timings['gui_open'] = time.perf_counter() - t0
+
+    vp = w.visPanel
+    t0 = time.perf_counter()
+    w._show_visPanel()
+    wait()
+    timings['gui_matrix'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vp.chooseLitType.setCurrentText(mylib.DEFAULT_LIT_TYPES[1])
+    wait()
+    timings['gui_switch_lit_type'] = time.perf_counter() - t0
+
+    w._show_entryPanel()
+    se = w.entryPanel.searchEntry
+    model = w.entryPanel.editEntry.resultModel
+    mol = top_molecule(w.cursor)
+    se.mol1Search.setText(mol)
+    t0 = time.perf_counter()
+    se._search_entry()
+    model.fetchMore()
+    wait()
+    timings['gui_search'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i in range(10):
+        model.fetchMore()
+        wait()
+    timings['gui_scroll_10_pages'] = time.perf_counter() - t0
+
+    for k in range(10):
+        mylib.insert_entry(w.cursor, (mol, 'GuiBench{:d}'.format(k), mylib.DEFAULT_LIT_TYPES[0], 2024, 'GuiBench{:d}'.format(k), ''))
+    t0 = time.perf_counter()
+    vp._refresh()
+    wait()
+    timings['gui_refresh'] = time.perf_counter() - t0
+
+    w.dbWorkers.cancel_all()
+    w.dbWorkers.close()
+    w.conn.close()
+    w.hide()
+    w.deleteLater()
+    app.processEvents()
+
+    return timings
+
+
+def git_commit():
+    ''' current commit of the working tree, None outside a git repository '''
+
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run(scales, gui=True, work_dir=None, repeat=5):
+    ''' Run the benchmarks on each scale.
+
+    Returns
+    result -- dict, ready for json
+    '''
+
+    result = {'commit': git_commit(),
+              'python': sys.version.split()[0],
+              'sqlite': sqlite3.sqlite_version,
+              'scales': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            n_mols, n_records = SCALES[scale]
+            db_name = os.path.join(work_dir or tmp, 'bench_{:s}.db'.format(scale))
+            for ext in ('', '-wal', '-shm'):
+                if os.path.exists(db_name + ext):
+                    os.remove(db_name + ext)
+                else:
+                    pass
+            print('{:s}: {:d} molecules, {:d} records'.format(scale, n_mols, n_records), file=sys.stderr)
+            stats = gen_db(db_name, n_mols, n_records)
+            timings = {'generate': stats['seconds']}
+            timings.update(bench_core(db_name, repeat))
+            if gui:
+                timings.update(bench_gui(db_name))
+            else:
+                pass
+            result['scales'][scale] = {'n_mols': n_mols, 'n_records': n_records,
+                                       'db_bytes': os.path.getsize(db_name), 'timings': timings}
+
+    return result
+
+
+def compare(old, new, threshold=1.2):
+    ''' Timings of new slower than old by more than threshold.
+
+    Returns
+    slower -- list of (scale, name, old seconds, new seconds)
+    '''
+
+    slower = []
+    for scale, entry in new['scales'].items():
+        old_timings = old['scales'].get(scale, {}).get('timings', {})
+        for name, t in entry['timings'].items():
+            if name in old_timings and t > old_timings[name] * threshold:
+                slower.append((scale, name, old_timings[name], t))
+            else:
+                pass
+
+    return slower
+
+
+def cli(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic databases')
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES),
+                        help='repeat for several scales (default: small, medium)')
+    parser.add_argument('--no-gui', action='store_true', help='skip the Qt benchmarks')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of fast benchmarks, the best is kept')
+    parser.add_argument('--dir', help='keep the generated databases in this directory')
+    parser.add_argument('-o', '--output', help='JSON result file (default: stdout)')
+    parser.add_argument('--compare', help='JSON result file of an earlier run')
+    args = parser.parse_args(argv)
+
+    result = run(args.scale or ['small', 'medium'], not args.no_gui, args.dir, args.repeat)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        slower = compare(old, result)
+        for (scale, name, t_old, t_new) in slower:
+            print('SLOWER {:s} {:s}: {:.4f} s -> {:.4f} s'.format(scale, name, t_old, t_new), file=sys.stderr)
+        return 1 if slower else 0
+    else:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -4,13 +4,14 @@
 Visualize the number of literatures on various dimers
 '''
 
-DB = 'dimer_lit.db'
-DEFAULT_LIT_TYPES = ['Microwave', '(sub)mm', 'IR', 'Theory']
-
+import os
 import sys
+import time
 from PyQt5 import QtWidgets, QtGui, QtCore
 import sqlite3
 import mylib
+import planner
+from mylib import DB, DEFAULT_LIT_TYPES
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -28,8 +29,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.resize(QtCore.QSize(1600, 900))
 
         # Connet to database
-        self.conn = sqlite3.connect(DB)
-        self.cursor = self.conn.cursor()
+        # writes go through this connection, reads of the workers use a
+        # pool of read only connections
+        self.conn = mylib.connect(DB)
+        self.cursor = self.conn.cursor(mylib.TracingCursor)
+        # repeated searches are served from memory until the data changes
+        self.searchCache = mylib.SearchCache()
+        # molecule names for autocomplete, loaded once by a worker below
+        self.molIndex = mylib.MolIndex()
 
         # Set menu bar actions
         entryAction = QtWidgets.QAction('Edit Entry', self)
@@ -37,17 +44,53 @@ class MainWindow(QtWidgets.QMainWindow):
         entryAction.setStatusTip('Edit literature entry')
         entryAction.triggered.connect(self._show_entryPanel)
 
+        importAction = QtWidgets.QAction('Import BibTeX/CSV...', self)
+        importAction.setStatusTip('Bulk import literature entries from a .bib or .csv file')
+        importAction.triggered.connect(self._import_file)
+
         visAction = QtWidgets.QAction('Visualization', self)
         visAction.setStatusTip('Visulize literature counts')
         visAction.triggered.connect(self._show_visPanel)
 
+        # timing spans of queries, jobs & widget updates, see mylib.Tracer
+        traceAction = QtWidgets.QAction('Record Timings', self)
+        traceAction.setCheckable(True)
+        traceAction.setChecked(mylib.TRACER.enabled)
+        traceAction.setStatusTip('Show the time breakdown of each operation in the status bar')
+        traceAction.toggled.connect(self._set_tracing)
+
+        saveTraceAction = QtWidgets.QAction('Save Trace...', self)
+        saveTraceAction.setStatusTip('Save the recorded timings as Chrome trace JSON')
+        saveTraceAction.triggered.connect(self._save_trace)
+
+        cacheAction = QtWidgets.QAction('Search Cache Stats', self)
+        cacheAction.setStatusTip('Show the hits & misses of the search cache & the reuse of the search templates')
+        cacheAction.triggered.connect(self._show_cache_stats)
+
+        # Run database work off the GUI thread, show a busy indicator meanwhile
+        self.dbWorkers = DbWorkers(DB, self)
+        self.busyLabel = QtWidgets.QLabel()
+        self.busyBar = QtWidgets.QProgressBar()
+        self.busyBar.setRange(0, 0)
+        self.busyBar.setMaximumWidth(150)
+        self.busyBar.hide()
+        self.dbWorkers.busy.connect(self._show_busy)
+        self.load_mol_names()
+
         # Set menu bar
         self.statusBar()
+        self.statusBar().addPermanentWidget(self.busyLabel)
+        self.statusBar().addPermanentWidget(self.busyBar)
 
         menuEntry = self.menuBar().addMenu('&Entry')
         menuEntry.addAction(entryAction)
+        menuEntry.addAction(importAction)
         menuVis = self.menuBar().addMenu('&Visulization')
         menuVis.addAction(visAction)
+        menuTools = self.menuBar().addMenu('&Tools')
+        menuTools.addAction(traceAction)
+        menuTools.addAction(saveTraceAction)
+        menuTools.addAction(cacheAction)
 
         # Set window layout
         self.entryPanel = EntryPanel(self)
@@ -74,12 +117,96 @@ class MainWindow(QtWidgets.QMainWindow):
         self.entryPanel.hide()
         self.visPanel.show()
 
+    def _import_file(self):
+        ''' bulk import a BibTeX / CSV file off the GUI thread '''
+
+        filename, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Import entries', '', 'BibTeX / CSV (*.bib *.csv)')
+        if filename:
+            self.dbWorkers.run('Importing', mylib.import_file, (filename, DEFAULT_LIT_TYPES),
+                               callback=self._import_done, write=True)
+        else:
+            pass
+
+    def _import_done(self, stats):
+
+        QtWidgets.QMessageBox.information(self, 'Import finished',
+            '{:d} inserted, {:d} duplicates skipped, {:d} invalid.\n'
+            '{:.2f} s, {:.0f} records/s'.format(stats['inserted'], stats['skipped'],
+                stats['invalid'], stats['seconds'], stats['rate']))
+        self.load_mol_names()
+        self.visPanel._refresh()
+
+    def load_mol_names(self):
+        ''' (re)load the autocomplete index off the GUI thread '''
+
+        self.dbWorkers.run('Loading molecules', mylib.read_mol_names,
+                           callback=self.molIndex.load, tag='mol-names')
+
+    def _show_busy(self, label):
+
+        self.busyLabel.setText(label)
+        self.busyBar.setVisible(bool(label))
+
+    def _set_tracing(self, enabled):
+
+        mylib.TRACER.enabled = enabled
+        if not enabled:
+            mylib.TRACER.clear()
+        else:
+            pass
+
+    def _save_trace(self):
+
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save trace', 'trace.json', 'Chrome trace (*.json)')
+        if filename:
+            mylib.TRACER.dump(filename)
+        else:
+            pass
+
+    def _show_cache_stats(self):
+
+        stats = self.searchCache.stats()
+        statements = mylib.STATEMENTS.stats()
+        QtWidgets.QMessageBox.information(self, 'Search cache',
+            '{:d} hits, {:d} misses, hit rate {:.0%}.\n'
+            '{:d} of {:d} results cached.\n'
+            'Search templates: {:d} distinct shapes, reused by {:.0%} of the queries.\n'
+            '(an estimate over all connections, each one has its own statement cache)'.format(
+                stats['hits'], stats['misses'], stats['hit_rate'], stats['entries'],
+                self.searchCache.size, statements['distinct'], statements['hit_rate']))
+
+    def show_timing(self, name, t0):
+        ''' record the operation name started at time.perf_counter() t0,
+        and show its breakdown in the status bar. Called from a job
+        callback, the operation ends once the callback returns. '''
+
+        if mylib.TRACER.enabled:
+            QtCore.QTimer.singleShot(0, lambda: self._show_timing(name, t0))
+        else:
+            pass
+
+    def _show_timing(self, name, t0):
+
+        t1 = time.perf_counter()
+        mylib.TRACER.add(name, 'ui', t0, t1)
+        stats = mylib.TRACER.breakdown(t0, t1)
+        self.statusBar().showMessage('{:s}: {:.0f} ms | SQL {:.0f} ms, {:d} queries, {:d} rows | '
+                                     'Python {:.0f} ms | Qt {:.0f} ms'.format(name, (t1 - t0) * 1e3,
+                                     stats['sql'] * 1e3, stats['queries'], stats['rows'],
+                                     stats['python'] * 1e3, stats['qt'] * 1e3))
+
     def closeEvent(self, event):
         q = QtWidgets.QMessageBox.question(self, 'Quit?',
                        'Are you sure to quit?', QtWidgets.QMessageBox.Yes |
                        QtWidgets.QMessageBox.No, QtWidgets.QMessageBox.Yes)
         if q == QtWidgets.QMessageBox.Yes:
+            self.dbWorkers.cancel_all()
+            self.dbWorkers.close()
             self.conn.close()
+            if os.environ.get('DIMER_TRACE', '').endswith('.json'):
+                mylib.TRACER.dump(os.environ['DIMER_TRACE'])
+            else:
+                pass
             self.close()
         else:
             event.ignore()
@@ -103,11 +230,11 @@ class EntryPanel(QtWidgets.QWidget):
         self.mainLayout.setAlignment(QtCore.Qt.AlignTop)
         self.setLayout(self.mainLayout)
 
-    def pass_search_result(self, result):
-        ''' pass the search result from searchEntry to editEntry '''
+    def pass_search_result(self, search_opts, sort_opt):
+        ''' pass the search options from searchEntry to editEntry '''
 
         self.editEntry.clear()
-        self.editEntry.display(result)
+        self.editEntry.display(search_opts, sort_opt)
 
 
 class NewEntry(QtWidgets.QGroupBox):
@@ -149,6 +276,8 @@ class NewEntry(QtWidgets.QGroupBox):
         self.setLayout(self.mainLayout)
 
         self.addBtn.clicked.connect(self._insert_entry)
+        MolCompleter(self.main.molIndex, self.mol1Input)
+        MolCompleter(self.main.molIndex, self.mol2Input)
 
     def _insert_entry(self):
         ''' insert new entry into the database '''
@@ -156,16 +285,35 @@ class NewEntry(QtWidgets.QGroupBox):
         entry = self._get_input()
 
         if entry:
-            # write entry into database
-            self.main.cursor.execute("INSERT INTO lit (mol1, mol2, lit_type, year, bibkey, note) VALUES (?,?,?,?,?,?)", entry)
-            self.main.conn.commit()
+            (mol1, mol2, lit_type, year, bibkey, note) = entry
+            # check duplicates off the GUI thread, then write
+            self.main.dbWorkers.run('Checking duplicates', mylib.check_duplicates,
+                                    (mol1, mol2, year, bibkey),
+                                    callback=lambda dup: self._write_entry(entry, dup))
         else:
             pass
 
+    def _write_entry(self, entry, dup):
+        ''' write entry into database unless it is duplicated '''
+
+        if dup:
+            msg = MsgWarning(self, 'Duplicates!', 'A duplicated copy of this input already exists in the database. Please change your input.')
+            msg.exec_()
+        else:
+            try:
+                mylib.insert_entry(self.main.cursor, entry)
+            except sqlite3.IntegrityError:  # written by someone else meanwhile
+                msg = MsgWarning(self, 'Duplicates!', 'A duplicated copy of this input already exists in the database. Please change your input.')
+                msg.exec_()
+                return None
+            self.main.molIndex.add(entry[:2])
+            self.main.visPanel._refresh()
+
     def _get_input(self):
         ''' retrieve input. Return:
         (mol1, mol2, lit_type, year, bibkey, note) if valid
         False if not valid
+        Duplicates are checked separately.
         '''
 
         mol1 = self.mol1Input.text()
@@ -203,26 +351,18 @@ class NewEntry(QtWidgets.QGroupBox):
             valid *= False
 
         if valid:
-            if self._check_duplicates(mol1, mol2, year, bibkey):
-                msg = MsgWarning(self, 'Duplicates!', 'A duplicated copy of this input already exists in the database. Please change your input.')
-                msg.exec_()
-                return False
-            else:
-                return (mol1, mol2, lit_type, year, bibkey, note)
+            return (mol1, mol2, lit_type, year, bibkey, note)
         else:
             return False
 
-    def _check_duplicates(self, mol1, mol2, year, bibkey):
-        ''' check whether the input entry is duplicated '''
-
-        r = self.main.cursor.execute("SELECT bibkey FROM lit WHERE mol1 = (?) AND mol2 = (?) AND year = (?) AND bibkey = (?)", (mol1, mol2, year, bibkey))
-
-        return bool(r.fetchall())
-
 
 class SearchEntry(QtWidgets.QGroupBox):
     ''' Search existing entry & edit it '''
 
+    SEARCH_DELAY = 300  # ms of no typing before a live search
+    # file dialog filter -> format of mylib.export_search
+    EXPORT_FILTERS = {'CSV (*.csv)': 'csv', 'JSON Lines (*.jsonl)': 'jsonl', 'BibTeX keys (*.txt)': 'bibkeys'}
+
     def __init__(self, parent, main):
         QtWidgets.QWidget.__init__(self, parent)
         self.parent = parent
@@ -233,12 +373,15 @@ class SearchEntry(QtWidgets.QGroupBox):
         self.setCheckable(False)
 
         self.searchBtn = QtWidgets.QPushButton('Search')
+        self.exportBtn = QtWidgets.QPushButton('Export...')
         self.sortOption = QtWidgets.QComboBox()
         self.sortOption.addItems(['Mol', 'Year', 'Lit Type'])
         self.mol1Search = QtWidgets.QLineEdit()
         self.mol2Search = QtWidgets.QLineEdit()
         self.yearStart = QtWidgets.QLineEdit()
         self.yearEnd = QtWidgets.QLineEdit()
+        self.textSearch = QtWidgets.QLineEdit()
+        self.textSearch.setPlaceholderText('bibkey, note')
         self.chooseLitType = QtWidgets.QWidget()
         self.chooseLitOptions = []
 
@@ -255,17 +398,60 @@ class SearchEntry(QtWidgets.QGroupBox):
         self.mainLayout.addWidget(QtWidgets.QLabel('Monomer 2'), 0, 1, QtCore.Qt.AlignHCenter)
         self.mainLayout.addWidget(QtWidgets.QLabel('Year'), 0, 2, 1, 3, QtCore.Qt.AlignHCenter)
         self.mainLayout.addWidget(QtWidgets.QLabel('Lit Type'), 0, 5, QtCore.Qt.AlignHCenter)
+        self.mainLayout.addWidget(QtWidgets.QLabel('Full Text'), 0, 6, QtCore.Qt.AlignHCenter)
+        self.mainLayout.addWidget(QtWidgets.QLabel('Sort by'), 0, 7, QtCore.Qt.AlignHCenter)
         self.mainLayout.addWidget(self.mol1Search, 1, 0)
         self.mainLayout.addWidget(self.mol2Search, 1, 1)
         self.mainLayout.addWidget(self.yearStart, 1, 2)
         self.mainLayout.addWidget(QtWidgets.QLabel('to'), 1, 3)
         self.mainLayout.addWidget(self.yearEnd, 1, 4)
         self.mainLayout.addWidget(self.chooseLitType, 1, 5)
-        self.mainLayout.addWidget(self.searchBtn, 1, 6)
+        self.mainLayout.addWidget(self.textSearch, 1, 6)
+        self.mainLayout.addWidget(self.sortOption, 1, 7)
+        self.mainLayout.addWidget(self.searchBtn, 1, 8)
+        self.mainLayout.addWidget(self.exportBtn, 1, 9)
 
         self.setLayout(self.mainLayout)
 
         self.searchBtn.clicked.connect(self._search_entry)
+        self.exportBtn.clicked.connect(self._export_results)
+        self.textSearch.returnPressed.connect(self._search_entry)
+
+        # search as you type, once the typing pauses
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(self.SEARCH_DELAY)
+        self.searchTimer.timeout.connect(self._live_search)
+        for lineEdit in (self.mol1Search, self.mol2Search):
+            completer = MolCompleter(self.main.molIndex, lineEdit)
+            completer.activated.connect(self._schedule_search)
+        for lineEdit in (self.mol1Search, self.mol2Search, self.yearStart, self.yearEnd, self.textSearch):
+            lineEdit.textEdited.connect(self._schedule_search)
+        for checkBox in self.chooseLitOptions:
+            checkBox.toggled.connect(self._schedule_search)
+        self.sortOption.currentIndexChanged.connect(self._schedule_search)
+        # full-text results are ranked by relevance, not by sortOption
+        self.textSearch.textChanged.connect(lambda text: self.sortOption.setEnabled(not planner.fts_query(text)))
+
+    def _schedule_search(self, *args):
+        ''' (re)start the delay of the live search, signal args are ignored '''
+        self.searchTimer.start()
+
+    def _live_search(self):
+        ''' search while typing, only once the monomers are known names.
+        Unknown names are marked instead of returning nothing. '''
+
+        known = True
+        for lineEdit in (self.mol1Search, self.mol2Search):
+            if lineEdit.text() and lineEdit.text() not in self.main.molIndex:
+                lineEdit.setStyleSheet('border: 1px solid #FF9933')
+                known = False
+            else:
+                lineEdit.setStyleSheet('color: black')
+        if known:
+            self._search_entry()
+        else:
+            pass
 
     def _search_entry(self):
         ''' search entry & return results to self.parent Panel '''
@@ -274,17 +460,23 @@ class SearchEntry(QtWidgets.QGroupBox):
         if not search_opts:  # if input value error, do nothing
             pass
         else:
-            sql_str, sql_arg = mylib.gen_search_sql_str(search_opts)
-            if sql_arg:
-                if isinstance(sql_arg, list):
-                    r = self.main.cursor.execute(sql_str, sql_arg)
-                else:
-                    r = self.main.cursor.execute(sql_str, [sql_arg])
-            else:
-                r = self.main.cursor.execute(sql_str)
+            # results are fetched page by page by the view
+            self.parent.pass_search_result(search_opts, self.sortOption.currentText())
+
 
-            self.parent.pass_search_result(r.fetchall())
+    def _export_results(self):
+        ''' stream all results of the search into a file, off the GUI thread '''
 
+        search_opts = self._get_search_option()
+        filename, chosen = QtWidgets.QFileDialog.getSaveFileName(self, 'Export results', 'results.csv',
+                                                                 ';;'.join(self.EXPORT_FILTERS))
+        if filename:
+            self.main.dbWorkers.run('Exporting', mylib.export_search,
+                                    (search_opts, filename, self.EXPORT_FILTERS.get(chosen, 'csv')),
+                                    callback=lambda n: self.main.statusBar().showMessage(
+                                        '{:d} lines exported to {:s}'.format(n, filename)))
+        else:
+            pass
 
     def _get_search_option(self):
         ''' retrieve search option '''
@@ -317,7 +509,7 @@ class SearchEntry(QtWidgets.QGroupBox):
         else:
             pass
 
-        return (mol1, mol2, yr_start, yr_end, checked_lit_types)
+        return (mol1, mol2, yr_start, yr_end, checked_lit_types, self.textSearch.text())
 
 
 class EditEntry(QtWidgets.QGroupBox):
@@ -332,58 +524,296 @@ class EditEntry(QtWidgets.QGroupBox):
         self.setAlignment(QtCore.Qt.AlignTop)
         self.setCheckable(False)
 
-        self.entryList = []
-
-        self.mainLayout = QtWidgets.QGridLayout()
-        self.mainLayout.setAlignment(QtCore.Qt.AlignTop)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Monomer 1'), 0, 0, QtCore.Qt.AlignHCenter)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Monomer 2'), 0, 1, QtCore.Qt.AlignHCenter)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Lit type'), 0, 2, QtCore.Qt.AlignHCenter)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Year'), 0, 3, QtCore.Qt.AlignHCenter)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Bibkey'), 0, 4, QtCore.Qt.AlignHCenter)
-        self.mainLayout.addWidget(QtWidgets.QLabel('Brief Note'), 0, 5, QtCore.Qt.AlignHCenter)
-
-        # make the trick to put in a scroll bar
-        mainWidget = QtWidgets.QWidget()
-        mainArea = QtWidgets.QScrollArea()
-        mainArea.setWidgetResizable(True)
-        mainArea.setWidget(mainWidget)
-        mainWidget.setLayout(self.mainLayout)
+        # results are fetched page by page as the view scrolls
+        self.resultModel = SearchResultModel(self)
+        self.resultView = QtWidgets.QTableView()
+        self.resultView.setModel(self.resultModel)
+        self.resultView.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.resultView.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.resultView.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.resultView.horizontalHeader().setStretchLastSection(True)
+        self.resultView.verticalHeader().hide()
+
+        # only the selected row gets an editor
+        self.entryRow = None
+        self.editLayout = QtWidgets.QHBoxLayout()
+
+        # batch edit: updates are staged, then saved in one transaction
+        self.batchCheck = QtWidgets.QCheckBox('Batch edit')
+        self.saveAllBtn = QtWidgets.QPushButton('Save all')
+        self.discardBtn = QtWidgets.QPushButton('Discard')
+        batchLayout = QtWidgets.QHBoxLayout()
+        batchLayout.addWidget(self.batchCheck)
+        batchLayout.addStretch()
+        batchLayout.addWidget(self.saveAllBtn)
+        batchLayout.addWidget(self.discardBtn)
+        self._show_staged()
 
         widgetLayout = QtWidgets.QVBoxLayout()
-        widgetLayout.addWidget(mainWidget)
+        widgetLayout.addWidget(self.resultView)
+        widgetLayout.addLayout(self.editLayout)
+        widgetLayout.addLayout(batchLayout)
         self.setLayout(widgetLayout)
 
-    def display(self, result):
+        self.searchStart = None
+        self.resultView.clicked.connect(self._show_editor)
+        self.resultModel.rowsInserted.connect(self._show_timing)
+        self.batchCheck.toggled.connect(self._clear_editor)
+        self.saveAllBtn.clicked.connect(self._save_all)
+        self.discardBtn.clicked.connect(self._discard_all)
+
+    def display(self, search_opts, sort_opt):
         ''' display result. Arguments
-        result -- [(pid, mol1, mol2, lit_type, year, bibkey, note), ...]
+        search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types)
+        sort_opt    -- str, key of planner.SORT_KEYS
         '''
 
-        # create EntryRow objects
-        for item in result:
-            row = result.index(item)
-            entryRow = EditEntryRow(self.main, item[1:], item[0])
-            self.entryList.append(entryRow)
-            self.mainLayout.addWidget(entryRow.mol1Input, row+1, 0)
-            self.mainLayout.addWidget(entryRow.mol2Input, row+1, 1)
-            self.mainLayout.addWidget(entryRow.chooseLitType, row+1, 2)
-            self.mainLayout.addWidget(entryRow.yearInput, row+1, 3)
-            self.mainLayout.addWidget(entryRow.bibkeyInput, row+1, 4)
-            self.mainLayout.addWidget(entryRow.noteInput, row+1, 5)
-            self.mainLayout.addWidget(entryRow.editBtn, row+1, 6)
+        # a new search cancels the stale one
+        self.searchStart = time.perf_counter()
+        cache = self.main.searchCache
+        self.main.dbWorkers.run('Counting results', cache.search_count, (search_opts,),
+                                callback=self._show_total, tag='search-count')
+        self.resultModel.set_query(self.main.dbWorkers, search_opts, sort_opt, cache)
+
+    def _show_timing(self):
+        ''' timing of a search, until its first page is shown '''
+
+        if self.searchStart:
+            self.main.show_timing('Search', self.searchStart)
+            self.searchStart = None
+        else:
+            pass
 
     def clear(self):
-        ''' clear elements and remove from the layout '''
+        ''' clear results and the editor '''
+
+        self._clear_editor()
+        self.setTitle('Search results')
+        self.main.dbWorkers.cancel('search-count')
+        self.resultModel.set_query(None, None, None)
+
+    def _show_total(self, total):
+
+        self.setTitle('Search results ({:d})'.format(total))
+
+    def _clear_editor(self):
+
+        if self.entryRow:
+            self.editLayout.removeWidget(self.entryRow)
+            self.entryRow.deleteLater()
+            self.entryRow = None
+        else:
+            pass
+
+    def _show_editor(self, index):
+        ''' create the editor of the clicked row '''
+
+        row = index.row()
+        item = self.resultModel.item(row)
+        self._clear_editor()
+        self.entryRow = EditEntryRow(self.main, item[1:7], item[0], batch=self.batchCheck.isChecked())
+        self.entryRow.entryUpdated.connect(lambda entry: self.resultModel.update_row(row, entry))
+        self.entryRow.entryStaged.connect(lambda entry: self._stage(row, entry))
+        self.editLayout.addWidget(self.entryRow)
+
+    def _stage(self, row, entry):
+
+        self.resultModel.stage(row, entry)
+        self._show_staged()
+
+    def _show_staged(self):
+        ''' batch mode cannot be left with staged edits '''
 
-        while self.entryList:
-            entryRow = self.entryList.pop()
-            entryRow.mol1Input.deleteLater()
-            entryRow.mol2Input.deleteLater()
-            entryRow.chooseLitType.deleteLater()
-            entryRow.yearInput.deleteLater()
-            entryRow.bibkeyInput.deleteLater()
-            entryRow.noteInput.deleteLater()
-            entryRow.editBtn.deleteLater()
+        n = len(self.resultModel.staged)
+        self.saveAllBtn.setText('Save all ({:d})'.format(n) if n else 'Save all')
+        self.saveAllBtn.setEnabled(bool(n))
+        self.discardBtn.setEnabled(bool(n))
+        self.batchCheck.setEnabled(not n)
+
+    def _save_all(self):
+        ''' validate the staged edits together off the GUI thread, then write '''
+
+        edits = list(self.resultModel.staged.items())
+        self.saveAllBtn.setEnabled(False)
+        self.main.dbWorkers.run('Checking duplicates', mylib.check_edits, (edits,),
+                                callback=lambda conflicts: self._write_all(edits, conflicts))
+
+    def _write_all(self, edits, conflicts):
+        ''' write the staged edits in a single transaction, unless any conflicts '''
+
+        self.saveAllBtn.setEnabled(True)
+        if conflicts:
+            bibkeys = [dict(edits)[pid][4] for pid in conflicts]
+            msg = MsgWarning(self, 'Duplicates!', 'Nothing is saved. These edits duplicate other entries, please change them: {:s}'.format(', '.join(bibkeys)))
+            msg.exec_()
+            return None
+        else:
+            pass
+        try:
+            mylib.update_entries(self.main.cursor, edits)
+        except sqlite3.IntegrityError:  # rolled back
+            msg = MsgWarning(self, 'Duplicates!', 'Nothing is saved. Some edits have the same monomers, year and bibkey as other entries.')
+            msg.exec_()
+            return None
+        self.main.molIndex.add(name for (pid, entry) in edits for name in entry[:2])
+        self.resultModel.unstage(saved=True)
+        self._show_staged()
+        self.main.visPanel._refresh()
+
+    def _discard_all(self):
+
+        self._clear_editor()
+        self.resultModel.unstage(saved=False)
+        self._show_staged()
+
+
+class SearchResultModel(QtCore.QAbstractTableModel):
+    ''' Table model of search results, rows are fetched page by page
+    with keyset pagination as the view scrolls. Pages are read by
+    DbWorkers off the GUI thread. Edits staged in batch edit mode are
+    shown over the fetched rows until they are saved or discarded. '''
+
+    FETCH_SIZE = 100
+    HEADERS = ['Monomer 1', 'Monomer 2', 'Lit type', 'Year', 'Bibkey', 'Brief Note']
+    # full-text searches add the matching snippet, ranked best first
+    FTS_HEADERS = HEADERS + ['Match']
+
+    def __init__(self, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.rows = []
+        self.last_row = None    # last fetched row, as in the database
+        self.workers = None
+        self.more = False       # more pages to fetch
+        self.pending = False    # a page is being fetched
+        self.search_opts = None
+        self.sort_opt = None
+        self.cache = None       # mylib.SearchCache, if any
+        self.headers = self.HEADERS
+        self.staged = {}        # {pid: entry}, kept across searches
+
+    def set_query(self, workers, search_opts, sort_opt, cache=None):
+        ''' replace the results by a new search, workers = None clears it.
+        Pages are read through cache if given. '''
+
+        if self.workers:    # drop the page of the previous search
+            self.workers.cancel('search-page')
+        else:
+            pass
+        self.beginResetModel()
+        self.rows = []
+        self.last_row = None
+        self.workers = workers
+        self.more = workers is not None
+        self.pending = False
+        self.search_opts = search_opts
+        self.sort_opt = sort_opt
+        self.cache = cache
+        if search_opts and planner.fts_query(search_opts[5]):
+            self.headers = self.FTS_HEADERS
+        else:
+            self.headers = self.HEADERS
+        self.endResetModel()
+
+    def item(self, row):
+        ''' row as fetched, with the staged entry if any '''
+
+        item = self.rows[row]
+        if item[0] in self.staged:
+            return (item[0],) + self.staged[item[0]] + item[7:]
+        else:
+            return item
+
+    def stage(self, row, entry):
+        ''' stage entry = (mol1, mol2, lit_type, year, bibkey, note) '''
+
+        self.staged[self.rows[row][0]] = tuple(entry)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.headers)-1))
+
+    def unstage(self, saved):
+        ''' drop the staged entries, into the rows if they are saved '''
+
+        if saved:
+            for (row, item) in enumerate(self.rows):
+                if item[0] in self.staged:
+                    self.rows[row] = self.item(row)
+                else:
+                    pass
+        else:
+            pass
+        self.staged = {}
+        if self.rows:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows)-1, len(self.headers)-1))
+        else:
+            pass
+
+    def update_row(self, row, entry):
+        ''' update row with entry = (mol1, mol2, lit_type, year, bibkey, note) '''
+
+        # keep the snippet & score of full-text results
+        self.rows[row] = (self.rows[row][0],) + tuple(entry) + self.rows[row][7:]
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.headers)-1))
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.more and not self.pending
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not self.more or self.pending:
+            return None
+        else:
+            pass
+
+        self.pending = True
+        search_page = self.cache.search_page if self.cache else mylib.search_page
+        self.workers.run('Searching', search_page,
+                         (self.search_opts, self.sort_opt, self.last_row, self.FETCH_SIZE),
+                         callback=self._add_rows, tag='search-page')
+
+    def _add_rows(self, new_rows):
+        ''' append a fetched page '''
+
+        self.pending = False
+        if len(new_rows) < self.FETCH_SIZE:   # last page
+            self.more = False
+        else:
+            pass
+        if new_rows:
+            self.last_row = new_rows[-1]
+            n = len(self.rows)
+            self.beginInsertRows(QtCore.QModelIndex(), n, n + len(new_rows) - 1)
+            self.rows.extend(new_rows)
+            self.endInsertRows()
+        else:
+            pass
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            return len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            return len(self.headers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        elif role == QtCore.Qt.DisplayRole:
+            # skip pid in the first column
+            value = self.item(index.row())[index.column()+1]
+            return '' if value is None else str(value)
+        elif role == QtCore.Qt.BackgroundRole and self.rows[index.row()][0] in self.staged:
+            return QtGui.QColor('#FFF3C4')
+        else:
+            return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        else:
+            return None
 
 
 class EditEntryRow(QtWidgets.QWidget):
@@ -391,10 +821,16 @@ class EditEntryRow(QtWidgets.QWidget):
         entry = (mol1, mol2, lit_type, year, bibkey, note)
     '''
 
-    def __init__(self, main, entry, pid):
+    # emits the updated entry after it is written to the database
+    entryUpdated = QtCore.pyqtSignal(tuple)
+    # emits the updated entry instead in batch mode, nothing is written
+    entryStaged = QtCore.pyqtSignal(tuple)
+
+    def __init__(self, main, entry, pid, batch=False):
         QtWidgets.QWidget.__init__(self, main)
         self.main = main
         self.pid = pid      # entry pid in the database
+        self.batch = batch
 
         self.editBtn = QtWidgets.QPushButton('Edit')
         self.mol1Input = QtWidgets.QLineEdit()
@@ -404,6 +840,17 @@ class EditEntryRow(QtWidgets.QWidget):
         self.bibkeyInput = QtWidgets.QLineEdit()
         self.noteInput = QtWidgets.QLineEdit()
 
+        mainLayout = QtWidgets.QHBoxLayout()
+        mainLayout.setContentsMargins(0, 0, 0, 0)
+        mainLayout.addWidget(self.mol1Input)
+        mainLayout.addWidget(self.mol2Input)
+        mainLayout.addWidget(self.chooseLitType)
+        mainLayout.addWidget(self.yearInput)
+        mainLayout.addWidget(self.bibkeyInput)
+        mainLayout.addWidget(self.noteInput)
+        mainLayout.addWidget(self.editBtn)
+        self.setLayout(mainLayout)
+
         # by default disable edit of the entry
         self._set_read_only(entry)
 
@@ -473,23 +920,44 @@ class EditEntryRow(QtWidgets.QWidget):
             self.editBtn.setText('Update')
         else:
             entry = self._get_input()
-            if entry:   # if input is valid
-                # unpack entry
-                entry_and_pid = list(entry)
-                entry_and_pid.append(self.pid)
-                # update database
-                self.main.cursor.execute("UPDATE lit SET mol1 = (?), mol2 = (?), lit_type = (?), year = (?), bibkey = (?), note = (?) WHERE id = (?)", entry_and_pid)
-                self.main.conn.commit()
+            if entry and self.batch:    # validated together on "Save all"
                 self._set_read_only(entry)
                 self.editBtn.setText('Edit')
+                self.entryStaged.emit(tuple(entry))
+            elif entry:   # if input is valid
+                (mol1, mol2, lit_type, year, bibkey, note) = entry
+                # check duplicates off the GUI thread, then write
+                self.main.dbWorkers.run('Checking duplicates', mylib.check_duplicates,
+                                        (mol1, mol2, year, bibkey, note),
+                                        callback=lambda dup: self._write_entry(entry, dup))
             else:
                 pass
 
+    def _write_entry(self, entry, dup):
+        ''' update the database unless the entry is duplicated '''
+
+        if dup:
+            msg = MsgWarning(self, 'Duplicates!', 'A duplicated copy of this input already exists in the database. Please change your input.')
+            msg.exec_()
+        else:
+            # update database
+            try:
+                mylib.update_entry(self.main.cursor, self.pid, entry)
+            except sqlite3.IntegrityError:  # same mol1, mol2, year & bibkey as another entry
+                msg = MsgWarning(self, 'Duplicates!', 'Another entry with the same monomers, year and bibkey already exists in the database. Please change your input.')
+                msg.exec_()
+                return None
+            self.main.molIndex.add(entry[:2])
+            self.main.visPanel._refresh()
+            self._set_read_only(entry)
+            self.editBtn.setText('Edit')
+            self.entryUpdated.emit(tuple(entry))
 
     def _get_input(self):
         ''' retrieve input. Return:
-        (mol1, mol2, lit_type, year, bibkey, note, pid) if valid
+        (mol1, mol2, lit_type, year, bibkey, note) if valid
         False if not valid
+        Duplicates are checked separately.
         '''
 
         mol1 = self.mol1Input.text()
@@ -527,26 +995,17 @@ class EditEntryRow(QtWidgets.QWidget):
             valid *= False
 
         if valid:
-            if self._check_duplicates(mol1, mol2, year, bibkey, note):
-                msg = MsgWarning(self, 'Duplicates!', 'A duplicated copy of this input already exists in the database. Please change your input.')
-                msg.exec_()
-                return False
-            else:
-                return (mol1, mol2, lit_type, year, bibkey, note)
+            return (mol1, mol2, lit_type, year, bibkey, note)
         else:
             return False
 
-    def _check_duplicates(self, mol1, mol2, year, bibkey, note):
-        ''' check whether the input entry is duplicated '''
-
-        r = self.main.cursor.execute("SELECT bibkey FROM lit WHERE mol1 = (?) AND mol2 = (?) AND year = (?) AND bibkey = (?) AND note = (?)", (mol1, mol2, year, bibkey, note))
-
-        return bool(r.fetchall())
-
 
 class VisPanel(QtWidgets.QWidget):
     ''' Visualization widget  '''
 
+    # rebuild the grids instead of updating cells beyond this number of changes
+    REBUILD_LIMIT = 1000
+
     def __init__(self, parent):
         QtWidgets.QWidget.__init__(self, parent)
         self.parent = parent
@@ -555,17 +1014,42 @@ class VisPanel(QtWidgets.QWidget):
         self.chooseLitType = QtWidgets.QComboBox()
         self.chooseLitType.addItems(DEFAULT_LIT_TYPES)
         self.refreshBtn = QtWidgets.QPushButton('Refresh DB')
+        self.exportBtn = QtWidgets.QPushButton('Export...')
+        # a table, or a heatmap for large matrices (needs numpy)
+        self.viewMode = QtWidgets.QComboBox()
+        self.viewMode.addItems(['Table', 'Heatmap'])
+        if mylib.np is None:
+            self.viewMode.model().item(1).setEnabled(False)
+        else:
+            pass
         self.detailInfo = QtWidgets.QLineEdit('')
         self.detailInfo.setReadOnly(True)
         self.detailInfo.setStyleSheet('background: transparent; border: 0px')
+        # counts of a year window, from the per-year sums (needs numpy)
+        self.yearCheck = QtWidgets.QCheckBox('Years')
+        self.yearStart = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.yearEnd = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.yearLabel = QtWidgets.QLabel('')
+        for slider in (self.yearStart, self.yearEnd):
+            slider.setRange(0, 0)
+            slider.setEnabled(False)
+        self.yearCheck.setEnabled(mylib.np is not None)
 
         self.infoBar = QtWidgets.QWidget()
         infoLayout = QtWidgets.QGridLayout()
         infoLayout.setAlignment(QtCore.Qt.AlignLeft)
         infoLayout.addWidget(self.chooseLitType, 0, 0)
+        infoLayout.addWidget(self.viewMode, 0, 1)
         infoLayout.addWidget(self.refreshBtn, 1, 0)
-        infoLayout.addWidget(QtWidgets.QLabel("Details: "), 0, 1, 2, 1)
-        infoLayout.addWidget(self.detailInfo, 0, 2, 2, 1)
+        infoLayout.addWidget(self.exportBtn, 1, 1)
+        infoLayout.addWidget(QtWidgets.QLabel("Details: "), 0, 2, 2, 1)
+        infoLayout.addWidget(self.detailInfo, 0, 3, 2, 1)
+        yearLayout = QtWidgets.QHBoxLayout()
+        yearLayout.addWidget(self.yearCheck)
+        yearLayout.addWidget(self.yearStart)
+        yearLayout.addWidget(self.yearEnd)
+        yearLayout.addWidget(self.yearLabel)
+        infoLayout.addLayout(yearLayout, 2, 0, 1, 4)
         self.infoBar.setLayout(infoLayout)
 
         self.mainLayout = QtWidgets.QVBoxLayout()
@@ -574,121 +1058,738 @@ class VisPanel(QtWidgets.QWidget):
         # Cache layout because there are only a few lit types.
         # One may wanna switch between lit types, but I don't need
         # to re-generate the grid over and over again.
-        self._create_mol_grid(DEFAULT_LIT_TYPES)
+        # Grids are built lazily, the first time a lit type is shown.
+        self.cache = {}
+        self.matrices = {}
+        # mylib.PairYears of the matrices, read when the year window is on
+        self.years = {}
+        # last applied entry of the lit_change log
+        self.change_seq = mylib.read_change_seq(self.parent.cursor)
         self.setLayout(self.mainLayout)
 
         self.chooseLitType.currentTextChanged.connect(self._show_grid)
         self.refreshBtn.clicked.connect(self._refresh)
+        self.exportBtn.clicked.connect(self._export_matrix)
+        self.viewMode.currentTextChanged.connect(self._set_view_mode)
+        self.yearCheck.toggled.connect(self._toggle_years)
+        self.yearStart.valueChanged.connect(self._year_start_changed)
+        self.yearEnd.valueChanged.connect(self._year_end_changed)
 
-    def _create_mol_grid(self, lit_types):
-        ''' create & cache molecule grids '''
+    def showEvent(self, event):
+        ''' build the grid of the current lit type when the panel shows up '''
 
-        # create empty cache & lower triangular dictionary
-        self.cache = {}
-        self.mol_list = []
-        self.mol_detail = {}
+        self._show_grid(self.chooseLitType.currentText())
+        QtWidgets.QWidget.showEvent(self, event)
 
+    def _create_mol_grid(self, lit_types):
+        ''' create & cache molecule grids of lit_types. The matrices are read
+        off the GUI thread, a placeholder is cached until they arrive. '''
+
+        placeholders = {}
         for lit_type in lit_types:
-            self._read_db_mol(lit_type)
-            if self.mol_list:
-                n = len(self.mol_list)
-                for i in range(n):
-                    for j in range(n):
-                        self.mol_detail[(lit_type, i, j)] = ('', 0)
-                self._read_db_detail(lit_type)
-
-                self.cache[lit_type] = QtWidgets.QTableWidget(n, n)
-                self.cache[lit_type].setSortingEnabled(False)
-                self.cache[lit_type].setHorizontalHeaderLabels(self.mol_list)
-                self.cache[lit_type].setVerticalHeaderLabels(self.mol_list)
-                self.cache[lit_type].setShowGrid(True)
-                self.cache[lit_type].cellClicked.connect(self._show_detail)
-
-                # fill in cells (lower triangular matrix)
-                for i in range(n):
-                    for j in range(i+1):
-                        k = self.mol_detail[(lit_type, i, j)][1]
-                        item = QtWidgets.QTableWidgetItem(str(k))
-                        item.setFlags(QtCore.Qt.ItemIsSelectable)
-                        item.setTextAlignment(QtCore.Qt.AlignCenter)
-                        self.cache[lit_type].setItem(i, j, item)
-            else:
-                self.cache[lit_type] = QtWidgets.QLabel('No records')
+            placeholders[lit_type] = QtWidgets.QLabel('Loading...')
+            self.cache[lit_type] = placeholders[lit_type]
             self.cache[lit_type].hide()
             self.mainLayout.addWidget(self.cache[lit_type])
 
-        self.cache[self.chooseLitType.currentText()].show()
+        # from the stored snapshot, or the pair_counts table
+        t0 = time.perf_counter()
+        self.parent.dbWorkers.run('Building matrix', mylib.load_matrices, (lit_types,),
+                                  callback=lambda matrices: self._add_mol_grid(matrices, placeholders, t0),
+                                  tag='grid:' + ','.join(lit_types), write=True)
 
+    def _add_mol_grid(self, matrices, placeholders, t0):
+        ''' replace the placeholders by the molecule grids '''
+
+        for lit_type, placeholder in placeholders.items():
+            if self.cache.get(lit_type) is not placeholder:  # invalidated
+                continue
+            else:
+                pass
+            if lit_type in matrices:
+                self.matrices[lit_type] = matrices[lit_type]
+                self.cache[lit_type] = self._make_view(lit_type)
+            else:
+                self.cache[lit_type] = QtWidgets.QLabel('No records')
+            self.cache[lit_type].setVisible(placeholder.isVisible())
+            self.mainLayout.replaceWidget(placeholder, self.cache[lit_type])
+            placeholder.deleteLater()
+
+        if self.yearCheck.isChecked():
+            self._load_years()
+        else:
+            pass
+        self.parent.show_timing('Matrix ' + ', '.join(placeholders), t0)
+
+    def _make_view(self, lit_type):
+        ''' view of the matrix of lit_type, in the current view mode '''
+
+        if self.viewMode.currentText() == 'Heatmap':
+            view = HeatmapView(self._view_matrix(lit_type))
+            view.cellClicked.connect(self._show_pair_detail)
+        else:
+            view = QtWidgets.QTableView()
+            view.setModel(MolGridModel(self._view_matrix(lit_type)))
+            view.setSortingEnabled(False)
+            view.setShowGrid(True)
+            view.clicked.connect(self._show_detail)
+
+        return view
+
+    def _set_view_mode(self, mode):
+        ''' swap the views of the built matrices, the matrices are kept '''
+
+        for lit_type in self.matrices:
+            old = self.cache[lit_type]
+            self.cache[lit_type] = self._make_view(lit_type)
+            self.cache[lit_type].setVisible(old.isVisible())
+            self.mainLayout.replaceWidget(old, self.cache[lit_type])
+            old.deleteLater()
+
+    def _view_matrix(self, lit_type):
+        ''' matrix of lit_type with the counts of the year window if it is
+        on, the all-time matrix otherwise '''
+
+        if self.yearCheck.isChecked() and lit_type in self.years:
+            counts = self.years[lit_type].window(self.yearStart.value(), self.yearEnd.value())
+            return self.matrices[lit_type].with_counts(counts)
+        else:
+            return self.matrices[lit_type]
+
+    def _set_view_matrix(self, lit_type, matrix):
+        ''' show matrix in the built view of lit_type '''
+
+        view = self.cache[lit_type]
+        if isinstance(view, HeatmapView):
+            view.set_matrix(matrix)
+        else:
+            view.model().set_matrix(matrix)
+
+    def _toggle_years(self, checked):
+        ''' turn the year window on or off '''
+
+        for slider in (self.yearStart, self.yearEnd):
+            slider.setEnabled(checked and bool(self.years))
+        if checked:
+            self._load_years()
+        else:
+            pass
+        self._apply_year_window()
+
+    def _load_years(self):
+        ''' read the per-year sums of the built matrices, off the GUI thread.
+        The worker gets a copy, the matrices may change meanwhile. '''
+
+        for lit_type, matrix in self.matrices.items():
+            tag = 'years:' + lit_type
+            if lit_type in self.years or tag in self.parent.dbWorkers.tagged:
+                continue
+            else:
+                pass
+            self.parent.dbWorkers.run('Counting years', mylib.read_pair_years, (lit_type, matrix.copy()),
+                                      callback=lambda years, lit_type=lit_type, matrix=matrix:
+                                      self._add_years(lit_type, matrix, years), tag=tag)
+
+    def _add_years(self, lit_type, matrix, years):
+        ''' store the sums of lit_type & widen the sliders to their years '''
+
+        if self.matrices.get(lit_type) is not matrix or len(matrix) != len(years):
+            return None     # changed in the meantime, refresh reloads them
+        else:
+            pass
+        self.years[lit_type] = years
+
+        first = min(y.first_year for y in self.years.values())
+        last = max(y.last_year for y in self.years.values())
+        for slider in (self.yearStart, self.yearEnd):
+            slider.blockSignals(True)
+            # a slider at the end of its range stays there
+            at_min = slider.value() == slider.minimum() or not slider.isEnabled()
+            at_max = slider.value() == slider.maximum() or not slider.isEnabled()
+            slider.setRange(first, last)
+            if at_min and slider is self.yearStart:
+                slider.setValue(first)
+            elif at_max and slider is self.yearEnd:
+                slider.setValue(last)
+            else:
+                pass
+            slider.setEnabled(self.yearCheck.isChecked())
+            slider.blockSignals(False)
+
+        self._apply_year_window([lit_type])
+
+    def _year_start_changed(self, year):
+        if year > self.yearEnd.value():
+            self.yearEnd.setValue(year)     # applies the window
+        else:
+            self._apply_year_window()
+
+    def _year_end_changed(self, year):
+        if year < self.yearStart.value():
+            self.yearStart.setValue(year)
+        else:
+            self._apply_year_window()
+
+    def _apply_year_window(self, lit_types=None):
+        ''' Show the counts of the year window in the views of lit_types,
+        all of them by default. Only the per-year sums are read, so this is
+        fast enough to follow the sliders live. '''
+
+        for lit_type in (lit_types or list(self.matrices)):
+            if lit_type in self.matrices:
+                self._set_view_matrix(lit_type, self._view_matrix(lit_type))
+            else:
+                pass
+
+        if self.yearCheck.isChecked() and self.years:
+            self.yearLabel.setText('{:d} - {:d}'.format(self.yearStart.value(), self.yearEnd.value()))
+        elif self.yearCheck.isChecked():
+            self.yearLabel.setText('Loading...')
+        else:
+            self.yearLabel.setText('')
 
     def _show_grid(self, lit_type):
-        ''' Display grid of molecules '''
+        ''' Display grid of molecules, create it if not cached yet '''
 
-        for item in DEFAULT_LIT_TYPES:
-            self.cache[item].hide()
+        if lit_type not in self.cache:
+            self._create_mol_grid([lit_type])
+        else:
+            pass
+        for item in self.cache.values():
+            item.hide()
         self.cache[lit_type].show()
 
-    def _show_detail(self, row, col):
-        ''' Display details of the selected cell at row, col '''
+    def _show_detail(self, index):
+        ''' Display details of the selected cell at index '''
+
+        self._show_pair_detail(index.row(), index.column())
+
+    def _show_pair_detail(self, i, j):
+        ''' Display details of cell (i, j) of the current matrix '''
 
         current_lit_type = self.chooseLitType.currentText()
-        info_str = self.mol_detail[(current_lit_type, row, col)][0]
+        info_str = self.matrices[current_lit_type].detail(i, j)
         self.detailInfo.setText(info_str)
 
-    def _read_db_mol(self, lit_type):
-        ''' read registered molecules from database. '''
+    def _export_matrix(self):
+        ''' stream the matrix of the current lit type into a file, as a
+        pair list or a dense grid, off the GUI thread '''
+
+        lit_type = self.chooseLitType.currentText()
+        filename, chosen = QtWidgets.QFileDialog.getSaveFileName(self, 'Export matrix',
+                                                                 lit_type.strip('()') + '.csv',
+                                                                 'Pair list (*.csv);;Dense matrix (*.csv)')
+        if not filename:
+            return None
+        elif chosen.startswith('Dense'):
+            func, args = mylib.export_dense, (lit_type, filename)
+        else:
+            func, args = mylib.export_pairs, ([lit_type], filename)
+        self.parent.dbWorkers.run('Exporting', func, args,
+                                  callback=lambda n: self.parent.statusBar().showMessage(
+                                      '{:s} matrix exported to {:s}'.format(lit_type, filename)))
+
+    def _refresh(self):
+        ''' refresh database. Only the cells touched since the last refresh
+        (according to the lit_change log) are updated. The changes are read
+        off the GUI thread. '''
+
+        t0 = time.perf_counter()
+        self.parent.dbWorkers.run('Refreshing', mylib.read_changed_pairs,
+                                  (self.change_seq, list(self.matrices), self.REBUILD_LIMIT),
+                                  callback=lambda changes: self._apply_changes(changes, t0), tag='refresh')
+
+    def _apply_changes(self, changes, t0):
+        ''' apply the result of mylib.read_changed_pairs to the grids '''
+
+        seq, touched, pairs = changes
+
+        for lit_type in touched:
+            # the per-year sums are outdated, and the views get the all-time
+            # matrices back, which the updates below apply to
+            self.years.pop(lit_type, None)
+            self.parent.dbWorkers.cancel('years:' + lit_type)
+            if lit_type in self.matrices:
+                self._set_view_matrix(lit_type, self.matrices[lit_type])
+            else:
+                pass
+            if lit_type in self.cache and (pairs is None or lit_type not in self.matrices):
+                # the grid is empty or still loading, or there are too many
+                # changes (bulk import), invalidate it
+                self.matrices.pop(lit_type, None)
+                self.parent.dbWorkers.cancel('grid:' + lit_type)
+                _t = self.cache.pop(lit_type)
+                _t.deleteLater()
+            else:   # built grids are updated below, unbuilt ones skipped
+                pass
 
-        r = self.parent.cursor.execute("SELECT DISTINCT mol FROM (SELECT mol1 AS mol FROM lit WHERE lit_type = ? UNION SELECT mol2 AS mol FROM lit WHERE lit_type = ?)t", (lit_type, lit_type))
+        for (lit_type, mol_a, mol_b, k, detail) in (pairs or []):
+            if lit_type in self.matrices and isinstance(self.cache[lit_type], HeatmapView):
+                self.cache[lit_type].set_pair(mol_a, mol_b, k, detail)
+            elif lit_type in self.matrices:
+                self.cache[lit_type].model().set_pair(mol_a, mol_b, k, detail)
+            else:   # invalidated in the meantime
+                pass
 
-        self.mol_list = []
-        for row in r.fetchall():
-            for x in row:
-                self.mol_list.append(x)
-        self.mol_list.sort()
+        # other processes may still need the log, only its old end is pruned
+        mylib.prune_changes(self.parent.cursor)
+        self.change_seq = seq
+        if self.yearCheck.isChecked():
+            self._load_years()
+        else:
+            pass
 
-    def _read_db_detail(self, lit_type):
-        ''' read item details from database for the selected lit_typeself.
-        Reform it to a (i, j):"bibkey: note" dictionary item,
-        where (i, j) is the table cell index, i >= j
+        if self.isVisible():
+            self._show_grid(self.chooseLitType.currentText())
+        else:
+            pass
 
-        Arguments
-        lit_type -- str from DEFAULT_LIT_TYPES
+        self.parent.show_timing('Refresh', t0)
 
-        Returns
-        (detail_txt str, k int) -> self.mol_detail[(lit_type, i, j)]
-        k is the number of records
-        '''
 
-        r = self.parent.cursor.execute("SELECT mol1, mol2, bibkey, note FROM lit WHERE lit_type = ?", (lit_type,))
+class MolGridModel(QtCore.QAbstractTableModel):
+    ''' Table model of the dimer matrix of one lit type.
+    Counts are served on demand from the sparse mylib.PairMatrix,
+    so no Qt item is allocated per cell.
+    '''
+
+    def __init__(self, matrix, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.matrix = matrix
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            return self.matrix.n
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        else:
+            return self.matrix.n
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        i = index.row()
+        j = index.column()
+        if not index.isValid() or j > i:   # lower triangular matrix only
+            return None
+        elif role == QtCore.Qt.DisplayRole:
+            return str(self.matrix.count(i, j))
+        elif role == QtCore.Qt.TextAlignmentRole:
+            return QtCore.Qt.AlignCenter
+        else:
+            return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            return self.matrix.mol_list[section]
+        else:
+            return None
+
+    def flags(self, index):
+        if index.isValid() and index.column() <= index.row():
+            return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+        else:
+            return QtCore.Qt.NoItemFlags
 
-        for row in r.fetchall():
-            (mol1, mol2, bibkey, note) = row
-            i = self.mol_list.index(mol1)
-            j = self.mol_list.index(mol2)
-            if i < j:
-                i, j = j, i
+    def set_matrix(self, matrix):
+        ''' show another matrix, e.g. of a year window '''
+
+        if matrix.n == self.matrix.n:
+            self.matrix = matrix
+            if matrix.n:
+                self.dataChanged.emit(self.index(0, 0), self.index(matrix.n - 1, matrix.n - 1))
             else:
                 pass
-            # update values in self.mol_detail
-            k = self.mol_detail[(lit_type, i, j)][1]
-            _this_str = self.mol_detail[(lit_type, i, j)][0]
-            if k == 0:
-                _this_str += "{:s}: {:s}".format(bibkey, note)
+        else:
+            self.beginResetModel()
+            self.matrix = matrix
+            self.endResetModel()
+
+    def set_pair(self, mol_a, mol_b, k, detail):
+        ''' update a single pair, add rows & columns for new molecules '''
+
+        if k and (self.matrix.index(mol_a) < 0 or self.matrix.index(mol_b) < 0):
+            # never-seen molecule, the row & column layout changes
+            self.beginResetModel()
+            self.matrix.set_pair(mol_a, mol_b, k, detail)
+            self.endResetModel()
+        else:
+            self.matrix.set_pair(mol_a, mol_b, k, detail)
+            i = self.matrix.index(mol_a)
+            j = self.matrix.index(mol_b)
+            if i >= 0 and j >= 0:
+                cell = self.index(max(i, j), min(i, j))
+                self.dataChanged.emit(cell, cell)
             else:
-                _this_str += "\n{:s}: {:s}".format(bibkey, note)
-            k += 1
-            self.mol_detail[(lit_type, i, j)] = (_this_str, k)
+                pass
 
 
-    def _refresh(self):
-        ''' refresh database '''
+class HeatmapView(QtWidgets.QWidget):
+    ''' Heatmap of the dimer matrix of one lit type, for matrices too large
+    for a table. Tiles are drawn at the level of detail of the zoom, see
+    mylib.HeatmapTiles. Wheel zooms, dragging pans, hovering shows the
+    pair under the cursor & a click selects it.
+    '''
+
+    cellClicked = QtCore.pyqtSignal(int, int)
+
+    MARGIN = 80         # px left of & above the cells for the molecule names
+    LABEL_SCALE = 12    # px per cell from which the names are drawn
+    MAX_SCALE = 40.
+
+    def __init__(self, matrix, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.matrix = matrix
+        self.tiles = mylib.HeatmapTiles(matrix)
+        self.scale = None       # px per cell, fit to the widget when shown
+        self.x0 = 0.            # cell at the left & top edges
+        self.y0 = 0.
+        self.dragPos = None
+        self.dragged = False
+        self.setMouseTracking(True)
+        self.setMinimumSize(300, 300)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+
+    def sizeHint(self):
+        return QtCore.QSize(800, 800)
+
+    def set_matrix(self, matrix):
+        ''' show another matrix of the same molecules, e.g. of a year window '''
+
+        self.matrix = matrix
+        self.tiles.matrix = matrix
+        self.tiles.invalidate()
+        self.update()
+
+    def set_pair(self, mol_a, mol_b, k, detail):
+        ''' update a single pair, see MolGridModel.set_pair '''
+
+        self.matrix.set_pair(mol_a, mol_b, k, detail)
+        self.tiles.invalidate()
+        self.update()
+
+    def _fit(self):
+        ''' whole matrix in view '''
+
+        side = min(self.width(), self.height()) - self.MARGIN
+        self.scale = min(max(side, 1) / max(self.matrix.n, 1), self.MAX_SCALE)
+        self.x0 = 0.
+        self.y0 = 0.
+
+    def _cell_at(self, pos):
+        ''' matrix coordinates (row, column) of a widget position '''
+
+        return (self.y0 + (pos.y() - self.MARGIN) / self.scale,
+                self.x0 + (pos.x() - self.MARGIN) / self.scale)
+
+    def _pair_at(self, pos):
+        ''' populated cell (i, j) under pos, None if empty. Zoomed out, the
+        pixel is a block of cells, the one with the most records is taken. '''
+
+        y, x = self._cell_at(pos)
+        if x < 0 or y < 0 or x >= self.matrix.n or y >= self.matrix.n:
+            return None
+        else:
+            pass
+        level = self.tiles.level_for(self.scale)
+
+        return self.tiles.block_cell(level, int(y) >> level, int(x) >> level)
+
+    def _image(self, level, ty, tx):
+        ''' tile as a QImage, over the cached buffer of self.tiles '''
+
+        argb = self.tiles.image(level, ty, tx)
+        size = self.tiles.size
+
+        return QtGui.QImage(argb.data, size, size, size * 4, QtGui.QImage.Format_ARGB32)
 
-        # clear previous widgets
-        keys = list(self.cache.keys())
-        for key in keys:
-            _t = self.cache.pop(key)
-            _t.deleteLater()
+    def paintEvent(self, event):
 
-        self._create_mol_grid(DEFAULT_LIT_TYPES)
+        if self.scale is None:
+            self._fit()
+        else:
+            pass
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), self.palette().window())
+        level = self.tiles.level_for(self.scale)
+        span = self.tiles.size << level     # cells per tile
+        n_tiles = self.tiles.n_tiles(level)
+        cells = QtCore.QRectF(self.MARGIN, self.MARGIN, self.width() - self.MARGIN, self.height() - self.MARGIN)
+        painter.setClipRect(cells)
+        # visible tiles of the lower triangle only
+        (y_top, x_left) = self._cell_at(QtCore.QPoint(self.MARGIN, self.MARGIN))
+        (y_bottom, x_right) = self._cell_at(QtCore.QPoint(self.width(), self.height()))
+        for ty in range(max(int(y_top) // span, 0), min(int(y_bottom) // span + 1, n_tiles)):
+            for tx in range(max(int(x_left) // span, 0), min(int(x_right) // span + 1, ty + 1)):
+                target = QtCore.QRectF(self.MARGIN + (tx * span - self.x0) * self.scale,
+                                       self.MARGIN + (ty * span - self.y0) * self.scale,
+                                       span * self.scale, span * self.scale)
+                painter.drawImage(target, self._image(level, ty, tx))
+        painter.setClipping(False)
+
+        # molecule names once they fit
+        if self.scale >= self.LABEL_SCALE:
+            first = max(int(min(x_left, y_top)), 0)
+            last = min(int(max(x_right, y_bottom)) + 1, self.matrix.n)
+            for k in range(first, last):
+                name = self.matrix.mol_list[k]
+                y = self.MARGIN + (k - self.y0) * self.scale
+                x = self.MARGIN + (k - self.x0) * self.scale
+                if y >= self.MARGIN:
+                    painter.drawText(QtCore.QRectF(0, y, self.MARGIN - 4, self.scale),
+                                     QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter, name)
+                else:
+                    pass
+                if x >= self.MARGIN:
+                    painter.save()
+                    painter.translate(x, self.MARGIN - 4)
+                    painter.rotate(-90)
+                    painter.drawText(QtCore.QRectF(0, 0, self.MARGIN - 4, self.scale),
+                                     QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter, name)
+                    painter.restore()
+                else:
+                    pass
+        else:
+            pass
+        painter.end()
+
+    def wheelEvent(self, event):
+        ''' zoom around the cursor '''
+
+        if self.scale is None:
+            self._fit()
+        else:
+            pass
+        pos = event.pos()
+        y, x = self._cell_at(pos)
+        factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+        min_scale = min(self.width(), self.height()) / max(self.matrix.n, 1) / 2
+        self.scale = min(max(self.scale * factor, min_scale), self.MAX_SCALE)
+        self.x0 = x - (pos.x() - self.MARGIN) / self.scale
+        self.y0 = y - (pos.y() - self.MARGIN) / self.scale
+        self.update()
+
+    def mousePressEvent(self, event):
+        self.dragPos = event.pos()
+        self.dragged = False
+
+    def mouseMoveEvent(self, event):
+        if self.dragPos is not None:    # pan
+            delta = event.pos() - self.dragPos
+            self.dragPos = event.pos()
+            self.dragged = True
+            self.x0 -= delta.x() / self.scale
+            self.y0 -= delta.y() / self.scale
+            self.update()
+        elif self.scale is not None:    # hover
+            pair = self._pair_at(event.pos())
+            if pair:
+                (i, j) = pair
+                QtWidgets.QToolTip.showText(event.globalPos(), '{:s} - {:s}: {:d}'.format(
+                    self.matrix.mol_list[i], self.matrix.mol_list[j], self.matrix.count(i, j)), self)
+            else:
+                QtWidgets.QToolTip.hideText()
+        else:
+            pass
+
+    def mouseReleaseEvent(self, event):
+        if not self.dragged:
+            pair = self._pair_at(event.pos())
+            if pair:
+                self.cellClicked.emit(*pair)
+            else:
+                pass
+        else:
+            pass
+        self.dragPos = None
+
+    def mouseDoubleClickEvent(self, event):
+        ''' back to the whole matrix '''
+
+        self._fit()
+        self.update()
+
+
+class DbJobSignals(QtCore.QObject):
+    ''' Signals of DbJob. QRunnable is not a QObject. '''
+
+    finished = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+    done = QtCore.pyqtSignal()
+
+
+class DbJob(QtCore.QRunnable):
+    ''' Run func(cursor, *args) in a worker thread, on a connection
+    borrowed from readers, or on a private writable connection if
+    readers is None. The result is delivered by signals.
+    '''
+
+    def __init__(self, db_name, func, args, readers=None):
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.db_name = db_name
+        self.func = func
+        self.args = args
+        self.readers = readers
+        self.cancelled = False
+        self.signals = DbJobSignals()
+
+    def cancel(self):
+        ''' the progress handler aborts the running statement '''
+        self.cancelled = True
+
+    def _progress(self):
+        return 1 if self.cancelled else 0
+
+    def run(self):
+        if self.cancelled:
+            self.signals.done.emit()
+            return None
+        else:
+            pass
+
+        if self.readers:
+            conn = self.readers.get()
+        else:
+            conn = mylib.connect(self.db_name)
+        conn.set_progress_handler(self._progress, 1000)
+        try:
+            with mylib.TRACER.span(self.func.__name__, 'job'):
+                result = self.func(conn.cursor(mylib.TracingCursor), *self.args)
+        except Exception as err:
+            if not self.cancelled:
+                self.signals.error.emit(str(err))
+            else:   # interrupted by cancel()
+                pass
+        else:
+            self.signals.finished.emit(result)
+        finally:
+            conn.set_progress_handler(None, 0)
+            if self.readers:
+                self.readers.put(conn)
+            else:
+                conn.close()
+            self.signals.done.emit()
+
+
+class DbWorkers(QtCore.QObject):
+    ''' Run database jobs off the GUI thread.
+    A job started with a tag cancels the running job of the same tag,
+    and results of cancelled jobs are never delivered.
+    '''
+
+    # labels of running jobs, '' when idle
+    busy = QtCore.pyqtSignal(str)
+
+    def __init__(self, db_name, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.db_name = db_name
+        self.pool = QtCore.QThreadPool(self)
+        # one read only connection per worker thread at most
+        self.readers = mylib.ReadPool(db_name, self.pool.maxThreadCount())
+        self.jobs = {}      # job -> label
+        self.tagged = {}    # tag -> job
+
+    def run(self, label, func, args=(), callback=None, tag=None, write=False):
+        ''' run func(cursor, *args), callback(result) in the GUI thread.
+        func gets a read only connection unless write is True. '''
+
+        if tag:
+            self.cancel(tag)
+        else:
+            pass
+
+        job = DbJob(self.db_name, func, args, None if write else self.readers)
+        job.signals.finished.connect(lambda result: self._deliver(job, callback, result))
+        job.signals.error.connect(lambda err: self._fail(job, label, err))
+        job.signals.done.connect(lambda: self._done(job, tag))
+        self.jobs[job] = label
+        if tag:
+            self.tagged[tag] = job
+        else:
+            pass
+        self._emit_busy()
+        self.pool.start(job)
+
+        return job
+
+    def cancel(self, tag):
+        ''' cancel the running job of tag '''
+
+        job = self.tagged.pop(tag, None)
+        if job:
+            job.cancel()
+        else:
+            pass
+
+    def cancel_all(self):
+
+        for job in self.jobs:
+            job.cancel()
+        self.tagged = {}
+
+    def wait(self):
+        self.pool.waitForDone()
+
+    def close(self):
+        ''' wait for the running jobs, and close the connections '''
+
+        self.wait()
+        self.readers.close()
+
+    def _deliver(self, job, callback, result):
+        if callback and not job.cancelled:
+            with mylib.TRACER.span(self.jobs.get(job, ''), 'qt'):
+                callback(result)
+        else:
+            pass
+
+    def _fail(self, job, label, err):
+        if not job.cancelled:
+            msg = MsgWarning(self.parent(), 'Database error', '{:s} failed: {:s}'.format(label, err))
+            msg.exec_()
+        else:
+            pass
+
+    def _done(self, job, tag):
+        self.jobs.pop(job, None)
+        if tag and self.tagged.get(tag) is job:
+            self.tagged.pop(tag)
+        else:
+            pass
+        self._emit_busy()
+
+    def _emit_busy(self):
+        self.busy.emit(', '.join(sorted(set(self.jobs.values()))))
+
+
+class MolCompleter(QtWidgets.QCompleter):
+    ''' Popup of the molecule names starting with the text of lineEdit,
+    read from a mylib.MolIndex at each keystroke. '''
+
+    LIMIT = 20
+
+    def __init__(self, index, lineEdit):
+        QtWidgets.QCompleter.__init__(self, lineEdit)
+        self.index = index
+        self.names = QtCore.QStringListModel(self)
+        self.setModel(self.names)
+        # already filtered by the index
+        self.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        lineEdit.setCompleter(self)
+        lineEdit.textEdited.connect(self._update)
+
+    def _update(self, text):
+
+        names = self.index.complete(text, self.LIMIT) if text else []
+        self.names.setStringList(names)
+        if names and names != [text]:
+            self.complete()
+        else:
+            self.popup().hide()
 
 
 class MsgWarning(QtWidgets.QMessageBox):
@@ -703,20 +1804,9 @@ class MsgWarning(QtWidgets.QMessageBox):
         self.setText(moretext)
 
 
-def create_db(db_name):
-    ''' Create database '''
-    conn = sqlite3.connect(db_name)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS lit
-                (id INTEGER PRIMARY KEY AUTOINCREMENT, mol1 TEXT NOT NULL, mol2 TEXT NOT NULL, lit_type TEXT NOT NULL, year INT NOT NULL, bibkey TEXT NOT NULL, note TEXT)
-                ''')
-    conn.commit()
-    conn.close()
-
-
 if __name__ == '__main__':
 
-    create_db(DB)
+    mylib.create_db(DB)
 
     app = QtWidgets.QApplication(sys.argv)
 
@@ -1,65 +1,1974 @@
 #! encoding = utf-8
 
-def gen_search_sql_str(search_opts):
-    ''' Generate sqlite3 inqury strings.
+'''
+Qt-free core of the dimer literature database: schema, search, entry
+writes, dimer matrices and bulk import. Also a command line interface
+for batch jobs, see "python -m mylib -h".
+'''
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import queue
+import sqlite3
+import pathlib
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+import planner
+from planner import LIT_COLUMNS, unpack_search_opts
+
+try:
+    import numpy as np
+except ImportError:     # only the heatmap view needs numpy
+    np = None
+
+DB = 'dimer_lit.db'
+DEFAULT_LIT_TYPES = ['Microwave', '(sub)mm', 'IR', 'Theory']
+
+# recount the pair of the OLD / NEW row into pair_counts, used by triggers
+_PAIR_RECOUNT = '''DELETE FROM pair_counts WHERE lit_type = {row}.lit_type AND mol_a = min({row}.mol1, {row}.mol2) AND mol_b = max({row}.mol1, {row}.mol2);
+        INSERT INTO pair_counts (lit_type, mol_a, mol_b, n, detail)
+        SELECT lit_type, min(mol1, mol2), max(mol1, mol2), count(*), group_concat(bibkey || ': ' || ifnull(note, ''), char(10)) FROM lit
+        WHERE lit_type = {row}.lit_type AND ((mol1 = {row}.mol1 AND mol2 = {row}.mol2) OR (mol1 = {row}.mol2 AND mol2 = {row}.mol1))
+        GROUP BY lit_type, min(mol1, mol2), max(mol1, mol2);'''
+
+# triggers keeping the change log, pair_counts & lit_fts in sync with lit
+_LIT_CHANGE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS lit_change_insert AFTER INSERT ON lit BEGIN
+        INSERT INTO lit_change (lit_type, mol1, mol2) VALUES (NEW.lit_type, NEW.mol1, NEW.mol2);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS lit_change_delete AFTER DELETE ON lit BEGIN
+        INSERT INTO lit_change (lit_type, mol1, mol2) VALUES (OLD.lit_type, OLD.mol1, OLD.mol2);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS lit_change_update AFTER UPDATE ON lit BEGIN
+        INSERT INTO lit_change (lit_type, mol1, mol2) VALUES (OLD.lit_type, OLD.mol1, OLD.mol2);
+        INSERT INTO lit_change (lit_type, mol1, mol2) VALUES (NEW.lit_type, NEW.mol1, NEW.mol2);
+        END''']
+
+_PAIR_COUNTS_TRIGGERS = [
+    # an insert only appends, no need to recount
+    '''CREATE TRIGGER IF NOT EXISTS pair_counts_insert AFTER INSERT ON lit BEGIN
+        INSERT INTO pair_counts (lit_type, mol_a, mol_b, n, detail)
+        VALUES (NEW.lit_type, min(NEW.mol1, NEW.mol2), max(NEW.mol1, NEW.mol2), 1, NEW.bibkey || ': ' || ifnull(NEW.note, ''))
+        ON CONFLICT (lit_type, mol_a, mol_b) DO UPDATE SET n = n + 1, detail = detail || char(10) || excluded.detail;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS pair_counts_delete AFTER DELETE ON lit BEGIN
+        ''' + _PAIR_RECOUNT.format(row='OLD') + '''
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS pair_counts_update AFTER UPDATE ON lit BEGIN
+        ''' + _PAIR_RECOUNT.format(row='OLD') + '''
+        ''' + _PAIR_RECOUNT.format(row='NEW') + '''
+        END''']
+
+_LIT_FTS_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS lit_fts_insert AFTER INSERT ON lit BEGIN
+        INSERT INTO lit_fts (rowid, bibkey, note) VALUES (NEW.id, NEW.bibkey, NEW.note);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS lit_fts_delete AFTER DELETE ON lit BEGIN
+        INSERT INTO lit_fts (lit_fts, rowid, bibkey, note) VALUES ('delete', OLD.id, OLD.bibkey, OLD.note);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS lit_fts_update AFTER UPDATE ON lit BEGIN
+        INSERT INTO lit_fts (lit_fts, rowid, bibkey, note) VALUES ('delete', OLD.id, OLD.bibkey, OLD.note);
+        INSERT INTO lit_fts (rowid, bibkey, note) VALUES (NEW.id, NEW.bibkey, NEW.note);
+        END''']
+
+# Schema migrations. MIGRATIONS[v-1] upgrades a database from
+# PRAGMA user_version = v-1 to v. Never edit a released step, append a new one.
+MIGRATIONS = [
+    # 1: literature table & change log of the dimer pairs touched by each write
+    ['''CREATE TABLE IF NOT EXISTS lit
+        (id INTEGER PRIMARY KEY AUTOINCREMENT, mol1 TEXT NOT NULL, mol2 TEXT NOT NULL, lit_type TEXT NOT NULL, year INT NOT NULL, bibkey TEXT NOT NULL, note TEXT)''',
+     '''CREATE TABLE IF NOT EXISTS lit_change
+        (seq INTEGER PRIMARY KEY AUTOINCREMENT, lit_type TEXT NOT NULL, mol1 TEXT NOT NULL, mol2 TEXT NOT NULL)'''] + _LIT_CHANGE_TRIGGERS,
+    # 2: indexes matching the query shapes
+    #   lit_pair -- matrix builds & pair reads by lit_type, lit type search
+    #   lit_mol2 -- searches on mol2, the mol2 side of pair searches
+    #   lit_year -- year range searches & ordering by year
+    #   lit_dup  -- duplicate checks, searches on mol1
+    ['''CREATE INDEX IF NOT EXISTS lit_pair ON lit (lit_type, mol1, mol2)''',
+     '''CREATE INDEX IF NOT EXISTS lit_mol2 ON lit (mol2, mol1)''',
+     '''CREATE INDEX IF NOT EXISTS lit_year ON lit (year)''',
+     '''CREATE INDEX IF NOT EXISTS lit_dup ON lit (mol1, mol2, year, bibkey)''',
+     '''ANALYZE'''],
+    # 3: duplicates are rejected by a UNIQUE constraint. Identical copies
+    #    are merged into the oldest one, distinct records are never deleted:
+    #    the upgrade stops until they are told apart, see _check_duplicates
+    ['''DELETE FROM lit WHERE id NOT IN (SELECT min(id) FROM lit GROUP BY mol1, mol2, lit_type, year, bibkey, note)''',
+     lambda conn: _check_duplicates(conn),
+     '''DROP INDEX IF EXISTS lit_dup''',
+     '''CREATE UNIQUE INDEX lit_dup ON lit (mol1, mol2, year, bibkey)'''],
+    # 4: binary snapshots of the dimer matrices, valid while seq matches
+    #    the change sequence number, see load_matrices
+    ['''CREATE TABLE IF NOT EXISTS matrix_snapshot
+        (lit_type TEXT PRIMARY KEY, seq INTEGER NOT NULL, fmt TEXT NOT NULL, mols BLOB NOT NULL, indptr BLOB NOT NULL, indices BLOB NOT NULL, counts BLOB NOT NULL, details BLOB NOT NULL)'''],
+    # 5: record counts & "bibkey: note" details per dimer pair, kept in sync
+    #    by triggers. mol_a <= mol_b, so (A, B) and (B, A) share a row.
+    ['''CREATE TABLE IF NOT EXISTS pair_counts
+        (lit_type TEXT NOT NULL, mol_a TEXT NOT NULL, mol_b TEXT NOT NULL, n INTEGER NOT NULL, detail TEXT NOT NULL, PRIMARY KEY (lit_type, mol_a, mol_b)) WITHOUT ROWID''',
+     '''INSERT INTO pair_counts (lit_type, mol_a, mol_b, n, detail)
+        SELECT lit_type, min(mol1, mol2), max(mol1, mol2), count(*), group_concat(bibkey || ': ' || ifnull(note, ''), char(10)) FROM lit
+        GROUP BY lit_type, min(mol1, mol2), max(mol1, mol2)'''] + _PAIR_COUNTS_TRIGGERS,
+    # 6: full-text index over bibkey & note, an external content FTS5 table
+    #    reading its text from lit, kept in sync by triggers
+    ['''CREATE VIRTUAL TABLE IF NOT EXISTS lit_fts USING fts5
+        (bibkey, note, content='lit', content_rowid='id', tokenize='porter unicode61')''',
+     '''INSERT INTO lit_fts (lit_fts) VALUES ('rebuild')'''] + _LIT_FTS_TRIGGERS,
+    # 7: molecule dictionary. lit, lit_change & pair_counts refer to molecules
+    #    by integer id. mol_alias maps every spelling, the canonical name
+    #    included, to its molecule. Ids & the change sequence are kept, so
+    #    lit_fts & the matrix snapshots stay valid.
+    ['''CREATE TABLE IF NOT EXISTS molecule
+        (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)''',
+     '''CREATE TABLE IF NOT EXISTS mol_alias
+        (name TEXT PRIMARY KEY, mol_id INTEGER NOT NULL REFERENCES molecule (id)) WITHOUT ROWID''',
+     '''CREATE TRIGGER IF NOT EXISTS molecule_insert AFTER INSERT ON molecule BEGIN
+        INSERT OR IGNORE INTO mol_alias (name, mol_id) VALUES (NEW.name, NEW.id);
+        END''',
+     '''INSERT INTO molecule (name) SELECT mol1 FROM lit UNION SELECT mol2 FROM lit
+        UNION SELECT mol1 FROM lit_change UNION SELECT mol2 FROM lit_change''',
+     '''CREATE TABLE lit_new
+        (id INTEGER PRIMARY KEY AUTOINCREMENT, mol1 INTEGER NOT NULL REFERENCES molecule (id), mol2 INTEGER NOT NULL REFERENCES molecule (id), lit_type TEXT NOT NULL, year INT NOT NULL, bibkey TEXT NOT NULL, note TEXT)''',
+     '''INSERT INTO lit_new (id, mol1, mol2, lit_type, year, bibkey, note)
+        SELECT lit.id, m1.id, m2.id, lit.lit_type, lit.year, lit.bibkey, lit.note FROM lit
+        JOIN molecule AS m1 ON m1.name = lit.mol1 JOIN molecule AS m2 ON m2.name = lit.mol2''',
+     '''DROP TABLE lit''',
+     '''ALTER TABLE lit_new RENAME TO lit''',
+     '''CREATE TABLE lit_change_new
+        (seq INTEGER PRIMARY KEY AUTOINCREMENT, lit_type TEXT NOT NULL, mol1 INTEGER NOT NULL, mol2 INTEGER NOT NULL)''',
+     '''INSERT INTO lit_change_new (seq, lit_type, mol1, mol2)
+        SELECT c.seq, c.lit_type, m1.id, m2.id FROM lit_change AS c
+        JOIN molecule AS m1 ON m1.name = c.mol1 JOIN molecule AS m2 ON m2.name = c.mol2''',
+     # carry the change sequence number over, even if the log is pruned
+     "DELETE FROM sqlite_sequence WHERE name = 'lit_change_new'",
+     "INSERT INTO sqlite_sequence (name, seq) SELECT 'lit_change_new', seq FROM sqlite_sequence WHERE name = 'lit_change'",
+     '''DROP TABLE lit_change''',
+     '''ALTER TABLE lit_change_new RENAME TO lit_change''',
+     '''DROP TABLE pair_counts''',
+     '''CREATE TABLE pair_counts
+        (lit_type TEXT NOT NULL, mol_a INTEGER NOT NULL, mol_b INTEGER NOT NULL, n INTEGER NOT NULL, detail TEXT NOT NULL, PRIMARY KEY (lit_type, mol_a, mol_b)) WITHOUT ROWID''',
+     '''INSERT INTO pair_counts (lit_type, mol_a, mol_b, n, detail)
+        SELECT lit_type, min(mol1, mol2), max(mol1, mol2), count(*), group_concat(bibkey || ': ' || ifnull(note, ''), char(10)) FROM lit
+        GROUP BY lit_type, min(mol1, mol2), max(mol1, mol2)''',
+     '''CREATE INDEX lit_pair ON lit (lit_type, mol1, mol2)''',
+     '''CREATE INDEX lit_mol2 ON lit (mol2, mol1)''',
+     '''CREATE INDEX lit_year ON lit (year)''',
+     '''CREATE UNIQUE INDEX lit_dup ON lit (mol1, mol2, year, bibkey)''',
+     # search results, with the molecule names
+     '''CREATE VIEW IF NOT EXISTS lit_entry AS
+        SELECT lit.id AS id, m1.name AS mol1, m2.name AS mol2, lit.lit_type AS lit_type, lit.year AS year, lit.bibkey AS bibkey, lit.note AS note,
+        lit.mol1 AS mol1_id, lit.mol2 AS mol2_id FROM lit
+        JOIN molecule AS m1 ON m1.id = lit.mol1 JOIN molecule AS m2 ON m2.id = lit.mol2''',
+     '''ANALYZE'''] + _LIT_CHANGE_TRIGGERS + _PAIR_COUNTS_TRIGGERS + _LIT_FTS_TRIGGERS,
+    # 8: indexes of the search sort keys. An index ends with the rowid, so
+    #    it serves ORDER BY key, id of the keyset pages without a sort
+    #   lit_mol1     -- 'Mol' sort, walking the molecule names in order
+    #   lit_lit_type -- 'Lit Type' sort ('Year' has lit_year)
+    ['''CREATE INDEX IF NOT EXISTS lit_mol1 ON lit (mol1)''',
+     '''CREATE INDEX IF NOT EXISTS lit_lit_type ON lit (lit_type)''',
+     '''ANALYZE'''],
+]
+
+# id of a molecule by any of its names, NULL if unknown
+SQL_MOL_ID = "(SELECT mol_id FROM mol_alias WHERE name = ?)"
+# add a molecule, unless the name is known
+SQL_ADD_MOL = "INSERT INTO molecule (name) SELECT ?1 WHERE NOT EXISTS (SELECT 1 FROM mol_alias WHERE name = ?1)"
+SQL_CHECK_DUPLICATES = "SELECT bibkey FROM lit WHERE mol1 = {0:s} AND mol2 = {0:s} AND year = (?) AND bibkey = (?)".format(SQL_MOL_ID)
+SQL_CHECK_DUPLICATES_NOTE = "SELECT bibkey FROM lit WHERE mol1 = {0:s} AND mol2 = {0:s} AND year = (?) AND bibkey = (?) AND note = (?)".format(SQL_MOL_ID)
+# distinct records of the same UNIQUE key (mol1, mol2, year, bibkey)
+SQL_LIT_CONFLICTS = "SELECT group_concat(id, ', '), mol1, mol2, year, bibkey FROM lit GROUP BY mol1, mol2, year, bibkey HAVING count(*) > 1"
+SQL_KEY_IDS = "SELECT id FROM lit WHERE mol1 = {0:s} AND mol2 = {0:s} AND year = (?) AND bibkey = (?)".format(SQL_MOL_ID)
+SQL_PAIR_COUNTS = "SELECT p.lit_type, a.name, b.name, p.n, p.detail FROM pair_counts AS p JOIN molecule AS a ON a.id = p.mol_a JOIN molecule AS b ON b.id = p.mol_b WHERE p.lit_type in ({:s})"
+# pairs in the lower triangle order of PairMatrix: row (max name), then column
+SQL_EXPORT_PAIRS = "SELECT p.lit_type, min(a.name, b.name) AS mol_a, max(a.name, b.name) AS mol_b, p.n FROM pair_counts AS p JOIN molecule AS a ON a.id = p.mol_a JOIN molecule AS b ON b.id = p.mol_b WHERE p.lit_type in ({:s}) ORDER BY p.lit_type, mol_b, mol_a"
+SQL_EXPORT_MOLS = "SELECT name FROM molecule WHERE id IN (SELECT mol_a FROM pair_counts WHERE lit_type = ?1 UNION SELECT mol_b FROM pair_counts WHERE lit_type = ?1) ORDER BY name"
+# distinct bibkeys of the search query {:s}, see export_search
+SQL_EXPORT_BIBKEYS = "SELECT bibkey FROM ({:s}) GROUP BY bibkey ORDER BY bibkey"
+# records per dimer pair & year of a lit type, for the year window
+SQL_PAIR_YEARS = "SELECT a.name, b.name, lit.year, count(*) FROM lit JOIN molecule AS a ON a.id = min(lit.mol1, lit.mol2) JOIN molecule AS b ON b.id = max(lit.mol1, lit.mol2) WHERE lit.lit_type = ? GROUP BY a.id, b.id, lit.year"
+SQL_PAIR = "SELECT p.n, p.detail FROM mol_alias AS a JOIN mol_alias AS b JOIN pair_counts AS p ON p.mol_a = min(a.mol_id, b.mol_id) AND p.mol_b = max(a.mol_id, b.mol_id) WHERE p.lit_type = ? AND a.name = ? AND b.name = ?"
+SQL_CHANGES = "SELECT c.seq, c.lit_type, min(a.name, b.name), max(a.name, b.name) FROM lit_change AS c JOIN molecule AS a ON a.id = c.mol1 JOIN molecule AS b ON b.id = c.mol2 WHERE c.seq > ? ORDER BY c.seq"
+SQL_PRUNE_CHANGES = "DELETE FROM lit_change WHERE seq <= ?"
+# last pruned seq, changes up to it are gone (seq has no gaps)
+SQL_PRUNED_SEQ = "SELECT ifnull((SELECT min(seq) FROM lit_change) - 1, (SELECT seq FROM sqlite_sequence WHERE name = 'lit_change'))"
+# writes to lit bump the change seq, a new alias adds a name
+SQL_DATA_VERSION = "SELECT (SELECT seq FROM sqlite_sequence WHERE name = 'lit_change'), (SELECT count(*) FROM mol_alias)"
+SQL_LOAD_SNAPSHOT = "SELECT lit_type, mols, indptr, indices, counts, details FROM matrix_snapshot WHERE seq = ? AND fmt = ? AND lit_type in ({:s})"
+SQL_SAVE_SNAPSHOT = "INSERT OR REPLACE INTO matrix_snapshot (lit_type, seq, fmt, mols, indptr, indices, counts, details) VALUES (?,?,?,?,?,?,?,?)"
+# mol1 & mol2 are names, add them with SQL_ADD_MOL first
+SQL_INSERT = "INSERT INTO lit (mol1, mol2, lit_type, year, bibkey, note) VALUES ({0:s},{0:s},?,?,?,?)".format(SQL_MOL_ID)
+SQL_UPDATE = "UPDATE lit SET mol1 = {0:s}, mol2 = {0:s}, lit_type = (?), year = (?), bibkey = (?), note = (?) WHERE id = (?)".format(SQL_MOL_ID)
+# free the key of an entry it is about to leave, bibkeys never hold a NUL
+SQL_PARK_KEY = "UPDATE lit SET bibkey = char(0) || id WHERE id = ?7 AND NOT (mol1 IS (SELECT mol_id FROM mol_alias WHERE name = ?1) AND mol2 IS (SELECT mol_id FROM mol_alias WHERE name = ?2) AND year = ?4 AND bibkey = ?5)"
+SQL_INSERT_IGNORE = "INSERT OR IGNORE INTO lit (mol1, mol2, lit_type, year, bibkey, note) VALUES ({0:s},{0:s},?,?,?,?)".format(SQL_MOL_ID)
+
+
+def _check_duplicates(conn):
+    ''' Stop migration 3 if distinct records share (mol1, mol2, year,
+    bibkey), the key of the UNIQUE index: which one to keep is up to
+    the user. The message lists them with their ids. '''
+
+    rows = conn.execute(SQL_LIT_CONFLICTS).fetchall()
+    if rows:
+        lines = ['  ids {:s}: {:s} {:s} {} {:s}'.format(*row) for row in rows[:20]]
+        if len(rows) > 20:
+            lines.append('  ... {:d} more'.format(len(rows) - 20))
+        else:
+            pass
+        raise sqlite3.IntegrityError(
+            'Cannot upgrade the database: {:d} groups of distinct records share mol1, mol2, year & bibkey.\n'
+            '{:s}\nGive them distinct bibkeys, or delete the extra records, e.g. in the sqlite3 shell:\n'
+            '  UPDATE lit SET bibkey = bibkey || \'b\' WHERE id = ...;\n'
+            'then open the database again. Nothing was changed.'.format(len(rows), '\n'.join(lines)))
+    else:
+        pass
+
+
+def migrate(conn):
+    ''' Upgrade the database schema to the latest version. Each step runs
+    in its own transaction together with its PRAGMA user_version bump.
+    A step is a list of SQL strings, or of functions called with conn.
+
+    Returns
+    version -- int, the schema version of the database
+    '''
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for v in range(version, len(MIGRATIONS)):
+        conn.execute("BEGIN")
+        try:
+            for sql_str in MIGRATIONS[v]:
+                if callable(sql_str):
+                    sql_str(conn)
+                else:
+                    conn.execute(sql_str)
+            conn.execute("PRAGMA user_version = {:d}".format(v+1))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    return max(version, len(MIGRATIONS))
+
+
+# per connection settings, see connect
+#   synchronous -- NORMAL is safe with WAL, a commit only fsyncs at checkpoints
+#   cache_size  -- negative: KiB of page cache
+#   mmap_size   -- bytes of the database file read through mmap
+PRAGMAS = [('synchronous', 'NORMAL'), ('cache_size', -20000), ('mmap_size', 268435456)]
+# prepared statements kept by each connection
+CACHED_STATEMENTS = 256
+# seconds a connection waits for a lock held by another one
+BUSY_TIMEOUT = 10.
+# changes kept in the lit_change log for the readers, see prune_changes
+CHANGE_LOG_KEEP = 10000
+
+
+def connect(db_name, read_only=False, check_same_thread=True):
+    ''' Open a tuned connection. Writable connections switch the database
+    to WAL, so readers (the GUI, a CLI process) never block the writer
+    and the other way round.
 
     Arguments
-    search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types)
+    db_name           -- str, database file, or ':memory:'
+    read_only         -- bool, open the file read only
+    check_same_thread -- bool, False to hand the connection to other
+                         threads, one at a time
 
     Returns
+    conn -- sqlite3.Connection
+    '''
+
+    if read_only and db_name != ':memory:':
+        uri = pathlib.Path(db_name).absolute().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=check_same_thread, uri=True)
+    else:
+        conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=check_same_thread)
+        # persistent, stored in the database file
+        conn.execute("PRAGMA journal_mode = WAL")
+
+    for (name, value) in PRAGMAS:
+        conn.execute("PRAGMA {:s} = {}".format(name, value))
+
+    return conn
+
+
+class ReadPool(object):
+    ''' A small pool of read only connections shared by worker threads.
+    Connections are opened on demand, up to size; beyond that get() waits
+    for one to be put back. '''
+
+    def __init__(self, db_name, size=4):
+        self.db_name = db_name
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        ''' borrow a connection '''
+
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.opened) < self.size:
+                conn = connect(self.db_name, read_only=True, check_same_thread=False)
+                self.opened.append(conn)
+                return conn
+            else:
+                pass
+        return self.idle.get()
+
+    def put(self, conn):
+        ''' give a connection back, ending what it left open '''
+
+        if conn.in_transaction:
+            conn.rollback()
+        else:
+            pass
+        self.idle.put(conn)
+
+    def close(self):
+        ''' close all connections, none may be borrowed '''
+
+        with self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+            self.idle = queue.LifoQueue()
+
+
+class Tracer(object):
+    ''' Records timing spans (name, category, start, end, thread, args)
+    while enabled. Categories used by the app:
+        sql -- a statement or a fetch of rows, see TracingCursor
+        job -- a database job in a worker thread, SQL included
+        qt  -- widget & model updates in the GUI thread
+        ui  -- a user operation, from the click to the last update
+    Thread safe, the oldest spans are dropped beyond size.
+    '''
+
+    def __init__(self, enabled=False, size=100000):
+        self.enabled = enabled
+        self.events = deque(maxlen=size)
+
+    def add(self, name, cat, t0, t1, **args):
+        ''' record a span of time.perf_counter() t0 to t1 '''
+
+        if self.enabled:
+            self.events.append((name, cat, t0, t1, threading.get_ident(), args))
+        else:
+            pass
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        ''' record the with block as a span '''
+
+        if not self.enabled:
+            yield args
+            return None
+        else:
+            pass
+        t0 = time.perf_counter()
+        try:
+            yield args      # may be filled, e.g. with a row count
+        finally:
+            self.add(name, cat, t0, time.perf_counter(), **args)
+
+    def clear(self):
+        self.events.clear()
+
+    def breakdown(self, t0, t1):
+        ''' Sum the spans overlapping t0 to t1 by category.
+
+        Returns
+        stats -- dict, seconds of sql, job, qt (time inside t0 to t1),
+                 python (job time outside SQL), queries & rows
+        '''
+
+        stats = {'sql': 0., 'job': 0., 'qt': 0., 'queries': 0, 'rows': 0}
+        for (name, cat, s0, s1, tid, args) in list(self.events):
+            if cat in stats and s1 > t0 and s0 < t1:
+                stats[cat] += min(s1, t1) - max(s0, t0)
+                if cat == 'sql':
+                    stats['queries'] += name != 'fetch'
+                    stats['rows'] += args.get('rows', 0)
+                else:
+                    pass
+            else:
+                pass
+        stats['python'] = max(stats['job'] - stats['sql'], 0.)
+
+        return stats
+
+    def dump(self, filename):
+        ''' Write the spans as Chrome trace JSON, for chrome://tracing or
+        https://ui.perfetto.dev '''
+
+        events = list(self.events)
+        start = min((e[2] for e in events), default=0.)
+        pid = os.getpid()
+        trace = [{'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                  'ts': (t0 - start) * 1e6, 'dur': (t1 - t0) * 1e6, 'args': args}
+                 for (name, cat, t0, t1, tid, args) in events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+# DIMER_TRACE=1 turns tracing on, DIMER_TRACE=file.json also saves the
+# trace to the file on exit
+TRACER = Tracer(enabled=bool(os.environ.get('DIMER_TRACE')))
+
+
+class TracingCursor(sqlite3.Cursor):
+    ''' Cursor recording its statements in TRACER, if enabled: a span
+    per execute, with the number of changed rows, and a 'fetch' span per
+    fetch, with the number of rows read. Use conn.cursor(TracingCursor). '''
+
+    def execute(self, sql_str, sql_arg=()):
+        with TRACER.span(sql_str.split(None, 1)[0], 'sql', sql=sql_str) as args:
+            sqlite3.Cursor.execute(self, sql_str, sql_arg)
+            args['rows'] = max(self.rowcount, 0)
+        return self
+
+    def executemany(self, sql_str, seq_of_args):
+        with TRACER.span(sql_str.split(None, 1)[0], 'sql', sql=sql_str) as args:
+            sqlite3.Cursor.executemany(self, sql_str, seq_of_args)
+            args['rows'] = max(self.rowcount, 0)
+        return self
+
+    def fetchone(self):
+        with TRACER.span('fetch', 'sql') as args:
+            row = sqlite3.Cursor.fetchone(self)
+            args['rows'] = 0 if row is None else 1
+        return row
+
+    def fetchmany(self, size=None):
+        with TRACER.span('fetch', 'sql') as args:
+            rows = sqlite3.Cursor.fetchmany(self, self.arraysize if size is None else size)
+            args['rows'] = len(rows)
+        return rows
+
+    def fetchall(self):
+        with TRACER.span('fetch', 'sql') as args:
+            rows = sqlite3.Cursor.fetchall(self)
+            args['rows'] = len(rows)
+        return rows
+
+
+def create_db(db_name):
+    ''' Create database, or upgrade its schema '''
+    conn = connect(db_name)
+    migrate(conn)
+    conn.close()
+
+
+def uses_index(cursor, sql_str, sql_arg=(), ordered=False):
+    ''' Check with EXPLAIN QUERY PLAN that a query does not fall back to a
+    full scan: no table is scanned without an index, and lit (the view
+    lit_entry reads lit) is only searched, never scanned, even through an
+    index. An ordered page must not sort: its rows come in index order,
+    so its LIMIT stops a scan of lit early.
+
+    Arguments
+    cursor  -- sqlite3 cursor
     sql_str -- str, sqlite3 query string
-    sql_arg -- single value / list, sqlite3 query arguments
+    sql_arg -- sqlite3 query arguments
+    ordered -- bool, the query is a page, ORDER BY ... LIMIT
+
+    Returns
+    ok   -- bool, True if the plan passes the checks above
+    plan -- list of str, the query plan
+    '''
+
+    r = cursor.execute("EXPLAIN QUERY PLAN " + sql_str, sql_arg)
+    plan = [row[-1] for row in r.fetchall()]
+    # a plain "SCAN table" without "USING ..." reads the whole table
+    bare_scan = any(re.match(r"SCAN \w+$", detail) for detail in plan)
+    lit_scan = any(re.match(r"SCAN lit(_entry)?\b", detail) for detail in plan)
+    sort = any(re.match(r"USE TEMP B-TREE FOR .*ORDER BY", detail) for detail in plan)
+    if ordered:
+        ok = not bare_scan and not sort
+    else:
+        ok = not bare_scan and not lit_scan
+
+    return ok, plan
+
+
+# SQL of the searches, from canonical templates, see planner
+gen_search_sql_str = planner.search_sql
+gen_page_sql_str = planner.page_sql
+gen_count_sql_str = planner.count_sql
+# reuse of the search templates, all connections together, see StatementStats
+STATEMENTS = planner.StatementStats(CACHED_STATEMENTS)
+
+
+def search_page(cursor, search_opts, sort_opt, last_row=None, limit=100):
+    ''' Read one page of search results, see gen_page_sql_str.
+
+    Returns
+    rows -- list of (pid, mol1, mol2, lit_type, year, bibkey, note),
+            full-text searches add (snippet, score)
+    '''
+
+    sql_str, sql_arg = gen_page_sql_str(search_opts, sort_opt, last_row, limit)
+    STATEMENTS.record(sql_str)
+
+    return cursor.execute(sql_str, sql_arg).fetchall()
+
+
+def search_count(cursor, search_opts):
+    ''' Count all search results '''
+
+    sql_str, sql_arg = gen_count_sql_str(search_opts)
+    STATEMENTS.record(sql_str)
 
+    return cursor.execute(sql_str, sql_arg).fetchone()[0]
+
+
+def search(cursor, search_opts, chunk_size=1000, sort_opt=None):
+    ''' Stream all search results, chunk_size rows at a time, ordered by
+    sort_opt if given (full-text results are ranked anyway).
+
+    Yields
+    (pid, mol1, mol2, lit_type, year, bibkey, note),
+    full-text searches add (snippet, score)
     '''
 
+    sql_str, sql_arg = gen_search_sql_str(search_opts, sort_opt)
+    STATEMENTS.record(sql_str)
+
+    return iter_rows(cursor.execute(sql_str, sql_arg), chunk_size)
+
+
+def iter_rows(cursor, chunk_size=1000):
+    ''' Stream the rows of an executed query, chunk_size rows at a time,
+    so that large results never sit in memory at once '''
+
+    rows = cursor.fetchmany(chunk_size)
+    while rows:
+        for row in rows:
+            yield row
+        rows = cursor.fetchmany(chunk_size)
+
+
+def search_key(search_opts):
+    ''' Normalize search_opts into a hashable key: lit types are sorted,
+    the free text is reduced to its full-text query and dropped if empty.
+    Searches of equal keys return the same rows. '''
+
+    search_opts, query = unpack_search_opts(search_opts)
     (mol1, mol2, yr_start, yr_end, checked_lit_types) = search_opts
+    key = (mol1, mol2, yr_start, yr_end, tuple(sorted(set(checked_lit_types))))
+
+    return key + (query,) if query else key
+
+
+def data_version(cursor):
+    ''' Version of the searchable data, changed by any committed write to
+    lit (through the change log) or to the molecule names, from this
+    process or another one. '''
+
+    return cursor.execute(SQL_DATA_VERSION).fetchone()
+
+
+class SearchCache(object):
+    ''' LRU cache of search pages & counts, keyed by search_key.
+    The whole cache is dropped once data_version changes. Thread safe,
+    shared by the worker threads. Cached pages are lists shared by all
+    hits, callers must not modify them. '''
+
+    def __init__(self, size=128):
+        self.size = size
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def search_page(self, cursor, search_opts, sort_opt, last_row=None, limit=100):
+        ''' cached search_page '''
+
+        if unpack_search_opts(search_opts)[1]:   # ranked by score, sort_opt is unused
+            sort_opt = None
+        else:
+            pass
+        return self._get(cursor, search_page, search_opts, (sort_opt, last_row, limit))
+
+    def search_count(self, cursor, search_opts):
+        ''' cached search_count '''
 
-    sql_arg = []
-    sql_frag = []
-    sql_str = ""
-
-    if mol1 and mol2:   # if both molecules are specified
-        sql_frag.append("(mol1 = ? AND mol2 = ?) OR (mol1 = ? AND mol2 = ?)")
-        sql_arg.append(mol1)
-        sql_arg.append(mol2)
-        sql_arg.append(mol2)
-        sql_arg.append(mol1)
-    elif mol1:
-        sql_frag.append("(mol1 = ? OR mol2 = ?)")
-        sql_arg.append(mol1)
-        sql_arg.append(mol1)
-    elif mol2:
-        sql_frag.append("(mol1 = ? OR mol2 = ?)")
-        sql_arg.append(mol2)
-        sql_arg.append(mol2)
+        return self._get(cursor, search_count, search_opts, ())
+
+    def _get(self, cursor, func, search_opts, args):
+
+        version = data_version(cursor)
+        key = (func.__name__, search_key(search_opts)) + args
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            else:
+                pass
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            else:
+                self.misses += 1
+
+        result = func(cursor, search_opts, *args)
+        with self.lock:
+            # not if the data changed meanwhile
+            if version == self.version:
+                self.entries[key] = result
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+            else:
+                pass
+
+        return result
+
+    def clear(self):
+        ''' drop the cached results & reset the counters '''
+
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        ''' Returns
+        stats -- dict, hits, misses, hit_rate & entries
+        '''
+
+        with self.lock:
+            n = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / n if n else 0., 'entries': len(self.entries)}
+
+
+def add_mols(cursor, names):
+    ''' Add the molecules of names missing in the dictionary, no commit '''
+
+    cursor.executemany(SQL_ADD_MOL, [(name,) for name in names])
+
+
+def mol_id(cursor, name):
+    ''' Molecule id of name, canonical or alias, None if unknown '''
+
+    row = cursor.execute("SELECT mol_id FROM mol_alias WHERE name = ?", (name,)).fetchone()
+
+    return row[0] if row else None
+
+
+def read_mol_names(cursor):
+    ''' All molecule names, canonical & aliases '''
+
+    return [row[0] for row in cursor.execute("SELECT name FROM mol_alias")]
+
+
+class MolIndex(object):
+    ''' In-memory prefix index of molecule names for autocomplete: names
+    sorted by their case-folded form, so the names starting with a prefix
+    are a slice found by bisection. Loaded once by load(), names of
+    later writes are added with add(). Names are never removed, a merged
+    molecule stays as an alias. '''
+
+    def __init__(self, names=()):
+        self.load(names)
+
+    def load(self, names):
+        ''' replace the index by names '''
+
+        pairs = sorted(set((name.casefold(), name) for name in names))
+        self.keys = [key for (key, name) in pairs]
+        self.names = [name for (key, name) in pairs]
+        self.known = set(self.names)
+
+    def add(self, names):
+        ''' add the new names of a write '''
+
+        for name in names:
+            if name and name not in self.known:
+                i = bisect_left(self.keys, name.casefold())
+                self.keys.insert(i, name.casefold())
+                self.names.insert(i, name)
+                self.known.add(name)
+            else:
+                pass
+
+    def complete(self, prefix, limit=20):
+        ''' Names starting with prefix, case insensitive, at most limit.
+
+        Returns
+        names -- list of str, in case-folded order
+        '''
+
+        key = prefix.casefold()
+        matches = []
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and len(matches) < limit and self.keys[i].startswith(key):
+            matches.append(self.names[i])
+            i += 1
+
+        return matches
+
+    def __contains__(self, name):
+        return name in self.known
+
+    def __len__(self):
+        return len(self.names)
+
+
+def add_alias(cursor, alias, name):
+    ''' Make alias another name of the molecule name, and commit.
+    If alias is a molecule of its own (e.g. "h2o" next to "H2O"), its
+    records & aliases are merged into name; records that become
+    duplicates are dropped.
+
+    Returns
+    merged -- int, number of records moved to name
+    '''
+
+    with cursor.connection:
+        add_mols(cursor, [name])
+        canonical = mol_id(cursor, name)
+        old = mol_id(cursor, alias)
+        if old is None:
+            cursor.execute("INSERT INTO mol_alias (name, mol_id) VALUES (?, ?)", (alias, canonical))
+            return 0
+        elif old == canonical:
+            return 0
+        else:
+            pass
+        # the triggers update the change log, pair_counts & lit_fts
+        merged = cursor.execute("UPDATE OR IGNORE lit SET mol1 = ? WHERE mol1 = ?", (canonical, old)).rowcount
+        merged += cursor.execute("UPDATE OR IGNORE lit SET mol2 = ? WHERE mol2 = ?", (canonical, old)).rowcount
+        cursor.execute("DELETE FROM lit WHERE mol1 = ? OR mol2 = ?", (old, old))
+        cursor.execute("UPDATE mol_alias SET mol_id = ? WHERE mol_id = ?", (canonical, old))
+        cursor.execute("DELETE FROM molecule WHERE id = ?", (old,))
+
+    return merged
+
+
+def insert_entry(cursor, entry):
+    ''' Insert entry = (mol1, mol2, lit_type, year, bibkey, note) and commit.
+    Raises sqlite3.IntegrityError if it is duplicated. '''
+
+    with cursor.connection:
+        add_mols(cursor, entry[:2])
+        cursor.execute(SQL_INSERT, entry)
+
+    return cursor.lastrowid
+
+
+def update_entry(cursor, pid, entry):
+    ''' Update the entry of pid with entry = (mol1, mol2, lit_type, year,
+    bibkey, note) and commit. Raises sqlite3.IntegrityError if another
+    entry has the same mol1, mol2, year & bibkey. '''
+
+    with cursor.connection:
+        add_mols(cursor, entry[:2])
+        cursor.execute(SQL_UPDATE, list(entry) + [pid])
+
+
+def check_edits(cursor, edits):
+    ''' Validate a batch of edits together before update_entries: an edit
+    conflicts if its (mol1, mol2, year, bibkey) is taken by an entry
+    outside the batch, by an edit of the batch keeping it, or by another
+    edit moving to it. A key is free once its holder moves elsewhere.
+
+    Arguments
+    edits -- list of (pid, entry), entry = (mol1, mol2, lit_type, year,
+             bibkey, note)
+
+    Returns
+    conflicts -- list of pid, in the order of edits
+    '''
+
+    new_keys = {}
+    for (pid, entry) in edits:
+        (mol1, mol2, lit_type, year, bibkey, note) = entry
+        # unknown molecules compare by name
+        new_keys[pid] = (mol_id(cursor, mol1) or mol1, mol_id(cursor, mol2) or mol2, int(year), bibkey)
+    conflicts = []
+    keys = {}
+    for (pid, entry) in edits:
+        (mol1, mol2, lit_type, year, bibkey, note) = entry
+        key = new_keys[pid]
+        r = cursor.execute(SQL_KEY_IDS, (mol1, mol2, year, bibkey))
+        # held outside the batch (default), or by an edit keeping it
+        taken = [row[0] for row in r.fetchall() if row[0] != pid and new_keys.get(row[0], key) == key]
+        if taken or key in keys:
+            conflicts.append(pid)
+        else:
+            keys[key] = pid
+
+    return conflicts
+
+
+def update_entries(cursor, edits):
+    ''' Write a batch of edits = [(pid, entry), ...] and commit once. The
+    entries changing their key are parked on a temporary bibkey first, so
+    an edit may take the key another one leaves, swaps included. On any
+    conflict the whole batch is rolled back and sqlite3.IntegrityError is
+    raised. '''
+
+    rows = [list(entry) + [pid] for (pid, entry) in edits]
+    with cursor.connection:
+        add_mols(cursor, [name for (pid, entry) in edits for name in entry[:2]])
+        cursor.executemany(SQL_PARK_KEY, rows)
+        cursor.executemany(SQL_UPDATE, rows)
+
+
+def check_duplicates(cursor, mol1, mol2, year, bibkey, note=None):
+    ''' Check whether an entry is duplicated. The note is compared as well
+    if it is not None. '''
+
+    if note is None:
+        r = cursor.execute(SQL_CHECK_DUPLICATES, (mol1, mol2, year, bibkey))
+    else:
+        r = cursor.execute(SQL_CHECK_DUPLICATES_NOTE, (mol1, mol2, year, bibkey, note))
+
+    return bool(r.fetchall())
+
+
+class PairMatrix(object):
+    ''' Sparse lower triangular matrix of record counts of one lit type.
+
+    Only populated pairs are stored, in compressed sparse row (CSR) layout:
+    the columns of row i are indices[indptr[i]:indptr[i+1]] in ascending
+    order, with counts and "bibkey: note" details at the same positions.
+    Cell (i, j) with i >= j indexes mol_list. A pair that is not stored
+    has no records: its count is 0 and its detail is ''.
+    '''
+
+    def __init__(self, mol_list, indptr, indices, counts, details):
+        self.mol_list = mol_list
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.details = details
+
+    @classmethod
+    def from_pairs(cls, mol_list, pairs):
+        ''' Build the matrix from an iterable of (i, j, k, detail_txt),
+        i >= j. '''
+
+        indptr = array('i', bytes(4 * (len(mol_list) + 1)))
+        indices = array('i')
+        counts = array('i')
+        details = []
+        for (i, j, k, detail) in sorted(pairs):
+            indptr[i+1] += 1
+            indices.append(j)
+            counts.append(k)
+            details.append(detail)
+        for i in range(len(mol_list)):
+            indptr[i+1] += indptr[i]
+
+        return cls(mol_list, indptr, indices, counts, details)
+
+    # binary layout of dumps(), the arrays are in native byte order
+    FMT = 'i{:d}-{:s}'.format(array('i').itemsize, sys.byteorder)
+
+    @classmethod
+    def loads(cls, mols, indptr, indices, counts, details):
+        ''' Rebuild the matrix from the blobs of dumps() '''
+
+        mol_list = mols.decode('utf-8').split('\x00') if mols else []
+        details = details.decode('utf-8').split('\x00') if indices else []
+
+        return cls(mol_list, array('i', indptr), array('i', indices),
+                   array('i', counts), details)
+
+    def dumps(self):
+        ''' Serialize the matrix into blobs (mols, indptr, indices, counts,
+        details). Strings are joined by NUL characters. '''
+
+        return ('\x00'.join(self.mol_list).encode('utf-8'),
+                self.indptr.tobytes(), self.indices.tobytes(),
+                self.counts.tobytes(),
+                '\x00'.join(self.details).encode('utf-8'))
+
+    def __len__(self):
+        ''' number of populated pairs '''
+        return len(self.indices)
+
+    @property
+    def n(self):
+        return len(self.mol_list)
+
+    def _find(self, i, j):
+        ''' position of cell (i, j) in the sparse arrays, -1 if missing '''
+
+        if i < j:
+            i, j = j, i
+        else:
+            pass
+        start = self.indptr[i]
+        end = self.indptr[i+1]
+        pos = bisect_left(self.indices, j, start, end)
+        if pos < end and self.indices[pos] == j:
+            return pos
+        else:
+            return -1
+
+    def count(self, i, j):
+        ''' number of records of cell (i, j) '''
+
+        pos = self._find(i, j)
+        return self.counts[pos] if pos >= 0 else 0
+
+    def detail(self, i, j):
+        ''' "bibkey: note" lines of cell (i, j) '''
+
+        pos = self._find(i, j)
+        return self.details[pos] if pos >= 0 else ''
+
+    def index(self, mol):
+        ''' index of mol in mol_list, -1 if missing '''
+
+        i = bisect_left(self.mol_list, mol)
+        if i < len(self.mol_list) and self.mol_list[i] == mol:
+            return i
+        else:
+            return -1
+
+    def _insert_mol(self, mol):
+        ''' insert an empty row & column for a never-seen molecule '''
+
+        p = bisect_left(self.mol_list, mol)
+        self.mol_list.insert(p, mol)
+        self.indptr.insert(p+1, self.indptr[p])
+        # shift the column indexes behind the new molecule
+        for pos, j in enumerate(self.indices):
+            if j >= p:
+                self.indices[pos] = j + 1
+            else:
+                pass
+
+    def set_pair(self, mol_a, mol_b, k, detail):
+        ''' Set the count & detail of the pair (mol_a, mol_b).
+        k = 0 removes the pair. Never-seen molecules get a new row & column.
+
+        Returns
+        added -- bool, True if molecules were added to mol_list
+        '''
+
+        added = False
+        for mol in (mol_a, mol_b):
+            if self.index(mol) < 0:
+                if k:
+                    self._insert_mol(mol)
+                    added = True
+                else:   # nothing to remove
+                    return added
+            else:
+                pass
+
+        i = self.index(mol_a)
+        j = self.index(mol_b)
+        if i < j:
+            i, j = j, i
+        else:
+            pass
+        start = self.indptr[i]
+        end = self.indptr[i+1]
+        pos = bisect_left(self.indices, j, start, end)
+        found = pos < end and self.indices[pos] == j
+
+        if found and k:
+            self.counts[pos] = k
+            self.details[pos] = detail
+        elif found:
+            del self.indices[pos]
+            del self.counts[pos]
+            del self.details[pos]
+            for r in range(i+1, len(self.indptr)):
+                self.indptr[r] -= 1
+        elif k:
+            self.indices.insert(pos, j)
+            self.counts.insert(pos, k)
+            self.details.insert(pos, detail)
+            for r in range(i+1, len(self.indptr)):
+                self.indptr[r] += 1
+        else:
+            pass
+
+        return added
+
+    def copy(self):
+        ''' an independent copy, safe to read in a worker thread '''
+
+        return PairMatrix(list(self.mol_list), array('i', self.indptr), array('i', self.indices),
+                          array('i', self.counts), list(self.details))
+
+    def with_counts(self, counts):
+        ''' A matrix of the same pairs with other counts, e.g. of a year
+        window, see PairYears. The arrays are shared: the copy is read only,
+        and invalid once this matrix changes. '''
+
+        return PairMatrix(self.mol_list, self.indptr, self.indices, counts, self.details)
+
+
+class HeatmapTiles(object):
+    ''' Level-of-detail heatmap of a PairMatrix, for matrices too large
+    for a table. Level L pools blocks of 2**L x 2**L cells into one pixel
+    (max or sum of the counts); each level is cut into square tiles of
+    size pixels, computed on demand from the sparse arrays in one
+    vectorized pass. The colored tiles of the last views are cached,
+    up to cache_size. Needs numpy.
+
+    Pixel (y, x) of tile (ty, tx) at level L covers the cells i (row) &
+    j (column) with i // 2**L == ty * size + y and j // 2**L == tx * size + x.
+    '''
+
+    # colors of the log count scale, from the lowest to the highest count
+    COLOR_STOPS = [0xFFF5C542, 0xFFF08A24, 0xFFD03A2C, 0xFF6E0B2E]
+    EMPTY_COLOR = 0xFFF4F4F4    # of the cells without records
+
+    def __init__(self, matrix, size=256, pool='max', cache_size=128):
+        if np is None:
+            raise ImportError('the heatmap needs numpy')
+        else:
+            pass
+        self.matrix = matrix
+        self.size = size
+        self.pool = pool
+        self.cache_size = cache_size
+        self.lut = self._color_table()
+        self.invalidate()
+
+    def invalidate(self):
+        ''' drop the tiles, after the matrix changed '''
+
+        indptr = np.frombuffer(self.matrix.indptr, dtype=np.int32)
+        self.rows = np.repeat(np.arange(self.matrix.n, dtype=np.int64), np.diff(indptr))
+        self.cols = np.frombuffer(self.matrix.indices, dtype=np.int32).astype(np.int64)
+        self.counts = np.frombuffer(self.matrix.counts, dtype=np.int32).astype(np.int64)
+        self.images = OrderedDict()
+        self.maxima = {}
+
+    @property
+    def max_level(self):
+        ''' first level fitting the whole matrix in a single tile '''
+
+        level = 0
+        while (self.matrix.n - 1) >> level >= self.size:
+            level += 1
+        return level
+
+    def level_for(self, scale):
+        ''' level to draw at scale pixels per cell: blocks of about one pixel '''
+
+        level = 0
+        while scale * 2 ** (level + 1) <= 1. and level < self.max_level:
+            level += 1
+        return level
+
+    def n_tiles(self, level):
+        ''' number of tiles along each side at level '''
+        return -(-self.matrix.n // (self.size << level)) if self.matrix.n else 0
+
+    def _pooled(self, keys, counts, minlength=0):
+        ''' pool counts by keys, returns (unique keys, values) or a dense
+        array of minlength '''
+
+        if minlength:
+            if self.pool == 'sum':
+                return np.bincount(keys, weights=counts, minlength=minlength).astype(np.int64)
+            else:
+                out = np.zeros(minlength, dtype=np.int64)
+                np.maximum.at(out, keys, counts)
+                return out
+        else:
+            uniq, inverse = np.unique(keys, return_inverse=True)
+            if self.pool == 'sum':
+                return uniq, np.bincount(inverse, weights=counts).astype(np.int64)
+            else:
+                out = np.zeros(len(uniq), dtype=np.int64)
+                np.maximum.at(out, inverse, counts)
+                return uniq, out
+
+    def vmax(self, level):
+        ''' highest pixel value at level, top of the color scale '''
+
+        if level not in self.maxima:
+            if not len(self.counts):
+                self.maxima[level] = 0
+            elif self.pool == 'sum' and level:
+                m = (self.matrix.n >> level) + 1
+                keys = (self.rows >> level) * m + (self.cols >> level)
+                self.maxima[level] = int(self._pooled(keys, self.counts)[1].max())
+            else:   # max pooling keeps the highest count at every level
+                self.maxima[level] = int(self.counts.max())
+        else:
+            pass
+
+        return self.maxima[level]
+
+    def tile(self, level, ty, tx):
+        ''' Pooled counts of tile (ty, tx) at level.
+
+        Returns
+        values -- numpy int64 array, size x size
+        '''
+
+        span = self.size << level
+        r0 = min(ty * span, self.matrix.n)
+        r1 = min(r0 + span, self.matrix.n)
+        c0 = tx * span
+        # rows of the tile are a slice of the CSR arrays
+        start = self.matrix.indptr[r0]
+        end = self.matrix.indptr[r1]
+        rows = self.rows[start:end]
+        cols = self.cols[start:end]
+        inside = (cols >= c0) & (cols < c0 + span)
+        keys = ((rows[inside] - r0) >> level) * self.size + ((cols[inside] - c0) >> level)
+        values = self._pooled(keys, self.counts[start:end][inside], self.size * self.size)
+
+        return values.reshape(self.size, self.size)
+
+    def _color_table(self):
+        ''' 256 ARGB colors, 0 for empty cells '''
+
+        stops = np.array(self.COLOR_STOPS, dtype=np.uint32)
+        x = np.linspace(0, len(stops) - 1, 255)
+        lut = np.zeros(256, dtype=np.uint32)
+        lut[0] = self.EMPTY_COLOR
+        for shift in (0, 8, 16, 24):
+            channel = (stops >> shift) & 0xFF
+            lut[1:] |= np.interp(x, np.arange(len(stops)), channel).astype(np.uint32) << shift
+
+        return lut
+
+    def colorize(self, values, vmax):
+        ''' Map pooled counts to ARGB colors on a log scale up to vmax.
+
+        Returns
+        argb -- numpy uint32 array of the shape of values
+        '''
+
+        scale = 254. / np.log1p(max(vmax, 1))
+        idx = np.where(values > 0, 1 + np.minimum(np.log1p(values) * scale, 254.).astype(np.int64), 0)
+
+        return self.lut[idx]
+
+    def image(self, level, ty, tx):
+        ''' ARGB colors of tile (ty, tx), see colorize. Cached. '''
+
+        key = (level, ty, tx)
+        if key in self.images:
+            self.images.move_to_end(key)
+        else:
+            argb = self.colorize(self.tile(level, ty, tx), self.vmax(level))
+            # transparent outside the lower triangle & beyond the last molecule
+            last = (self.matrix.n - 1) >> level
+            argb[last - ty * self.size + 1:, :] = 0
+            argb[:, last - tx * self.size + 1:] = 0
+            if tx == ty:
+                argb[np.triu_indices(self.size, 1)] = 0
+            else:
+                pass
+            self.images[key] = argb
+            while len(self.images) > self.cache_size:
+                self.images.popitem(last=False)
+
+        return self.images[key]
+
+    def block_cell(self, level, bi, bj):
+        ''' The cell with the highest count in block (bi, bj) of level,
+        i.e. under a pixel, None if the block has no records.
+
+        Returns
+        (i, j) -- int, cell of the matrix
+        '''
+
+        b = 1 << level
+        r0 = min(bi * b, self.matrix.n)
+        r1 = min(r0 + b, self.matrix.n)
+        start = self.matrix.indptr[r0]
+        end = self.matrix.indptr[r1]
+        cols = self.cols[start:end]
+        inside = np.flatnonzero((cols >= bj * b) & (cols < bj * b + b))
+        if len(inside):
+            pos = start + inside[np.argmax(self.counts[start:end][inside])]
+            return int(self.rows[pos]), int(self.cols[pos])
+        else:
+            return None
+
+
+class PairYears(object):
+    ''' Number of records of every populated pair of a PairMatrix by year,
+    stored as cumulative sums over the years: column y of cum counts the
+    records of each pair before year first_year + y. The counts of any
+    year window are then the difference of two columns, one vectorized
+    pass over the populated pairs. Needs numpy.
+
+    cum -- numpy int32 array, len(matrix) x (number of years + 1), rows
+           at the positions of the matrix's sparse arrays
+    '''
+
+    def __init__(self, first_year, cum):
+        self.first_year = first_year
+        # column major, the columns read by window are contiguous
+        self.cum = np.asfortranarray(cum, dtype=np.int32)
+
+    @classmethod
+    def from_rows(cls, matrix, rows):
+        ''' Sum the rows (mol_a, mol_b, year, k) over the pairs of matrix.
+        Pairs missing from the matrix are ignored. '''
+
+        if np is None:
+            raise ImportError('the year window needs numpy')
+        else:
+            pass
+
+        mol_index = {mol: i for i, mol in enumerate(matrix.mol_list)}
+        n = matrix.n
+        rows = [row for row in rows if row[0] in mol_index and row[1] in mol_index]
+        a = np.array([mol_index[row[0]] for row in rows], dtype=np.int64)
+        b = np.array([mol_index[row[1]] for row in rows], dtype=np.int64)
+        years = np.array([row[2] for row in rows], dtype=np.int64)
+        counts = np.array([row[3] for row in rows], dtype=np.int32)
+
+        # keys of the lower triangle cells, ascending like the sparse arrays
+        indptr = np.frombuffer(matrix.indptr, dtype=np.int32)
+        cells = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr)) * n \
+            + np.frombuffer(matrix.indices, dtype=np.int32)
+        keys = np.maximum(a, b) * n + np.minimum(a, b)
+        pos = np.searchsorted(cells, keys)
+        found = pos < len(cells)
+        found[found] = cells[pos[found]] == keys[found]
+
+        first_year = int(years.min()) if len(years) else 0
+        last_year = int(years.max()) if len(years) else -1
+        table = np.zeros((len(matrix), last_year - first_year + 2), dtype=np.int32)
+        np.add.at(table, (pos[found], years[found] - first_year + 1), counts[found])
+
+        return cls(first_year, np.cumsum(table, axis=1, dtype=np.int32))
+
+    @property
+    def last_year(self):
+        return self.first_year + self.cum.shape[1] - 2
+
+    def __len__(self):
+        ''' number of populated pairs '''
+        return self.cum.shape[0]
+
+    def window(self, yr_start=None, yr_end=None):
+        ''' Number of records of each pair from yr_start to yr_end, both
+        included, None for no bound.
+
+        Returns
+        counts -- numpy int32 array, at the positions of the sparse arrays
+        '''
+
+        y0 = 0 if yr_start is None else min(max(yr_start - self.first_year, 0), self.cum.shape[1] - 1)
+        y1 = self.cum.shape[1] - 1 if yr_end is None else min(max(yr_end - self.first_year + 1, 0), self.cum.shape[1] - 1)
+        if y1 <= y0:
+            return np.zeros(len(self), dtype=np.int32)
+        else:
+            return self.cum[:, y1] - self.cum[:, y0]
+
+
+def read_pair_counts(cursor, lit_types):
+    ''' Read the number of records of every dimer pair of lit_types from
+    the trigger-maintained pair_counts table, in a single query.
+
+    Arguments
+    cursor    -- sqlite3 cursor
+    lit_types -- list of lit types to read
+
+    Returns
+    matrices -- dict, {lit_type: PairMatrix}, molecules of each lit type
+                are sorted. Lit types without records are not stored.
+    '''
+
+    if not lit_types:
+        return {}
     else:
         pass
 
-    if yr_start:
-        sql_frag.append("year >= ?")
-        sql_arg.append(yr_start)
+    _this_str = "?, " * (len(lit_types)-1) + "?"
+    r = cursor.execute(SQL_PAIR_COUNTS.format(_this_str), list(lit_types))
+    rows = r.fetchall()
+
+    # collect molecules of each lit type
+    mols = {}
+    for (lit_type, mol_a, mol_b, k, detail) in rows:
+        mols.setdefault(lit_type, set()).update((mol_a, mol_b))
+
+    mol_lists = {}
+    mol_index = {}
+    pairs = {}
+    for lit_type, mol_set in mols.items():
+        mol_lists[lit_type] = sorted(mol_set)
+        mol_index[lit_type] = {mol: i for i, mol in enumerate(mol_lists[lit_type])}
+        pairs[lit_type] = []
+
+    for (lit_type, mol_a, mol_b, k, detail) in rows:
+        # put the pair in the lower triangle, i >= j
+        i = mol_index[lit_type][mol_a]
+        j = mol_index[lit_type][mol_b]
+        pairs[lit_type].append((max(i, j), min(i, j), k, detail))
+
+    matrices = {}
+    for lit_type in mol_lists:
+        matrices[lit_type] = PairMatrix.from_pairs(mol_lists[lit_type], pairs[lit_type])
+
+    return matrices
+
+
+def load_matrices(cursor, lit_types):
+    ''' Like read_pair_counts, but reuse the binary snapshots stored in
+    matrix_snapshot while no write to lit happened since they were taken
+    (same change sequence number). Outdated or missing snapshots are
+    rebuilt and stored again.
+
+    Returns
+    matrices -- dict, {lit_type: PairMatrix}, see read_pair_counts
+    '''
+
+    if not lit_types:
+        return {}
+    else:
+        pass
+
+    conn = cursor.connection
+    # read the sequence number & the matrices from the same data. A
+    # transaction of the caller is left open, for the caller to end.
+    started = not conn.in_transaction
+    if started:
+        cursor.execute("BEGIN")
     else:
         pass
+    try:
+        seq = read_change_seq(cursor)
+        _this_str = "?, " * (len(lit_types)-1) + "?"
+        r = cursor.execute(SQL_LOAD_SNAPSHOT.format(_this_str), [seq, PairMatrix.FMT] + list(lit_types))
+        matrices = {}
+        found = set()
+        for row in r.fetchall():
+            found.add(row[0])
+            m = PairMatrix.loads(*row[1:])
+            if m.n:     # an empty snapshot means no records
+                matrices[row[0]] = m
+            else:
+                pass
+        missing = [lit_type for lit_type in lit_types if lit_type not in found]
+        built = read_pair_counts(cursor, missing)
+    finally:
+        if started:
+            conn.commit()
+        else:
+            pass
+
+    if missing:
+        empty = PairMatrix([], array('i', [0]), array('i'), array('i'), [])
+        # a savepoint commits only if no transaction was open
+        cursor.execute("SAVEPOINT snapshot")
+        try:
+            cursor.executemany(SQL_SAVE_SNAPSHOT, [
+                (lit_type, seq, PairMatrix.FMT) + built.get(lit_type, empty).dumps()
+                for lit_type in missing])
+        except sqlite3.OperationalError:   # read only or locked, it is just a cache
+            cursor.execute("ROLLBACK TO snapshot")
+        finally:
+            cursor.execute("RELEASE snapshot")
+        matrices.update(built)
+    else:
+        pass
+
+    return matrices
+
+
+def read_pair(cursor, lit_type, mol_a, mol_b):
+    ''' Read the number of records & details of a single dimer pair.
+
+    Returns
+    (k int, detail_txt str)
+    '''
+
+    r = cursor.execute(SQL_PAIR, (lit_type, mol_a, mol_b))
+    row = r.fetchone()
+
+    return row if row else (0, '')
+
+
+def read_pair_years(cursor, lit_type, matrix):
+    ''' Read the number of records of every dimer pair of lit_type by
+    year, in a single query, as the cumulative sums of the year window.
+
+    Arguments
+    cursor   -- sqlite3 cursor
+    lit_type -- str
+    matrix   -- PairMatrix of lit_type, the layout of the sums. It is read
+                only, a copy is safe in a worker thread.
+
+    Returns
+    years -- PairYears
+    '''
+
+    r = cursor.execute(SQL_PAIR_YEARS, (lit_type,))
+
+    return PairYears.from_rows(matrix, r.fetchall())
 
-    if yr_end:
-        sql_frag.append("year <= ?")
-        sql_arg.append(yr_end)
+
+def read_changes(cursor, since_seq):
+    ''' Read the dimer pairs touched by writes to lit after since_seq,
+    as recorded by the lit_change triggers.
+
+    Returns
+    seq   -- int, the last change sequence number
+    pairs -- set of (lit_type, mol_a, mol_b), mol_a <= mol_b, None if
+             changes after since_seq were pruned from the log already
+    '''
+
+    r = cursor.execute(SQL_CHANGES, (since_seq,))
+
+    seq = since_seq
+    pairs = set()
+    for row in r.fetchall():
+        seq = row[0]
+        pairs.add(row[1:])
+
+    # checked after the read: a prune in between errs on the safe side
+    pruned = cursor.execute(SQL_PRUNED_SEQ).fetchone()[0] or 0
+    if pruned > since_seq:
+        return max(seq, pruned), None
+    else:
+        return seq, pairs
+
+
+def read_changed_pairs(cursor, since_seq, lit_types, limit=None):
+    ''' Read the changes after since_seq together with the current counts &
+    details of the touched pairs of lit_types.
+
+    Arguments
+    limit -- int, beyond this number of touched pairs (e.g. after a bulk
+             import) a rebuild is cheaper, and no pair is read
+
+    Returns
+    seq     -- int, the last change sequence number
+    touched -- set of all lit types touched by the changes, all lit_types
+               if the log was pruned past since_seq
+    pairs   -- list of (lit_type, mol_a, mol_b, k, detail_txt) of lit_types,
+               None if there are more than limit changes or if the log
+               was pruned past since_seq
+    '''
+
+    seq, changes = read_changes(cursor, since_seq)
+    if changes is None:     # fell behind the log, rebuild everything
+        return seq, set(lit_types), None
     else:
         pass
 
-    if checked_lit_types:
-        n = len(checked_lit_types)
-        _this_str = "?, " * (n-1) + "?"
-        sql_frag.append("lit_type in ({:s})".format(_this_str))
-        for item in checked_lit_types:
-            sql_arg.append(item)
+    touched = set(change[0] for change in changes)
+    if limit and len(changes) > limit:
+        return seq, touched, None
     else:
         pass
 
-    if sql_frag:  # if there are arguments
-        while sql_frag:   # stitch all sql fragments together
-            sql_str = " AND " + sql_frag.pop() + sql_str
-        # chop off the first " AND " and replace it with " WHERE "
-        return "SELECT * FROM lit WHERE" + sql_str[4:], sql_arg
-    else:   # no arguments, return a pure search sentence
-        return "SELECT * FROM lit", []
+    pairs = []
+    for (lit_type, mol_a, mol_b) in changes:
+        if lit_type in lit_types:
+            k, detail = read_pair(cursor, lit_type, mol_a, mol_b)
+            pairs.append((lit_type, mol_a, mol_b, k, detail))
+        else:
+            pass
+
+    return seq, touched, pairs
+
+
+def read_change_seq(cursor):
+    ''' Read the current change sequence number '''
+
+    r = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'lit_change'")
+    row = r.fetchone()
+
+    return row[0] if row else 0
+
+
+def prune_changes(cursor, keep=CHANGE_LOG_KEEP):
+    ''' Delete the change log but its last keep changes and commit. The
+    log is shared by every process reading the database, so it is never
+    cut at what one reader applied. A reader more than keep changes
+    behind rebuilds its matrices, see read_changes. '''
+
+    with cursor.connection:
+        cursor.execute(SQL_PRUNE_CHANGES, (read_change_seq(cursor) - keep,))
+
+
+def _read_bib_value(text, pos):
+    ''' Read a BibTeX field value starting at text[pos].
+
+    Returns
+    value -- str, without the outer braces / quotes
+    pos   -- int, position right after the value
+    '''
+
+    if text[pos] == '{':
+        depth = 0
+        for end in range(pos, len(text)):
+            if text[end] == '{':
+                depth += 1
+            elif text[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    return text[pos+1:end], end + 1
+            else:
+                pass
+        return text[pos+1:], len(text)
+    elif text[pos] == '"':
+        depth = 0
+        for end in range(pos+1, len(text)):
+            if text[end] == '{':
+                depth += 1
+            elif text[end] == '}':
+                depth -= 1
+            elif text[end] == '"' and depth == 0 and text[end-1] != '\\':
+                return text[pos+1:end], end + 1
+            else:
+                pass
+        return text[pos+1:], len(text)
+    else:   # bare number or macro
+        m = re.compile(r'[^,})\s]*').match(text, pos)
+        return m.group(), m.end()
+
+
+# an entry starts with "@type{" or "@type(" at the beginning of a line
+_BIB_ENTRY_START = re.compile(r'\s*@\s*(\w+)\s*([{(])')
+# entries without records
+_BIB_SKIPPED = ('comment', 'preamble', 'string')
+# what an unparsable entry yields, counted as invalid by import_records
+_BIB_INVALID = ('', '', '', '', '', '')
+
+
+def _parse_bib_entry(text):
+    ''' Parse the text of one BibTeX entry "@type{key, field = value, ...}"
+    or "@type(key, ...)".
+
+    Returns
+    (entry_type, key, fields) -- fields is a dict with lowercase names,
+    None if the entry has no key
+    '''
+
+    m = re.match(r'@\s*(\w+)\s*[{(]\s*([^,\s{}()]+)\s*,', text)
+    if not m:
+        return None
+    else:
+        pass
+
+    fields = {}
+    field_re = re.compile(r'\s*([\w\-:]+)\s*=\s*')
+    pos = m.end()
+    while True:
+        f = field_re.match(text, pos)
+        if not f or f.end() >= len(text):
+            break
+        else:
+            pass
+        value, pos = _read_bib_value(text, f.end())
+        # drop BibTeX case protection braces
+        fields[f.group(1).lower()] = ' '.join(value.replace('{', '').replace('}', '').split())
+        # skip to the next field
+        comma = text.find(',', pos)
+        if comma < 0:
+            break
+        else:
+            pos = comma + 1
+
+    return m.group(1).lower(), m.group(2), fields
+
+
+def parse_bibtex(f):
+    ''' Parse a BibTeX file object entry by entry, without reading it into
+    memory. The dimer is described by custom fields:
+        mol1, mol2, littype (or lit_type), year, note (or annote)
+    and the entry key is the bibkey.
+
+    Entries start at the beginning of a line, any other text between
+    entries (% comments, an e-mail address...) is ignored, and so are
+    @comment, @preamble & @string. An entry without key, or left open
+    by the next entry or the end of the file, yields empty fields, so
+    that import_records counts it as invalid.
+
+    Yields
+    (mol1, mol2, lit_type, year, bibkey, note), missing fields are ''
+    '''
+
+    buf = []
+    depth = 0
+    entry_type = None
+    for line in f:
+        start = _BIB_ENTRY_START.match(line)
+        if start and buf:   # the previous entry was never closed
+            if entry_type not in _BIB_SKIPPED:
+                yield _BIB_INVALID
+            else:
+                pass
+            buf = []
+        elif not buf and not start:     # text between entries
+            continue
+        else:
+            pass
+        if start:
+            entry_type = start.group(1).lower()
+            opening, closing = ('{', '}') if start.group(2) == '{' else ('(', ')')
+            depth = 0
+            line = line[line.index('@'):]
+        else:
+            pass
+        buf.append(line)
+        depth += line.count(opening) - line.count(closing)
+        if depth > 0:
+            continue
+        else:
+            pass
+
+        text = ''.join(buf)
+        buf = []
+        if entry_type in _BIB_SKIPPED:
+            continue
+        else:
+            pass
+        entry = _parse_bib_entry(text)
+        if entry:
+            (entry_type, bibkey, fields) = entry
+            yield (fields.get('mol1', ''), fields.get('mol2', ''),
+                   fields.get('littype', fields.get('lit_type', '')),
+                   fields.get('year', ''), bibkey,
+                   fields.get('note', fields.get('annote', '')))
+        else:
+            yield _BIB_INVALID
+
+    if buf and entry_type not in _BIB_SKIPPED:     # unterminated last entry
+        yield _BIB_INVALID
+    else:
+        pass
+
+
+def parse_csv(f):
+    ''' Parse a CSV file object row by row. The header names the columns
+    mol1, mol2, lit_type, year, bibkey, note (any order, note optional).
+
+    Yields
+    (mol1, mol2, lit_type, year, bibkey, note), missing fields are ''
+    '''
+
+    for row in csv.DictReader(f):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        yield (row.get('mol1', ''), row.get('mol2', ''), row.get('lit_type', ''),
+               row.get('year', ''), row.get('bibkey', ''), row.get('note', ''))
+
+
+def _valid_records(records, lit_types, stats):
+    ''' Filter out records with missing fields, non-integer year or an
+    unknown lit type, counting them in stats['invalid'] '''
+
+    for (mol1, mol2, lit_type, year, bibkey, note) in records:
+        try:
+            year = int(year)
+        except ValueError:
+            year = None
+        if mol1 and mol2 and bibkey and year is not None and (not lit_types or lit_type in lit_types):
+            stats['valid'] += 1
+            yield (mol1, mol2, lit_type, year, bibkey, note)
+        else:
+            stats['invalid'] += 1
+
+
+def _add_record_mols(cursor, records):
+    ''' Add the molecules of records to the dictionary as they stream by '''
+
+    known = set(row[0] for row in cursor.execute("SELECT name FROM mol_alias"))
+    for record in records:
+        for name in record[:2]:
+            if name not in known:
+                cursor.execute(SQL_ADD_MOL, (name,))
+                known.add(name)
+            else:
+                pass
+        yield record
+
+
+def import_records(cursor, records, lit_types=None):
+    ''' Insert records in a single transaction with one executemany.
+    Duplicates are skipped by the UNIQUE constraint on
+    (mol1, mol2, year, bibkey). records may be a generator, it is
+    consumed as it is inserted.
+
+    Arguments
+    cursor    -- sqlite3 cursor
+    records   -- iterable of (mol1, mol2, lit_type, year, bibkey, note)
+    lit_types -- list of accepted lit types, None accepts all
+
+    Returns
+    stats -- dict, inserted / skipped (duplicates) / invalid counts,
+             seconds and rate (records per second)
+    '''
+
+    stats = {'valid': 0, 'invalid': 0}
+    t0 = time.perf_counter()
+    with cursor.connection:     # commit, or roll back on any error
+        records = _add_record_mols(cursor.connection.cursor(), _valid_records(records, lit_types, stats))
+        cursor.executemany(SQL_INSERT_IGNORE, records)
+        inserted = max(cursor.rowcount, 0)
+    seconds = time.perf_counter() - t0
+
+    total = stats['valid'] + stats['invalid']
+    return {'inserted': inserted,
+            'skipped': stats['valid'] - inserted,
+            'invalid': stats['invalid'],
+            'seconds': seconds,
+            'rate': total / seconds if seconds > 0 else 0.}
+
+
+def import_file(cursor, filename, lit_types=None):
+    ''' Bulk import a BibTeX (.bib) or CSV file, see import_records '''
+
+    ext = os.path.splitext(filename)[1].lower()
+    with open(filename, encoding='utf-8', newline='') as f:
+        if ext == '.bib':
+            return import_records(cursor, parse_bibtex(f), lit_types)
+        elif ext == '.csv':
+            return import_records(cursor, parse_csv(f), lit_types)
+        else:
+            raise ValueError('Unknown file type {:s}, expect .bib or .csv'.format(ext))
+
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'bibkeys', 'tsv')
+
+
+@contextmanager
+def _output(out):
+    ''' text file of out, a file name or an open file '''
+
+    if isinstance(out, (str, pathlib.Path)):
+        with open(out, 'w', encoding='utf-8', newline='') as f:
+            yield f
+    else:
+        yield out
+
+
+def export_search(cursor, search_opts, out, fmt='csv', chunk_size=1000):
+    ''' Stream the results of a search into out, chunk_size rows at a
+    time, in bounded memory.
+
+    Arguments
+    search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types[, text])
+    out         -- file name, or text file
+    fmt         -- 'csv': header & rows of LIT_COLUMNS (full-text searches
+                          add snippet & score)
+                   'jsonl': a JSON object per row, same columns
+                   'bibkeys': the distinct bibkeys, sorted, one per line
+                   'tsv': tab separated rows without header
+
+    Returns
+    n -- int, number of lines written, header excluded
+    '''
+
+    if fmt == 'bibkeys':
+        sql_str, sql_arg = gen_search_sql_str(search_opts)
+        r = cursor.execute(SQL_EXPORT_BIBKEYS.format(sql_str), sql_arg)
+        rows = (row[0] for row in iter_rows(r, chunk_size))
+    elif fmt in EXPORT_FORMATS:
+        rows = search(cursor, search_opts, chunk_size)
+    else:
+        raise ValueError('Unknown export format {:s}, expect one of {:s}'.format(fmt, ', '.join(EXPORT_FORMATS)))
+
+    columns = LIT_COLUMNS + (('snippet', 'score') if unpack_search_opts(search_opts)[1] else ())
+    n = 0
+    with _output(out) as f:
+        if fmt == 'jsonl':
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+                n += 1
+        elif fmt == 'bibkeys':
+            for bibkey in rows:
+                f.write(bibkey + '\n')
+                n += 1
+        else:
+            writer = csv.writer(f, delimiter='\t' if fmt == 'tsv' else ',', lineterminator='\n')
+            if fmt == 'csv':
+                writer.writerow(columns)
+            else:
+                pass
+            for row in rows:
+                writer.writerow(row)
+                n += 1
+
+    return n
+
+
+def export_pairs(cursor, lit_types, out, fmt='csv', chunk_size=1000):
+    ''' Stream the pair list of lit_types from pair_counts into out: rows
+    of (lit_type, mol_a, mol_b, count), mol_a <= mol_b, in the row order
+    of the matrices.
+
+    Arguments
+    fmt -- 'csv' with a header, or 'tsv' without
+
+    Returns
+    n -- int, number of pairs written
+    '''
+
+    _this_str = "?, " * (len(lit_types)-1) + "?"
+    r = cursor.execute(SQL_EXPORT_PAIRS.format(_this_str), list(lit_types))
+    n = 0
+    with _output(out) as f:
+        writer = csv.writer(f, delimiter='\t' if fmt == 'tsv' else ',', lineterminator='\n')
+        if fmt == 'csv':
+            writer.writerow(('lit_type', 'mol_a', 'mol_b', 'count'))
+        else:
+            pass
+        for row in iter_rows(r, chunk_size):
+            writer.writerow(row)
+            n += 1
+
+    return n
+
+
+def export_dense(cursor, lit_type, out, chunk_size=1000):
+    ''' Stream the matrix of lit_type into out as a dense CSV, laid out as
+    the grid: a header of the molecules, then a row per molecule with
+    the counts of the lower triangle (0 without records), upper cells
+    empty. Only one row of the matrix is held in memory.
+
+    Returns
+    n -- int, number of molecules
+    '''
+
+    mols = [row[0] for row in cursor.execute(SQL_EXPORT_MOLS, (lit_type,))]
+    r = cursor.execute(SQL_EXPORT_PAIRS.format('?'), (lit_type,))
+    pairs = iter_rows(r, chunk_size)
+    pair = next(pairs, None)
+    with _output(out) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow([''] + mols)
+        # pairs come row by row, columns ascending, as mols
+        for (i, mol) in enumerate(mols):
+            row = [0] * (i + 1) + [''] * (len(mols) - i - 1)
+            j = 0
+            while pair and pair[2] == mol:
+                while mols[j] != pair[1]:
+                    j += 1
+                row[j] = pair[3]
+                pair = next(pairs, None)
+            writer.writerow([mol] + row)
+
+    return len(mols)
+
+
+def _cli_search(cursor, args):
+
+    search_opts = (args.mol1, args.mol2, args.yr_start, args.yr_end, args.lit_type or [], args.text)
+    export_search(cursor, search_opts, args.output or sys.stdout, args.format)
+
+
+def _cli_matrix(cursor, args):
+
+    lit_types = args.lit_type or DEFAULT_LIT_TYPES
+    if args.format == 'dense':
+        if len(lit_types) != 1:
+            sys.exit('a dense matrix needs exactly one --lit-type')
+        else:
+            export_dense(cursor, lit_types[0], args.output or sys.stdout)
+    else:
+        export_pairs(cursor, sorted(lit_types), args.output or sys.stdout, args.format)
+
+
+def _cli_import(cursor, args):
+
+    lit_types = None if args.any_lit_type else DEFAULT_LIT_TYPES
+    for filename in args.files:
+        stats = import_file(cursor, filename, lit_types)
+        print('{:s}: {:d} inserted, {:d} duplicates skipped, {:d} invalid, '
+              '{:.2f} s, {:.0f} records/s'.format(filename, stats['inserted'],
+              stats['skipped'], stats['invalid'], stats['seconds'], stats['rate']))
+    prune_changes(cursor)
+
+
+def _cli_alias(cursor, args):
+
+    merged = add_alias(cursor, args.alias, args.name)
+    print('{:s} -> {:s}: {:d} records merged'.format(args.alias, args.name, merged))
+
+
+def cli(argv=None):
+    ''' Command line interface, without Qt '''
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m mylib', description='Dimer literature database')
+    parser.add_argument('--db', default=DB, help='database file (default: %(default)s)')
+    parser.add_argument('--trace', help='save the timings of all queries to this Chrome trace JSON file')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    p = commands.add_parser('search', help='search entries, tab separated rows to stdout')
+    p.add_argument('--mol1', default='')
+    p.add_argument('--mol2', default='')
+    p.add_argument('--from', dest='yr_start', type=int, default=None, help='first year')
+    p.add_argument('--to', dest='yr_end', type=int, default=None, help='last year')
+    p.add_argument('--lit-type', action='append', help='repeat for several lit types')
+    p.add_argument('--text', default='', help='full-text search in bibkey & note, ranked by relevance')
+    p.add_argument('--format', choices=EXPORT_FORMATS, default='tsv', help='output format (default: %(default)s), see export_search')
+    p.add_argument('-o', '--output', help='output file (default: stdout)')
+    p.set_defaults(func=_cli_search)
+
+    p = commands.add_parser('matrix', help='record counts of dimer pairs, tab separated "lit_type mol_a mol_b count"')
+    p.add_argument('--lit-type', action='append', help='repeat for several lit types (default: all)')
+    p.add_argument('--format', choices=('tsv', 'csv', 'dense'), default='tsv',
+                   help='pair list, or dense CSV of a single lit type (default: %(default)s)')
+    p.add_argument('-o', '--output', help='output file (default: stdout)')
+    p.set_defaults(func=_cli_matrix)
+
+    p = commands.add_parser('import', help='bulk import .bib / .csv files')
+    p.add_argument('files', nargs='+')
+    p.add_argument('--any-lit-type', action='store_true', help='accept lit types other than {:s}'.format(', '.join(DEFAULT_LIT_TYPES)))
+    p.set_defaults(func=_cli_import)
+
+    p = commands.add_parser('alias', help='make ALIAS another name of the molecule NAME, merging their records')
+    p.add_argument('alias')
+    p.add_argument('name')
+    p.set_defaults(func=_cli_alias)
+
+    args = parser.parse_args(argv)
+
+    create_db(args.db)
+    conn = connect(args.db)
+    TRACER.enabled = TRACER.enabled or bool(args.trace)
+    try:
+        with TRACER.span(args.command, 'job'):
+            args.func(conn.cursor(TracingCursor), args)
+    except BrokenPipeError:    # e.g. piped into head
+        pass
+    finally:
+        conn.close()
+        if args.trace:
+            TRACER.dump(args.trace)
+        else:
+            pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
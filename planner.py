@@ -0,0 +1,289 @@
+#! encoding = utf-8
+
+'''
+Query planner of the literature searches.
+
+Search options are bound to a fixed set of canonical SQL templates: each
+filter is either absent or present with always the same text, the lit
+types are a single JSON array parameter read by json_each, and all
+arguments are named. Searches of the same shape, whatever the molecules,
+years or number of lit types, thus run the same SQL string, which sqlite3
+prepares once per connection and then takes from its statement cache.
+'''
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# search sort options -> sort column of lit
+SORT_KEYS = {'Mol': 'mol1', 'Year': 'year', 'Lit Type': 'lit_type'}
+# columns of search results
+LIT_COLUMNS = ('id', 'mol1', 'mol2', 'lit_type', 'year', 'bibkey', 'note')
+SQL_SELECT = "SELECT {:s} FROM lit_entry".format(", ".join(LIT_COLUMNS))
+# full-text searches join lit_fts, and return 2 more columns after LIT_COLUMNS:
+# the best matching snippet with the matches in [], and the BM25 score
+# (lower is better), which is also the sort key of full-text results
+SQL_FTS_SELECT = "SELECT {:s}, snippet(lit_fts, -1, '[', ']', '...', 10), bm25(lit_fts) FROM lit_entry JOIN lit_fts ON lit_fts.rowid = lit_entry.id".format(
+    ", ".join("lit_entry." + col for col in LIT_COLUMNS))
+# counts need no names: lit under the column names of lit_entry, so that the
+# filters apply unchanged and read covering indexes of lit
+_LIT_IDS = "(SELECT id, mol1 AS mol1_id, mol2 AS mol2_id, lit_type, year FROM lit) AS lit_entry"
+SQL_COUNT = "SELECT count(*) FROM " + _LIT_IDS
+SQL_FTS_COUNT = "SELECT count(*) FROM {:s} JOIN lit_fts ON lit_fts.rowid = lit_entry.id".format(_LIT_IDS)
+# nothing to filter, no need for the names of the view
+SQL_COUNT_ALL = "SELECT count(*) FROM lit"
+
+# molecule id of a named parameter, canonical name or alias
+_MOL_ID = "(SELECT mol_id FROM mol_alias WHERE name = :{:s})"
+# the filters, in their order in the WHERE clause, each one parenthesized
+FILTERS = OrderedDict([
+    ('query', "lit_fts MATCH :query"),
+    ('mol', "(mol1_id = {0:s} OR mol2_id = {0:s})".format(_MOL_ID.format('mol'))),
+    ('pair', "((mol1_id = {0:s} AND mol2_id = {1:s}) OR (mol1_id = {1:s} AND mol2_id = {0:s}))".format(
+        _MOL_ID.format('mol1'), _MOL_ID.format('mol2'))),
+    ('yr_start', "year >= :yr_start"),
+    ('yr_end', "year <= :yr_end"),
+    ('lit_types', "lit_type IN (SELECT value FROM json_each(:lit_types))"),
+])
+
+
+def fts_query(text):
+    ''' Convert free text into an FTS5 query: every word is a quoted
+    prefix term, and all of them must match. The FTS5 operators are not
+    exposed, so no user input can be a syntax error.
+
+    Returns
+    query -- str, FTS5 MATCH expression, '' if text has no words
+    '''
+
+    words = re.findall(r"\w+", text)
+
+    return " ".join('"{:s}"*'.format(w) for w in words)
+
+
+def unpack_search_opts(search_opts):
+    ''' Split search_opts into the column filters & the full-text query.
+    The free text is optional, so 5-tuples remain valid search_opts. '''
+
+    if len(search_opts) > 5:
+        return search_opts[:5], fts_query(search_opts[5] or '')
+    else:
+        return search_opts, ''
+
+
+def bind(search_opts):
+    ''' Bind search options to the canonical filters.
+
+    Arguments
+    search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types[, text])
+
+    Returns
+    shape  -- tuple of the names of FILTERS in use, in their order
+    params -- dict, named query arguments
+    '''
+
+    (mol1, mol2, yr_start, yr_end, checked_lit_types), query = unpack_search_opts(search_opts)
+
+    shape = []
+    params = {}
+    if query:
+        shape.append('query')
+        params['query'] = query
+    else:
+        pass
+    # molecules are matched by id, under any of their names
+    if mol1 and mol2:
+        shape.append('pair')
+        params['mol1'] = mol1
+        params['mol2'] = mol2
+    elif mol1 or mol2:
+        shape.append('mol')
+        params['mol'] = mol1 or mol2
+    else:
+        pass
+    if yr_start:
+        shape.append('yr_start')
+        params['yr_start'] = yr_start
+    else:
+        pass
+    if yr_end:
+        shape.append('yr_end')
+        params['yr_end'] = yr_end
+    else:
+        pass
+    if checked_lit_types:
+        shape.append('lit_types')
+        params['lit_types'] = json.dumps(list(checked_lit_types))
+    else:
+        pass
+
+    return tuple(shape), params
+
+
+@lru_cache(maxsize=None)
+def template(variant, shape, key=None, after=False):
+    ''' Canonical SQL of a search. The set of templates is fixed: one per
+    variant, shape & sort key.
+
+    Arguments
+    variant -- 'rows' all results, 'count' their number, or 'page' one
+               page of results by keyset pagination
+    shape   -- tuple, names of FILTERS in use, see bind
+    key     -- str, sort column of ordered rows & pages, None unordered.
+               Full-text searches are always ordered by BM25 score.
+    after   -- bool, a page after the last row of the previous page
+
+    Returns
+    sql_str -- str
+    '''
+
+    fts = 'query' in shape
+    if fts:
+        key = "bm25(lit_fts)"
+    else:
+        pass
+
+    sql_frag = [FILTERS[name] for name in shape]
+    if variant == 'count':
+        if fts:
+            select_str = SQL_FTS_COUNT
+        elif shape:
+            select_str = SQL_COUNT
+        else:
+            select_str = SQL_COUNT_ALL
+    else:
+        select_str = SQL_FTS_SELECT if fts else SQL_SELECT
+    if variant == 'page' and after:
+        sql_frag.append("({:s}, id) > (:last_key, :last_id)".format(key))
+    else:
+        pass
+
+    sql_str = select_str
+    if sql_frag:
+        sql_str += " WHERE " + " AND ".join(sql_frag)
+    else:
+        pass
+    if variant == 'page':
+        sql_str += " ORDER BY {:s}, id LIMIT :limit".format(key)
+    elif variant == 'rows' and key:
+        sql_str += " ORDER BY {:s}, id".format(key)
+    else:
+        pass
+
+    return sql_str
+
+
+def search_sql(search_opts, sort_opt=None):
+    ''' SQL of all results of a search.
+
+    Arguments
+    search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types[, text])
+                   text is matched against bibkey & note, and then the
+                   results are ranked by BM25, best first
+    sort_opt    -- str, key of SORT_KEYS, None for no particular order
+
+    Returns
+    sql_str -- str, sqlite3 query string
+    params  -- dict, sqlite3 query arguments
+    '''
+
+    shape, params = bind(search_opts)
+
+    return template('rows', shape, SORT_KEYS[sort_opt] if sort_opt else None), params
+
+
+def page_sql(search_opts, sort_opt, last_row=None, limit=100):
+    ''' SQL of one page of search results, ordered by the sort key & id.
+    The next page starts right after last_row (keyset pagination), so
+    each page costs the same regardless of how deep it is.
+
+    Arguments
+    search_opts -- (mol1, mol2, yr_start, yr_end, checked_lit_types[, text])
+    sort_opt    -- str, key of SORT_KEYS, ignored (may be None) by full-text
+                   searches, which are ordered by BM25 score
+    last_row    -- tuple, last row of the previous page, None for the
+                   first page
+    limit       -- int, page size
+
+    Returns
+    sql_str -- str, sqlite3 query string
+    params  -- dict, sqlite3 query arguments
+    '''
+
+    shape, params = bind(search_opts)
+    # full-text pages are ordered by score, whatever sort_opt is, even None
+    key = None if 'query' in shape else SORT_KEYS[sort_opt]
+    params['limit'] = limit
+    if last_row:
+        # the score of full-text rows follows the snippet
+        params['last_key'] = last_row[len(LIT_COLUMNS) + 1] if 'query' in shape else last_row[LIT_COLUMNS.index(key)]
+        params['last_id'] = last_row[0]
+    else:
+        pass
+
+    return template('page', shape, key, bool(last_row)), params
+
+
+def count_sql(search_opts):
+    ''' SQL counting all search results.
+
+    Returns
+    sql_str -- str, sqlite3 query string
+    params  -- dict, sqlite3 query arguments
+    '''
+
+    shape, params = bind(search_opts)
+
+    return template('count', shape), params
+
+
+class StatementStats(object):
+    ''' Reuse of the search templates: the SQL strings run, from every
+    connection of the process, are replayed into one LRU list of the size
+    of a statement cache (cached_statements). sqlite3 keeps a statement
+    cache per connection, and the searches are spread over several (the
+    main one & the readers), so this estimates how few distinct shapes
+    the searches take, not the hit rate of any actual cache. Thread safe.
+    '''
+
+    def __init__(self, size=128):
+        self.size = size
+        self.recent = OrderedDict()
+        self.distinct = set()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def record(self, sql_str):
+        ''' count sql_str as run, a hit if it would be cached '''
+
+        with self.lock:
+            self.distinct.add(sql_str)
+            if sql_str in self.recent:
+                self.hits += 1
+                self.recent.move_to_end(sql_str)
+            else:
+                self.misses += 1
+                self.recent[sql_str] = True
+                while len(self.recent) > self.size:
+                    self.recent.popitem(last=False)
+
+    def clear(self):
+
+        with self.lock:
+            self.recent.clear()
+            self.distinct = set()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        ''' Returns
+        stats -- dict, hits, misses, hit_rate & distinct statements
+        '''
+
+        with self.lock:
+            n = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / n if n else 0., 'distinct': len(self.distinct)}
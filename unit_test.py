@@ -2,9 +2,24 @@
 
 ''' unit tests '''
 
+import io
+import os
+import json
 import mylib
+import planner
+import sqlite3
+import tempfile
 import unittest
 
+# search queries read names from the lit_entry view, and match molecules by id
+SQL = {'sel': "SELECT id, mol1, mol2, lit_type, year, bibkey, note FROM lit_entry",
+       'cnt': "SELECT count(*) FROM (SELECT id, mol1 AS mol1_id, mol2 AS mol2_id, lit_type, year FROM lit) AS lit_entry",
+       'mol': "(mol1_id = (SELECT mol_id FROM mol_alias WHERE name = :mol) OR mol2_id = (SELECT mol_id FROM mol_alias WHERE name = :mol))",
+       'pair': "((mol1_id = (SELECT mol_id FROM mol_alias WHERE name = :mol1) AND mol2_id = (SELECT mol_id FROM mol_alias WHERE name = :mol2)) OR "
+               "(mol1_id = (SELECT mol_id FROM mol_alias WHERE name = :mol2) AND mol2_id = (SELECT mol_id FROM mol_alias WHERE name = :mol1)))",
+       'lit': "lit_type IN (SELECT value FROM json_each(:lit_types))"}
+
+
 class GenSearchSQLStr(unittest.TestCase):
     ''' Test gen_search_sql_str '''
 
@@ -12,16 +27,17 @@ class GenSearchSQLStr(unittest.TestCase):
     # (mol1, mol2, yr_start, yr_end, checked_lit_types)
 
     test_pairs = [
-        (('', '', None, None, []), ("SELECT * FROM lit", [])),
-        (('', '', None, None, ['MW']), ("SELECT * FROM lit WHERE lit_type in (?)", ['MW'])),
-        (('', '', None, None, ['MW', 'IR', 'Theory']), ("SELECT * FROM lit WHERE lit_type in (?, ?, ?)", ['MW', 'IR', 'Theory'])),
-        (('Ar', '', None, None, ['MW']), ("SELECT * FROM lit WHERE (mol1 = ? OR mol2 = ?) AND lit_type in (?)", ['Ar', 'Ar', 'MW'])),
-        (('', 'Kr', None, None, ['MW']), ("SELECT * FROM lit WHERE (mol1 = ? OR mol2 = ?) AND lit_type in (?)", ['Kr', 'Kr', 'MW'])),
-        (('Ar', 'H2O', None, None, ['MW']), ("SELECT * FROM lit WHERE (mol1 = ? AND mol2 = ?) OR (mol1 = ? AND mol2 = ?) AND lit_type in (?)", ['Ar', 'H2O', 'H2O', 'Ar', 'MW'])),
-        (('', '', 1990, None, ['MW']), ("SELECT * FROM lit WHERE year >= ? AND lit_type in (?)", [1990, 'MW'])),
-        (('', '', None, 2000, ['MW']), ("SELECT * FROM lit WHERE year <= ? AND lit_type in (?)", [2000, 'MW'])),
-        (('', '', 1990, 2000, ['MW']), ("SELECT * FROM lit WHERE year >= ? AND year <= ? AND lit_type in (?)", [1990, 2000, 'MW'])),
-        (('Ar', 'H2O', 1990, 2000, ['MW', 'IR']), ("SELECT * FROM lit WHERE (mol1 = ? AND mol2 = ?) OR (mol1 = ? AND mol2 = ?) AND year >= ? AND year <= ? AND lit_type in (?, ?)", ['Ar', 'H2O', 'H2O', 'Ar', 1990, 2000, 'MW', 'IR']))
+        (('', '', None, None, []), (SQL['sel'], {})),
+        (('', '', None, None, ['MW']), ("{sel} WHERE {lit}".format(**SQL), {'lit_types': '["MW"]'})),
+        (('', '', None, None, ['MW', 'IR', 'Theory']), ("{sel} WHERE {lit}".format(**SQL), {'lit_types': '["MW", "IR", "Theory"]'})),
+        (('Ar', '', None, None, ['MW']), ("{sel} WHERE {mol} AND {lit}".format(**SQL), {'mol': 'Ar', 'lit_types': '["MW"]'})),
+        (('', 'Kr', None, None, ['MW']), ("{sel} WHERE {mol} AND {lit}".format(**SQL), {'mol': 'Kr', 'lit_types': '["MW"]'})),
+        (('Ar', 'H2O', None, None, ['MW']), ("{sel} WHERE {pair} AND {lit}".format(**SQL), {'mol1': 'Ar', 'mol2': 'H2O', 'lit_types': '["MW"]'})),
+        (('', '', 1990, None, ['MW']), ("{sel} WHERE year >= :yr_start AND {lit}".format(**SQL), {'yr_start': 1990, 'lit_types': '["MW"]'})),
+        (('', '', None, 2000, ['MW']), ("{sel} WHERE year <= :yr_end AND {lit}".format(**SQL), {'yr_end': 2000, 'lit_types': '["MW"]'})),
+        (('', '', 1990, 2000, ['MW']), ("{sel} WHERE year >= :yr_start AND year <= :yr_end AND {lit}".format(**SQL), {'yr_start': 1990, 'yr_end': 2000, 'lit_types': '["MW"]'})),
+        (('Ar', 'H2O', 1990, 2000, ['MW', 'IR']), ("{sel} WHERE {pair} AND year >= :yr_start AND year <= :yr_end AND {lit}".format(**SQL),
+                                                   {'mol1': 'Ar', 'mol2': 'H2O', 'yr_start': 1990, 'yr_end': 2000, 'lit_types': '["MW", "IR"]'}))
     ]
 
     def test(self):
@@ -31,7 +47,754 @@ class GenSearchSQLStr(unittest.TestCase):
         for (i, j) in self.test_pairs:
             test_out = mylib.gen_search_sql_str(i)
             self.assertEqual(j, test_out)
+        self.assertEqual(mylib.gen_search_sql_str(('Ar', '', None, None, []), 'Year'),
+                         ("{sel} WHERE {mol} ORDER BY year, id".format(**SQL), {'mol': 'Ar'}))
+
+
+class GenPageSQLStr(unittest.TestCase):
+    ''' Test gen_page_sql_str & gen_count_sql_str '''
+
+    def test(self):
+
+        print('\nTest keyset page & count SQL generator')
+
+        opts = ('Ar', '', None, 2000, ['MW'])
+        self.assertEqual(mylib.gen_page_sql_str(opts, 'Year', None, 50),
+                         ("{sel} WHERE {mol} AND year <= :yr_end AND {lit} ORDER BY year, id LIMIT :limit".format(**SQL),
+                          {'mol': 'Ar', 'yr_end': 2000, 'lit_types': '["MW"]', 'limit': 50}))
+        last_row = (7, 'Ar', 'Ne', 'MW', 1995, 'Foo1995JCP', '')
+        self.assertEqual(mylib.gen_page_sql_str(opts, 'Year', last_row, 50),
+                         ("{sel} WHERE {mol} AND year <= :yr_end AND {lit} AND (year, id) > (:last_key, :last_id) ORDER BY year, id LIMIT :limit".format(**SQL),
+                          {'mol': 'Ar', 'yr_end': 2000, 'lit_types': '["MW"]', 'last_key': 1995, 'last_id': 7, 'limit': 50}))
+        self.assertEqual(mylib.gen_page_sql_str(('', '', None, None, []), 'Mol', last_row, 10),
+                         ("{sel} WHERE (mol1, id) > (:last_key, :last_id) ORDER BY mol1, id LIMIT :limit".format(**SQL),
+                          {'last_key': 'Ar', 'last_id': 7, 'limit': 10}))
+        self.assertEqual(mylib.gen_count_sql_str(opts),
+                         ("{cnt} WHERE {mol} AND year <= :yr_end AND {lit}".format(**SQL), {'mol': 'Ar', 'yr_end': 2000, 'lit_types': '["MW"]'}))
+        self.assertEqual(mylib.gen_count_sql_str(('', '', None, None, [])), ("SELECT count(*) FROM lit", {}))
+
+
+class QueryPlanner(unittest.TestCase):
+    ''' Test the canonical templates of the planner '''
+
+    def test(self):
+
+        print('\nTest canonical search templates')
+
+        # same shape, same statement: molecules, years & lit types vary
+        sql_str = mylib.gen_page_sql_str(('Ar', '', 1990, None, ['MW']), 'Mol')[0]
+        for opts in [('Ne', '', 2001, None, ['IR', 'Theory']), ('', 'Kr', 1, None, mylib.DEFAULT_LIT_TYPES)]:
+            self.assertIs(mylib.gen_page_sql_str(opts, 'Mol')[0], sql_str)
+        # the pair filter does not swallow the other filters
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        c = conn.cursor()
+        mylib.import_records(c, [('Ar', 'H2O', 'IR', 2000, 'Foo2000JCP', ''), ('H2O', 'Ar', 'Theory', 1980, 'Bar1980JCP', '')])
+        stats = mylib.STATEMENTS
+        stats.clear()
+        self.assertEqual(mylib.search_count(c, ('Ar', 'H2O', 1990, None, ['IR', 'Theory'])), 1)
+        self.assertEqual([row[5] for row in mylib.search(c, ('H2O', 'Ar', None, None, ['Theory']))], ['Bar1980JCP'])
+        self.assertEqual(mylib.search_count(c, ('H2O', 'Ar', 1970, None, ['Theory'])), 1)
+        self.assertEqual(stats.stats(), {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'distinct': 2})
+        conn.close()
+
+
+class ReadPairCounts(unittest.TestCase):
+    ''' Test read_pair_counts '''
+
+    records = [
+        ('H2O', 'OH', 'Microwave', 2005, 'Ohshima2005JACS', 'B'),
+        ('OH', 'H2O', 'Microwave', 2006, 'Foo2006JCP', ''),
+        ('Ar', 'HO2', 'Microwave', 2005, 'Suma2005JCP', 'A'),
+        ('Ar', 'D2O', '(sub)mm', 2012, 'Li2012JMS', None),
+        ('Ar', 'Ar', 'IR', 2000, 'Bar2000JCP', ''),
+    ]
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        mylib.import_records(self.conn.cursor(), self.records)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test(self):
+
+        print('\nTest aggregate pair counts')
+
+        r = mylib.read_pair_counts(self.conn.cursor(), ['Microwave', '(sub)mm', 'IR', 'Theory'])
+        self.assertEqual(sorted(r.keys()), ['(sub)mm', 'IR', 'Microwave'])
+        m = r['Microwave']
+        self.assertEqual(m.mol_list, ['Ar', 'H2O', 'HO2', 'OH'])
+        # (H2O, OH) and (OH, H2O) share the lower triangular cell
+        self.assertEqual(m.count(3, 1), 2)
+        self.assertEqual(sorted(m.detail(3, 1).split('\n')), ['Foo2006JCP: ', 'Ohshima2005JACS: B'])
+        self.assertEqual((m.detail(2, 0), m.count(2, 0)), ('Suma2005JCP: A', 1))
+        self.assertEqual(len(m), 2)
+        # missing pairs mean zero
+        self.assertEqual((m.detail(1, 0), m.count(1, 0)), ('', 0))
+        self.assertEqual(m.count(0, 2), 1)
+        self.assertEqual((r['(sub)mm'].mol_list, r['(sub)mm'].count(1, 0), r['(sub)mm'].detail(1, 0)), (['Ar', 'D2O'], 1, 'Li2012JMS: '))
+        self.assertEqual((r['IR'].mol_list, r['IR'].count(0, 0)), (['Ar'], 1))
+        self.assertEqual(mylib.read_pair_counts(self.conn.cursor(), []), {})
+
+    def test_snapshot(self):
+
+        print('\nTest matrix snapshots')
+
+        lit_types = ['Microwave', '(sub)mm', 'IR', 'Theory']
+        cursor = self.conn.cursor()
+        built = mylib.load_matrices(cursor, lit_types)
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM matrix_snapshot").fetchone()[0], 4)
+        loaded = mylib.load_matrices(cursor, lit_types)
+        self.assertEqual(sorted(loaded), ['(sub)mm', 'IR', 'Microwave'])
+        for lit_type in loaded:
+            self.assertEqual(loaded[lit_type].dumps(), built[lit_type].dumps())
+        self.assertEqual((loaded['Microwave'].count(3, 1), loaded['IR'].detail(0, 0)), (2, 'Bar2000JCP: '))
+        # a write outdates the snapshots
+        mylib.insert_entry(cursor, ('Ar', 'Ne', 'Theory', 2001, 'Baz2001JCP', 'x'))
+        self.assertEqual(mylib.load_matrices(cursor, ['Theory'])['Theory'].mol_list, ['Ar', 'Ne'])
+        self.assertEqual(mylib.load_matrices(cursor, []), {})
+        # the transaction of the caller is neither committed nor ended
+        cursor.execute("INSERT INTO lit (mol1, mol2, lit_type, year, bibkey) VALUES (1, 1, 'IR', 2002, 'Tmp2002')")
+        mylib.load_matrices(cursor, ['IR'])
+        self.assertTrue(self.conn.in_transaction)
+        self.conn.rollback()
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM lit WHERE bibkey = 'Tmp2002'").fetchone()[0], 0)
+
+
+class PairMatrixUpdate(unittest.TestCase):
+    ''' Test PairMatrix.set_pair '''
+
+    def test(self):
+
+        print('\nTest sparse matrix update')
+
+        m = mylib.PairMatrix.from_pairs(['Ar', 'H2O', 'OH'], [(2, 1, 1, 'a'), (1, 0, 2, 'b')])
+        # update an existing pair
+        self.assertFalse(m.set_pair('OH', 'H2O', 3, 'c'))
+        self.assertEqual((m.count(2, 1), m.detail(2, 1)), (3, 'c'))
+        # add a pair between known molecules
+        self.assertFalse(m.set_pair('Ar', 'Ar', 1, 'd'))
+        self.assertEqual((m.count(0, 0), m.count(1, 0), len(m)), (1, 2, 3))
+        # remove a pair
+        self.assertFalse(m.set_pair('H2O', 'Ar', 0, ''))
+        self.assertEqual((m.count(1, 0), m.detail(1, 0), len(m)), (0, '', 2))
+        # never-seen molecule shifts rows & columns
+        self.assertTrue(m.set_pair('Kr', 'OH', 1, 'e'))
+        self.assertEqual(m.mol_list, ['Ar', 'H2O', 'Kr', 'OH'])
+        self.assertEqual((m.count(3, 1), m.count(0, 0), m.count(3, 2)), (3, 1, 1))
+        self.assertEqual(list(m.indptr), [0, 1, 1, 1, 3])
+        # removing a pair of unknown molecules does nothing
+        self.assertFalse(m.set_pair('Ne', 'Ar', 0, ''))
+        self.assertEqual(m.n, 4)
+
+
+class ChangeLog(unittest.TestCase):
+    ''' Test the shared change log & its retention '''
+
+    def test(self):
+
+        print('\nTest change log')
+
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        c = conn.cursor()
+        self.assertEqual(mylib.read_changes(c, 0), (0, set()))
+        for k in range(5):
+            mylib.insert_entry(c, ('Ar', 'Ne', 'IR', 2000 + k, 'Foo{:d}'.format(k), ''))
+        self.assertEqual(mylib.read_changes(c, 0), (5, {('IR', 'Ar', 'Ne')}))
+        # a reader behind the kept changes must rebuild
+        mylib.prune_changes(c, keep=2)
+        self.assertEqual(mylib.read_changes(c, 3), (5, {('IR', 'Ar', 'Ne')}))
+        self.assertEqual(mylib.read_changes(c, 2), (5, None))
+        self.assertEqual(mylib.read_changed_pairs(c, 1, ['IR', 'Theory']), (5, {'IR', 'Theory'}, None))
+        self.assertEqual(mylib.read_changed_pairs(c, 4, ['IR']), (5, {'IR'}, [('IR', 'Ar', 'Ne', 5, '\n'.join(
+            'Foo{:d}: '.format(k) for k in range(5)))]))
+        mylib.prune_changes(c, keep=0)
+        self.assertEqual(mylib.read_changes(c, 5), (5, set()))
+        self.assertEqual(mylib.read_changes(c, 4), (5, None))
+        conn.close()
+
+
+class Migrate(unittest.TestCase):
+    ''' Test schema migrations '''
+
+    def test(self):
+
+        print('\nTest schema migrations')
+
+        conn = sqlite3.connect(':memory:')
+        # a database created before versioning
+        conn.execute(mylib.MIGRATIONS[0][0])
+        conn.execute("INSERT INTO lit (mol1, mol2, lit_type, year, bibkey, note) VALUES ('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', '')")
+        conn.commit()
+        self.assertEqual(mylib.migrate(conn), len(mylib.MIGRATIONS))
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], len(mylib.MIGRATIONS))
+        self.assertEqual(conn.execute("SELECT count(*) FROM lit").fetchone()[0], 1)
+        # molecules are referred to by id
+        self.assertEqual(conn.execute("SELECT typeof(mol1), typeof(mol2) FROM lit").fetchone(), ('integer', 'integer'))
+        self.assertEqual(conn.execute("SELECT mol1, mol2, bibkey FROM lit_entry").fetchone(), ('Ar', 'Ne', 'Foo2000JCP'))
+        self.assertEqual(mylib.read_pair(conn.cursor(), 'IR', 'Ne', 'Ar'), (1, 'Foo2000JCP: '))
+        # up to date, nothing to do
+        self.assertEqual(mylib.migrate(conn), len(mylib.MIGRATIONS))
+        conn.close()
+
+        # identical copies are merged, distinct records stop the upgrade
+        conn = sqlite3.connect(':memory:')
+        conn.execute(mylib.MIGRATIONS[0][0])
+        conn.executemany("INSERT INTO lit (mol1, mol2, lit_type, year, bibkey, note) VALUES (?, ?, ?, ?, ?, ?)",
+                         [('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', None), ('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', None),
+                          ('Ar', 'Kr', 'IR', 2001, 'Bar2001JCP', 'a'), ('Ar', 'Kr', 'Theory', 2001, 'Bar2001JCP', 'b')])
+        conn.commit()
+        with self.assertRaisesRegex(sqlite3.IntegrityError, 'ids 3, 4: Ar Kr 2001 Bar2001JCP'):
+            mylib.migrate(conn)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], 2)
+        self.assertEqual(conn.execute("SELECT count(*) FROM lit").fetchone()[0], 4)
+        conn.execute("UPDATE lit SET bibkey = 'Bar2001JCPb' WHERE id = 4")
+        conn.commit()
+        self.assertEqual(mylib.migrate(conn), len(mylib.MIGRATIONS))
+        self.assertEqual([row[0] for row in conn.execute("SELECT bibkey FROM lit ORDER BY id")],
+                         ['Foo2000JCP', 'Bar2001JCP', 'Bar2001JCPb'])
+        conn.close()
+
+
+class Molecule(unittest.TestCase):
+    ''' Test the molecule dictionary & aliases '''
+
+    records = [
+        ('H2O', 'Ar', 'IR', 2000, 'Foo2000JCP', ''),
+        ('h2o', 'Ar', 'IR', 2000, 'Foo2000JCP', ''),
+        ('h2o', 'Ne', 'IR', 2001, 'Bar2001JCP', ''),
+    ]
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        mylib.import_records(self.conn.cursor(), self.records)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test(self):
+
+        print('\nTest molecule aliases')
+
+        c = self.conn.cursor()
+        self.assertEqual(self.conn.execute("SELECT count(*) FROM molecule").fetchone()[0], 4)
+        # merge the spelling variant, the duplicate of Foo2000JCP is dropped
+        self.assertEqual(mylib.add_alias(c, 'h2o', 'H2O'), 1)
+        self.assertEqual(mylib.mol_id(c, 'h2o'), mylib.mol_id(c, 'H2O'))
+        self.assertEqual(sorted(row[1:3] for row in mylib.search(c, ('h2o', '', None, None, []))),
+                         [('H2O', 'Ar'), ('H2O', 'Ne')])
+        m = mylib.read_pair_counts(c, ['IR'])['IR']
+        self.assertEqual(m.mol_list, ['Ar', 'H2O', 'Ne'])
+        self.assertEqual(m.count(1, 0), 1)
+        # new entries may use any name
+        mylib.insert_entry(c, ('Ne', 'h2o', 'IR', 2002, 'Baz2002JCP', ''))
+        self.assertEqual(mylib.read_pair(c, 'IR', 'H2O', 'Ne')[0], 2)
+        self.assertTrue(mylib.check_duplicates(c, 'Ne', 'H2O', 2002, 'Baz2002JCP'))
+
+
+class BatchEdit(unittest.TestCase):
+    ''' Test check_edits & update_entries '''
+
+    records = [
+        ('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', ''),
+        ('Ar', 'Ne', 'IR', 2001, 'Bar2001JCP', ''),
+        ('Ar', 'Kr', 'IR', 2002, 'Baz2002JCP', ''),
+    ]
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        mylib.import_records(self.conn.cursor(), self.records)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test(self):
+
+        print('\nTest batch edits')
+
+        c = self.conn.cursor()
+        # 2 takes the key of 1, which moves away in the same batch
+        edits = [(1, ('Ar', 'Ne', 'IR', '1999', 'Foo2000JCP', 'a')),
+                 (2, ('Ar', 'Ne', 'IR', '2000', 'Foo2000JCP', 'b'))]
+        self.assertEqual(mylib.check_edits(c, edits), [])
+        # taken by 3 outside the batch, or twice in the batch
+        self.assertEqual(mylib.check_edits(c, [(1, ('Ar', 'Kr', 'IR', '2002', 'Baz2002JCP', ''))]), [1])
+        self.assertEqual(mylib.check_edits(c, [(1, ('Xe', 'Ne', 'IR', '2000', 'Foo2000JCP', '')),
+                                               (2, ('Xe', 'Ne', 'IR', '2000', 'Foo2000JCP', ''))]), [2])
+        mylib.update_entries(c, edits)
+        self.assertEqual(c.execute("SELECT year, note FROM lit ORDER BY id").fetchall(), [(1999, 'a'), (2000, 'b'), (2002, '')])
+        # a conflict rolls back the whole batch, new molecules included
+        with self.assertRaises(sqlite3.IntegrityError):
+            mylib.update_entries(c, [(1, ('Xe', 'Ne', 'IR', '1999', 'Foo2000JCP', 'c')),
+                                     (2, ('Ar', 'Kr', 'IR', '2002', 'Baz2002JCP', ''))])
+        self.assertEqual(c.execute("SELECT year, note FROM lit ORDER BY id").fetchall(), [(1999, 'a'), (2000, 'b'), (2002, '')])
+        self.assertIsNone(mylib.mol_id(c, 'Xe'))
+        # 1 takes the key of 2, which moves away later in the batch
+        edits = [(1, ('Ar', 'Ne', 'IR', '2000', 'Foo2000JCP', 'c')),
+                 (2, ('Ar', 'Ne', 'IR', '2001', 'Foo2000JCP', 'd'))]
+        self.assertEqual(mylib.check_edits(c, edits), [])
+        mylib.update_entries(c, edits)
+        self.assertEqual(c.execute("SELECT year, note FROM lit ORDER BY id").fetchall(), [(2000, 'c'), (2001, 'd'), (2002, '')])
+        # 1 & 2 swap their keys
+        edits = [(1, ('Ar', 'Ne', 'IR', '2001', 'Foo2000JCP', 'e')),
+                 (2, ('Ar', 'Ne', 'IR', '2000', 'Foo2000JCP', 'f'))]
+        self.assertEqual(mylib.check_edits(c, edits), [])
+        mylib.update_entries(c, edits)
+        self.assertEqual(c.execute("SELECT year, bibkey, note FROM lit ORDER BY id").fetchall(),
+                         [(2001, 'Foo2000JCP', 'e'), (2000, 'Foo2000JCP', 'f'), (2002, 'Baz2002JCP', '')])
+        self.assertEqual(c.execute("SELECT n, detail FROM pair_counts WHERE n = 2").fetchall(), [(2, 'Foo2000JCP: e\nFoo2000JCP: f')])
+        # 2 keeps its key & changes the note only: the edit moving in conflicts
+        self.assertEqual(mylib.check_edits(c, [(1, ('Ar', 'Ne', 'IR', '2000', 'Foo2000JCP', '')),
+                                               (2, ('Ar', 'Ne', 'IR', '2000', 'Foo2000JCP', 'g'))]), [1])
+
+
+class Connect(unittest.TestCase):
+    ''' Test the connection factory & the read only pool '''
+
+    def test(self):
+
+        print('\nTest connections')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, 'test.db')
+            mylib.create_db(db_name)
+            conn = mylib.connect(db_name)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)   # NORMAL
+            pool = mylib.ReadPool(db_name, 2)
+            reader = pool.get()
+            # a pending write does not block the reader, which keeps its snapshot
+            mylib.add_mols(conn.cursor(), ['Ar'])
+            conn.execute("INSERT INTO lit (mol1, mol2, lit_type, year, bibkey) VALUES (1, 1, 'IR', 2000, 'Foo2000JCP')")
+            self.assertEqual(reader.execute("SELECT count(*) FROM lit").fetchone()[0], 0)
+            conn.commit()
+            self.assertEqual(reader.execute("SELECT count(*) FROM lit").fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                reader.execute("DELETE FROM lit")
+            pool.put(reader)
+            self.assertFalse(reader.in_transaction)
+            self.assertIs(pool.get(), reader)
+            pool.put(reader)
+            pool.close()
+            conn.close()
+
+
+class SearchCache(unittest.TestCase):
+    ''' Test the search cache & its invalidation '''
+
+    def test(self):
+
+        print('\nTest search cache')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_name = os.path.join(tmp, 'test.db')
+            mylib.create_db(db_name)
+            conn = mylib.connect(db_name)
+            mylib.import_records(conn.cursor(), [('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', ''),
+                                                 ('Ar', 'Kr', 'Theory', 2001, 'Bar2001JCP', '')])
+            reader = mylib.connect(db_name, read_only=True)
+            c = reader.cursor()
+            cache = mylib.SearchCache(size=2)
+            self.assertEqual(cache.search_count(c, ('Ar', '', None, None, ['IR', 'Theory'])), 2)
+            # same search, other order of lit types & an empty text
+            self.assertEqual(cache.search_count(c, ('Ar', '', None, None, ['Theory', 'IR'], ' ')), 2)
+            self.assertEqual(len(cache.search_page(c, ('Ar', '', None, None, []), 'Mol')), 2)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            # the least recently used count is dropped
+            cache.search_count(c, ('Ne', '', None, None, []))
+            cache.search_count(c, ('Ar', '', None, None, ['IR', 'Theory']))
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+            # a write of another connection invalidates the cache
+            mylib.insert_entry(conn.cursor(), ('Ar', 'Xe', 'IR', 2002, 'Baz2002JCP', ''))
+            self.assertEqual(cache.search_count(c, ('Ar', '', None, None, ['IR', 'Theory'])), 3)
+            self.assertEqual(cache.stats()['entries'], 1)
+            # so does a new name
+            self.assertEqual(cache.search_count(c, ('argon', '', None, None, [])), 0)
+            with conn:
+                mylib.add_alias(conn.cursor(), 'argon', 'Ar')
+            self.assertEqual(cache.search_count(c, ('argon', '', None, None, [])), 3)
+            self.assertEqual(cache.stats()['hits'], 1)
+            cache.clear()
+            self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'hit_rate': 0., 'entries': 0})
+            # full-text pages are ranked by score, any sort option shares them
+            fts_opts = ('', '', None, None, [], 'Baz')
+            self.assertEqual([row[5] for row in cache.search_page(c, fts_opts, 'Year')], ['Baz2002JCP'])
+            first = cache.search_page(c, fts_opts, 'Mol')
+            self.assertEqual(cache.search_page(c, fts_opts, 'Year', first[-1]), [])
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            reader.close()
+            conn.close()
+
+
+class MolIndex(unittest.TestCase):
+    ''' Test the prefix index of molecule names '''
+
+    def test(self):
+
+        print('\nTest molecule name index')
+
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        c = conn.cursor()
+        mylib.import_records(c, [('Ar', 'H2O', 'IR', 2000, 'Foo2000JCP', ''), ('HCN', 'H2', 'IR', 2001, 'Bar2001JCP', '')])
+        mylib.add_alias(c, 'argon', 'Ar')
+        index = mylib.MolIndex(mylib.read_mol_names(c))
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.complete('h'), ['H2', 'H2O', 'HCN'])
+        self.assertEqual(index.complete('H2'), ['H2', 'H2O'])
+        self.assertEqual(index.complete('a'), ['Ar', 'argon'])
+        self.assertEqual(index.complete('h', limit=1), ['H2'])
+        self.assertEqual(index.complete('Xe'), [])
+        index.add(['h2s', 'H2', ''])
+        self.assertEqual(index.complete('H2'), ['H2', 'H2O', 'h2s'])
+        self.assertIn('h2s', index)
+        self.assertNotIn('H2S', index)
+        conn.close()
+
+
+@unittest.skipIf(mylib.np is None, 'numpy is not installed')
+class HeatmapTiles(unittest.TestCase):
+    ''' Test the level-of-detail tiles of the heatmap '''
+
+    def test(self):
+
+        print('\nTest heatmap tiles')
+
+        mols = ['M{:02d}'.format(i) for i in range(10)]
+        pairs = [(1, 0, 2, 'A'), (3, 2, 5, 'B'), (3, 3, 1, 'C'), (9, 8, 4, 'D'), (9, 1, 7, 'E')]
+        matrix = mylib.PairMatrix.from_pairs(mols, pairs)
+        tiles = mylib.HeatmapTiles(matrix, size=4)
+        self.assertEqual((tiles.max_level, tiles.n_tiles(0), tiles.n_tiles(2)), (2, 3, 1))
+        self.assertEqual(tiles.level_for(1.), 0)
+        self.assertEqual(tiles.level_for(0.25), 2)
+        self.assertEqual(tiles.tile(0, 0, 0)[3].tolist(), [0, 0, 5, 1])
+        self.assertEqual(tiles.tile(0, 2, 0)[1].tolist(), [0, 7, 0, 0])
+        # blocks of 2 x 2 cells, max & sum pooling
+        self.assertEqual(tiles.tile(1, 0, 0)[:3, :3].tolist(), [[2, 0, 0], [0, 5, 0], [0, 0, 0]])
+        self.assertEqual(tiles.vmax(2), 7)
+        tiles = mylib.HeatmapTiles(matrix, size=4, pool='sum')
+        self.assertEqual(tiles.tile(1, 0, 0)[1, 1], 6)
+        self.assertEqual(tiles.tile(2, 0, 0).sum(), 19)
+        # a click on a block resolves to its cell with the most records
+        self.assertEqual(tiles.block_cell(1, 1, 1), (3, 2))
+        self.assertEqual(tiles.block_cell(1, 4, 0), (9, 1))
+        self.assertIsNone(tiles.block_cell(1, 2, 0))
+        # colors: empty cells, the log scale, nothing above the diagonal
+        argb = tiles.image(0, 0, 0)
+        self.assertEqual(argb[0, 0], tiles.EMPTY_COLOR)
+        self.assertEqual(argb[3, 3], tiles.lut[1 + int(mylib.np.log1p(1) * 254 / mylib.np.log1p(7))])
+        self.assertEqual(argb[0, 1], 0)
+        matrix.set_pair('M09', 'M01', 0, '')
+        tiles.invalidate()
+        self.assertEqual(tiles.vmax(0), 5)
+
+
+@unittest.skipIf(mylib.np is None, 'numpy is not installed')
+class PairYears(unittest.TestCase):
+    ''' Test the year window of the matrices '''
+
+    def test(self):
+
+        print('\nTest pair years')
+
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        c = conn.cursor()
+        mylib.import_records(c, [('Ar', 'Ne', 'IR', 1990, 'A1990', ''),
+                                 ('Ne', 'Ar', 'IR', 1995, 'B1995', ''),
+                                 ('Ar', 'Ne', 'IR', 2000, 'C2000', ''),
+                                 ('Ar', 'H2O', 'IR', 1995, 'D1995', ''),
+                                 ('Ar', 'Ar', 'IR', 2003, 'E2003', ''),
+                                 ('Ar', 'Kr', 'Theory', 1980, 'F1980', '')])
+        matrix = mylib.read_pair_counts(c, ['IR'])['IR']
+        years = mylib.read_pair_years(c, 'IR', matrix)
+        self.assertEqual((len(years), years.first_year, years.last_year), (3, 1990, 2003))
+        # all years add up to the all-time counts
+        self.assertEqual(years.window().tolist(), list(matrix.counts))
+        windowed = matrix.with_counts(years.window(1991, 2000))
+        ar, ne, h2o = (matrix.index(mol) for mol in ('Ar', 'Ne', 'H2O'))
+        self.assertEqual((windowed.count(ne, ar), windowed.count(ar, h2o), windowed.count(ar, ar)), (2, 1, 0))
+        self.assertEqual(years.window(1995, 1995).tolist(), years.window(1992, 1998).tolist())
+        # out of range & empty windows
+        self.assertEqual(years.window(1900, 1990).sum(), 1)
+        self.assertEqual(years.window(2003, 2100).sum(), 1)
+        self.assertEqual(years.window(2001, 2000).sum(), 0)
+        self.assertEqual(years.window(2010, None).sum(), 0)
+        # pairs missing from the matrix, e.g. added since it was read
+        mylib.insert_entry(c, ('Ne', 'Kr', 'IR', 1995, 'G1995', ''))
+        self.assertEqual(mylib.read_pair_years(c, 'IR', matrix).window().tolist(), list(matrix.counts))
+        conn.close()
+
+
+class Export(unittest.TestCase):
+    ''' Test the streaming export of results & matrices '''
+
+    def setUp(self):
+
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        self.c = self.conn.cursor()
+        mylib.import_records(self.c, [('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', 'a, b'),
+                                      ('Ne', 'Ar', 'IR', 2001, 'Bar2001JCP', ''),
+                                      ('Kr', 'Kr', 'IR', 2001, 'Bar2001JCP', ''),
+                                      ('Ar', 'Kr', 'Theory', 2002, 'Baz2002JCP', '')])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_search(self):
+
+        print('\nTest export of search results')
+
+        f = io.StringIO()
+        n = mylib.export_search(self.c, ('Ar', '', None, None, ['IR']), f, 'csv', chunk_size=1)
+        self.assertEqual(n, 2)
+        self.assertEqual(f.getvalue().splitlines()[:2], ['id,mol1,mol2,lit_type,year,bibkey,note',
+                                                         '1,Ar,Ne,IR,2000,Foo2000JCP,"a, b"'])
+        f = io.StringIO()
+        mylib.export_search(self.c, ('', '', None, None, [], 'foo'), f, 'jsonl')
+        row = json.loads(f.getvalue())
+        self.assertEqual((row['bibkey'], row['note'], sorted(row)[-2:]), ('Foo2000JCP', 'a, b', ['snippet', 'year']))
+        f = io.StringIO()
+        self.assertEqual(mylib.export_search(self.c, ('', '', None, None, []), f, 'bibkeys'), 3)
+        self.assertEqual(f.getvalue(), 'Bar2001JCP\nBaz2002JCP\nFoo2000JCP\n')
+        with self.assertRaises(ValueError):
+            mylib.export_search(self.c, ('', '', None, None, []), f, 'xml')
+
+    def test_matrix(self):
+
+        print('\nTest export of matrices')
+
+        f = io.StringIO()
+        self.assertEqual(mylib.export_pairs(self.c, ['IR', 'Theory'], f), 3)
+        self.assertEqual(f.getvalue().splitlines(), ['lit_type,mol_a,mol_b,count', 'IR,Kr,Kr,1',
+                                                     'IR,Ar,Ne,2', 'Theory,Ar,Kr,1'])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'ir.csv')
+            self.assertEqual(mylib.export_dense(self.c, 'IR', filename), 3)
+            with open(filename) as f:
+                self.assertEqual(f.read().splitlines(), [',Ar,Kr,Ne', 'Ar,0,,', 'Kr,0,1,', 'Ne,2,0,0'])
+
+
+class Tracer(unittest.TestCase):
+    ''' Test timing spans of queries '''
+
+    def test(self):
+
+        print('\nTest tracing')
+
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        tracer = mylib.TRACER
+        tracer.enabled = True
+        tracer.clear()
+        try:
+            c = conn.cursor(mylib.TracingCursor)
+            mylib.import_records(c, [('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', ''), ('Ar', 'Kr', 'IR', 2001, 'Bar2001JCP', '')])
+            with tracer.span('search', 'job'):
+                rows = mylib.search_page(c, ('Ar', '', None, None, []), 'Mol')
+            self.assertEqual(len(rows), 2)
+            self.assertEqual([(e[0], e[1]) for e in tracer.events][-3:],
+                             [('SELECT', 'sql'), ('fetch', 'sql'), ('search', 'job')])
+            self.assertEqual(tracer.events[-2][5]['rows'], 2)
+            job = tracer.events[-1]
+            stats = tracer.breakdown(job[2], job[3])
+            self.assertEqual((stats['queries'], stats['rows']), (1, 2))
+            self.assertGreaterEqual(stats['job'], stats['sql'])
+            with tempfile.TemporaryDirectory() as tmp:
+                tracer.dump(os.path.join(tmp, 'trace.json'))
+                with open(os.path.join(tmp, 'trace.json')) as f:
+                    trace = json.load(f)
+            self.assertEqual([e['name'] for e in trace['traceEvents']][-3:], ['SELECT', 'fetch', 'search'])
+            self.assertEqual(trace['traceEvents'][-1]['ph'], 'X')
+            # disabled, nothing is recorded
+            tracer.enabled = False
+            tracer.clear()
+            mylib.search_page(c, ('Ar', '', None, None, []), 'Mol')
+            self.assertEqual(len(tracer.events), 0)
+        finally:
+            tracer.enabled = False
+            conn.close()
+
+
+class FullTextSearch(unittest.TestCase):
+    ''' Test full-text search over bibkey & note '''
+
+    records = [
+        ('H2O', 'OH', 'Microwave', 2005, 'Ohshima2005JACS', 'tunneling splitting'),
+        ('Ar', 'HO2', 'Microwave', 2005, 'Suma2005JCP', 'tunnel tunnel tunnel'),
+        ('Ar', 'D2O', '(sub)mm', 2012, 'Li2012JMS', None),
+    ]
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        mylib.import_records(self.conn.cursor(), self.records)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test(self):
+
+        print('\nTest full-text search')
+
+        c = self.conn.cursor()
+        self.assertEqual(planner.fts_query('tunnel "H2O'), '"tunnel"* "H2O"*')
+        # ranked by BM25, with the matches marked in the snippet
+        rows = mylib.search_page(c, ('', '', None, None, [], 'tunnel'), 'Mol')
+        self.assertEqual([row[5] for row in rows], ['Suma2005JCP', 'Ohshima2005JACS'])
+        self.assertEqual(rows[1][7], '[tunneling] splitting')
+        self.assertEqual(mylib.search_count(c, ('', '', None, None, [], 'tunnel')), 2)
+        # combined with the column filters, and bibkey prefixes
+        self.assertEqual(mylib.search_count(c, ('Ar', '', None, None, [], 'tunnel')), 1)
+        self.assertEqual(mylib.search_count(c, ('', '', None, None, [], 'li2012')), 1)
+        # next page after the best match
+        rows = mylib.search_page(c, ('', '', None, None, [], 'tunnel'), 'Mol', rows[0])
+        self.assertEqual([row[5] for row in rows], ['Ohshima2005JACS'])
+        # the index follows updates & deletes
+        mylib.update_entry(c, 1, ('H2O', 'OH', 'Microwave', 2005, 'Ohshima2005JACS', 'rotation'))
+        self.conn.execute("DELETE FROM lit WHERE id = 2")
+        self.assertEqual(mylib.search_count(c, ('', '', None, None, [], 'tunnel')), 0)
+        self.assertEqual(mylib.search_count(c, ('', '', None, None, [], 'rotation')), 1)
+        # words only, no FTS5 syntax: an empty query means no text filter
+        self.assertEqual(mylib.search_count(c, ('', '', None, None, [], '" *')), 2)
+
+
+class QueryPlan(unittest.TestCase):
+    ''' Every query shape of main.py & mylib.py must use an index '''
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        mylib.migrate(self.conn)
+        # enough records for ANALYZE to steer the plans like on a real database
+        mols = ['M{:03d}'.format(i) for i in range(300)]
+        mylib.import_records(self.conn.cursor(), [
+            (mols[k % 300], mols[k * 7 % 299], mylib.DEFAULT_LIT_TYPES[k % 4], 1970 + k % 50, 'Foo{:d}'.format(k), '')
+            for k in range(3000)])
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test(self):
+
+        print('\nTest query plans')
+
+        queries = [
+            (mylib.SQL_CHECK_DUPLICATES, ('Ar', 'Ne', 2000, 'Foo2000JCP')),
+            (mylib.SQL_CHECK_DUPLICATES_NOTE, ('Ar', 'Ne', 2000, 'Foo2000JCP', '')),
+            (mylib.SQL_KEY_IDS, ('Ar', 'Ne', 2000, 'Foo2000JCP')),
+            (mylib.SQL_PAIR_COUNTS.format('?, ?'), ('MW', 'IR')),
+            (mylib.SQL_PAIR, ('MW', 'Ar', 'Ne')),
+            (mylib.SQL_PAIR_YEARS, ('MW',)),
+            (mylib.SQL_EXPORT_PAIRS.format('?, ?'), ('MW', 'IR')),
+            (mylib.SQL_EXPORT_MOLS, ('MW',)),
+            (mylib.SQL_CHANGES, (0,)),
+            (mylib.SQL_PRUNE_CHANGES, (0,)),
+            (mylib.SQL_LOAD_SNAPSHOT.format('?, ?'), (1, mylib.PairMatrix.FMT, 'MW', 'IR')),
+            (mylib.SQL_UPDATE, ('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', '', 1)),
+            (mylib.SQL_PARK_KEY, ('Ar', 'Ne', 'IR', 2000, 'Foo2000JCP', '', 1)),
+        ]
+        last_row = (7, 'Ar', 'Ne', 'MW', 1995, 'Foo1995JCP', '')
+        for search_opts in [('Ar', '', None, None, []), ('', 'Ne', None, None, []),
+                            ('Ar', 'Ne', None, None, ['MW']), ('', '', 1990, 2000, []),
+                            ('', '', None, None, ['MW', 'IR']), ('', '', None, None, []),
+                            ('Ar', '', None, None, [], 'tunnel'), ('', '', None, None, [], 'Foo')]:
+            # a count or a stream of all records, or of whole lit types,
+            # reads them all anyway
+            selective = bool(search_opts[0] or search_opts[1] or search_opts[5:])
+            browse = not (selective or search_opts[2])
+            if not browse:
+                queries.append(mylib.gen_count_sql_str(search_opts))
+                queries.append(mylib.gen_search_sql_str(search_opts))
+                sql_str, sql_arg = mylib.gen_search_sql_str(search_opts)
+                queries.append((mylib.SQL_EXPORT_BIBKEYS.format(sql_str), sql_arg))
+            elif search_opts[4]:
+                queries.append(mylib.gen_count_sql_str(search_opts))
+            else:
+                pass
+            for sort_opt in planner.SORT_KEYS:
+                # full-text rows end with (snippet, score)
+                for row in (None, last_row + ('', -1.0)):
+                    sql_str, sql_arg = mylib.gen_page_sql_str(search_opts, sort_opt, row)
+                    # pages browsing all records, some lit types or years
+                    # come in index order. Pages of a molecule or a text
+                    # only sort their matches.
+                    ordered = browse or (sort_opt == 'Year' and not selective)
+                    ok, plan = mylib.uses_index(self.conn.cursor(), sql_str, sql_arg, ordered=ordered)
+                    self.assertTrue(ok, '{:s}\n{:s}'.format(sql_str, '\n'.join(plan)))
+
+        for (sql_str, sql_arg) in queries:
+            ok, plan = mylib.uses_index(self.conn.cursor(), sql_str, sql_arg)
+            self.assertTrue(ok, '{:s}\n{:s}'.format(sql_str, '\n'.join(plan)))
+        # the check catches full scans of an index & sorts
+        self.assertFalse(mylib.uses_index(self.conn.cursor(), "SELECT * FROM lit ORDER BY year")[0])
+        self.assertFalse(mylib.uses_index(self.conn.cursor(), "SELECT * FROM lit ORDER BY note LIMIT 10", ordered=True)[0])
+
+
+class ImportRecords(unittest.TestCase):
+    ''' Test BibTeX / CSV parsers & bulk import '''
+
+    bib = '''% exported from a reference manager
+@string{jcp = "J. Chem. Phys."}
+@article{Foo2000JCP,
+  author = {A. {B}ar and C. Baz},
+  mol1 = {Ar},
+  mol2 = "H2O",
+  littype = {Microwave},
+  year = 2000,
+  note = {A = 1 GHz}
+}
+@Article{ Bar2001JMS , mol1={Ne}, mol2={OH}, lit_type={IR}, year={2001}}
+@comment{ignored}
+@misc{NoDimer2002, year = {2002}}
+% questions to someone@example.org
+Contact: someone@example.org
+@article{Baz2003JCP,
+  mol1 = {Ar}, mol2 = {Kr}, littype = {Theory}, year = {2003}}
+@article(Qux2004JCP, mol1 = {Ne}, mol2 = {Kr}, littype = {IR}, year = 2004)
+@article{mol1 = {Ar}, year = {2005}}
+@article{Open2006JCP, mol1 = {Ar},
+@article{Last2007JCP, mol1 = {Xe}, mol2 = {Kr}, littype = {IR}, year = {2007}}
+@article{Cut2008JCP, mol1 = {Xe},
+'''
+    csv = '''mol1,mol2,lit_type,year,bibkey,note
+Ar,H2O,Microwave,2000,Foo2000JCP,duplicate
+Kr,OH,Theory,1999,Baz1999JPC,"B, C"
+Kr,OH,Unknown,1999,Baz1999JPC,
+'''
+
+    def test(self):
+
+        print('\nTest bulk import')
+
+        self.assertEqual(list(mylib.parse_bibtex(io.StringIO(self.bib))), [
+            ('Ar', 'H2O', 'Microwave', '2000', 'Foo2000JCP', 'A = 1 GHz'),
+            ('Ne', 'OH', 'IR', '2001', 'Bar2001JMS', ''),
+            ('', '', '', '2002', 'NoDimer2002', ''),
+            ('Ar', 'Kr', 'Theory', '2003', 'Baz2003JCP', ''),
+            ('Ne', 'Kr', 'IR', '2004', 'Qux2004JCP', ''),
+            ('', '', '', '', '', ''),
+            ('', '', '', '', '', ''),
+            ('Xe', 'Kr', 'IR', '2007', 'Last2007JCP', ''),
+            ('', '', '', '', '', '')])
+        self.assertEqual(list(mylib.parse_csv(io.StringIO(self.csv)))[1], ('Kr', 'OH', 'Theory', '1999', 'Baz1999JPC', 'B, C'))
 
+        conn = sqlite3.connect(':memory:')
+        mylib.migrate(conn)
+        lit_types = ['Microwave', '(sub)mm', 'IR', 'Theory']
+        stats = mylib.import_records(conn.cursor(), mylib.parse_bibtex(io.StringIO(self.bib)), lit_types)
+        self.assertEqual((stats['inserted'], stats['skipped'], stats['invalid']), (5, 0, 4))
+        stats = mylib.import_records(conn.cursor(), mylib.parse_csv(io.StringIO(self.csv)), lit_types)
+        self.assertEqual((stats['inserted'], stats['skipped'], stats['invalid']), (1, 1, 1))
+        self.assertEqual(conn.execute("SELECT count(*) FROM lit").fetchone()[0], 6)
+        conn.close()
 
 
 if __name__ == '__main__':